@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+import sys
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import benchmark
+
+packer = benchmark.packer
+
+
+@pytest.fixture
+def apk(tmp_path):
+    # small synthetic apk with a fake v2 block and a channel payload
+    return benchmark.makeApk(str(tmp_path / 'app.apk'), 0x20000, 16,
+                             channel='base')
+
+
+@pytest.fixture
+def variants(apk, tmp_path):
+    # channel variants of apk, written by writeValues()
+    paths = []
+    for channel in ('google', 'huawei', 'xiaomi'):
+        path = str(tmp_path / 'app-{}.apk'.format(channel))
+        packer.writeValues(apk, {packer.PLUGIN_CHANNEL_KEY: channel}, path)
+        paths.append(path)
+    return paths
+
+
+def makeConfig(language='', country='', density=0):
+    # 64 byte ResTable_config with a locale and a density
+    config = bytearray(64)
+    struct.pack_into('<I', config, 0, len(config))
+    config[8:10] = language.encode('ascii').ljust(2, b'\0')
+    config[10:12] = country.encode('ascii').ljust(2, b'\0')
+    struct.pack_into('<H', config, 14, density)
+    return bytes(config)
+
+
+def makeTypeChunk(typeId, config, entries, count, flags=0):
+    '''
+    ResTable_type chunk, entries maps an entry index to (type, data),
+    ('compact', type, data) or 'bag', flags 1 is sparse, 2 offset16
+    '''
+    body = b''
+    offsets = {}
+    for i in sorted(entries):
+        entry = entries[i]
+        offsets[i] = len(body)
+        if entry == 'bag':
+            body += struct.pack('<HHIII', 16, 1, i, 0, 0)
+        elif entry[0] == 'compact':
+            body += struct.pack('<HHI', i, 0x8 | entry[1] << 8, entry[2])
+        else:
+            body += struct.pack('<HHIHBBI', 8, 0, i, 8, 0, *entry)
+    if flags & 1:
+        table = b''.join(struct.pack('<HH', i, offsets[i] // 4)
+                         for i in sorted(offsets))
+        count = len(offsets)
+    elif flags & 2:
+        table = b''.join(struct.pack('<H', offsets[i] // 4
+                                     if i in offsets else 0xffff)
+                         for i in range(count))
+        table += b'\0' * (-len(table) % 4)
+    else:
+        table = b''.join(struct.pack('<I', offsets.get(i, 0xffffffff))
+                         for i in range(count))
+    headerSize = 20 + len(config)
+    start = headerSize + len(table)
+    return struct.pack('<HHIBBHII', 0x0201, headerSize, start + len(body),
+                       typeId, flags, 0, count, start) + \
+        config + table + body
+
+
+def makeResources(strings, chunks, packageId=0x7f,
+                  package='com.mcxiaoke.benchmark'):
+    # resources.arsc with a global string pool and one package
+    typePool = benchmark.makeStringPool(['string', 'integer', 'bool'])
+    keyPool = benchmark.makeStringPool(['k'])
+    body = typePool + keyPool + b''.join(chunks)
+    header = struct.pack('<HHII', 0x0200, 288, 288 + len(body), packageId)
+    header += package.encode('utf-16-le').ljust(256, b'\0')
+    header += struct.pack('<IIIII', 288, 3, 288 + len(typePool), 1, 0)
+    content = benchmark.makeStringPool(strings) + header + body
+    return struct.pack('<HHII', 0x0002, 12, 12 + len(content), 1) + content
+
+
+# @string/app_name, @string/version, @string/alias -> app_name
+STRINGS = ['Demo', '2.0-beta', u'演示', '2.0-zh', 'Dense']
+RESOURCES = makeResources(STRINGS, [
+    makeTypeChunk(1, makeConfig(), {0: (3, 0), 1: (3, 1),
+                                    2: (1, 0x7f010000)}, 3),
+    makeTypeChunk(1, makeConfig(density=480), {0: (3, 4)}, 3),
+    makeTypeChunk(1, makeConfig('zh', 'CN'), {0: (3, 2)}, 3),
+    makeTypeChunk(1, makeConfig('zh'), {1: (3, 3)}, 3),
+    makeTypeChunk(2, makeConfig(), {7: (0x10, 42), 100: (3, 0), 3: 'bag'},
+                  0, flags=1),
+    makeTypeChunk(3, makeConfig(), {1: ('compact', 0x12, 1)}, 4, flags=2),
+])
+
+
+def makeResourceApk(path, stored=True, resources=RESOURCES):
+    # apk whose label and versionName reference resources.arsc
+    manifest = benchmark.makeManifest('com.mcxiaoke.benchmark', 7,
+                                      0x7f010001, label=0x7f010002)
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('AndroidManifest.xml', manifest, zipfile.ZIP_DEFLATED)
+        z.writestr('resources.arsc', resources,
+                   zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+    return path
+
+
+@pytest.fixture(params=[True, False], ids=['stored', 'deflated'])
+def resourceApk(request, tmp_path):
+    return makeResourceApk(str(tmp_path / 'res.apk'), request.param)
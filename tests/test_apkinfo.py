@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import apkinfo
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_path_and_raw_agree(apk):
+    with apkinfo.APK(apk) as a:
+        expected = (a.get_package(), a.get_version_name(),
+                    a.get_target_sdk_version())
+    b = apkinfo.APK(read(apk), raw=True)
+    assert (b.get_package(), b.get_version_name(),
+            b.get_target_sdk_version()) == expected
+    assert b.get_raw() == read(apk)
+
+
+@pytest.mark.parametrize('mode', ['w', 'a', 'x'])
+def test_write_modes_are_rejected(apk, mode):
+    data = read(apk)
+    with pytest.raises(ValueError):
+        apkinfo.APK(apk, mode=mode)
+    assert read(apk) == data
+
+
+def test_close_releases_zip(apk):
+    a = apkinfo.APK(apk)
+    a.close()
+    assert a.zip.fp is None
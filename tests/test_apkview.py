@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from conftest import packer
+
+
+def test_slices_are_views(apk):
+    with open(apk, 'rb') as f:
+        data = f.read()
+    with packer.ApkView(apk) as v:
+        sections = v.sections
+        block = v.findSigningBlock()
+        cd = v.centralDirectory()
+        assert isinstance(block, memoryview)
+        assert isinstance(cd, memoryview)
+        assert cd.tobytes() == data[sections.cdStartOffset:
+                                     sections.cdStartOffset +
+                                     sections.cdSizeBytes]
+        assert v.findSigningBlockOffset() + len(block) == \
+            sections.cdStartOffset
+        assert v.findSigningBlockByMagic().tobytes() == block.tobytes()
+        assert bytes(v.eocd()) == data[sections.eocdOffset:]
+        del block, cd
+
+
+def test_close_releases_map(apk):
+    v = packer.ApkView(apk)
+    v.sections
+    v.close()
+    assert v.mm is None and v.view is None
+    v.close()
+
+
+def test_close_on_error(apk):
+    with pytest.raises(RuntimeError):
+        with packer.ApkView(apk) as v:
+            raise RuntimeError()
+    assert v.mm is None
+
+
+def test_too_small(tmp_path):
+    path = tmp_path / 'empty.apk'
+    path.write_bytes(b'PK')
+    with pytest.raises(packer.ZipFormatException):
+        packer.ApkView(str(path))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import packer
+
+
+def test_lookup(apk):
+    result = asyncio.run(packer.AsyncLookup().lookup(apk))
+    assert result['error'] is None
+    assert result['channel'] == 'base'
+    assert result['values']['padding'] == 'p' * 64
+    assert result['package'] == 'com.mcxiaoke.benchmark'
+    assert result['version_code'] == '100'
+    assert result['version_name'] == '1.0.0'
+
+
+def test_lookup_all_in_order(apk, variants, tmp_path):
+    missing = str(tmp_path / 'missing.apk')
+    lookup = packer.AsyncLookup(limit=2, info=False)
+    results = asyncio.run(lookup.lookupAll(variants + [missing]))
+    assert [r['channel'] for r in results] == \
+        ['google', 'huawei', 'xiaomi', None]
+    assert results[0]['package'] is None
+    assert results[-1]['error'].startswith('FileNotFoundError')
+    assert asyncio.run(lookup.getChannel(apk)) == 'base'
+
+
+def test_limit(monkeypatch):
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def lookupApk(apk, info):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return {'path': apk}
+
+    monkeypatch.setattr(packer, 'lookupApk', lookupApk)
+    lookup = packer.AsyncLookup(limit=3)
+    results = asyncio.run(lookup.lookupAll([str(i) for i in range(12)]))
+    assert [r['path'] for r in results] == [str(i) for i in range(12)]
+    assert running[1] == 3
+    # a new event loop gets its own semaphore
+    assert len(asyncio.run(lookup.lookupAll(['a', 'b']))) == 2
+
+
+def test_bad_limit():
+    with pytest.raises(ValueError):
+        packer.AsyncLookup(limit=0)
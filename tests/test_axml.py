@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import io
+
+import pytest
+
+import apkinfo
+import benchmark
+
+NS = 'http://schemas.android.com/apk/res/android'
+MANIFEST = benchmark.makeManifest('com.example', 7, 'v1', activities=3,
+                                  permissions=2)
+
+
+def test_events():
+    events = list(apkinfo.AXMLParser(MANIFEST))
+    starts = [e for e in events if isinstance(e, apkinfo.AXMLStartTag)]
+    ends = [e for e in events if isinstance(e, apkinfo.AXMLEndTag)]
+    assert [e.name for e in starts] == [
+        'manifest', 'uses-sdk', 'uses-permission', 'uses-permission',
+        'application', 'activity', 'activity', 'activity']
+    assert [e.name for e in ends][-2:] == ['application', 'manifest']
+    assert len(starts) == len(ends)
+    manifest = starts[0]
+    assert manifest.namespaces == [('android', NS)]
+    attributes = dict((a.name, a) for a in manifest.attributes)
+    assert attributes['package'].value == 'com.example'
+    assert attributes['package'].uri == ''
+    code = attributes['versionCode']
+    assert (code.prefix, code.uri, code.value) == ('android', NS, '7')
+    assert (code.type, code.data) == (apkinfo.TYPE_INT_DEC, 7)
+
+
+def test_invalid_has_no_events():
+    assert list(apkinfo.AXMLParser(b'\0' * 64)) == []
+
+
+def test_printer_sink():
+    text = apkinfo.AXMLPrinter(MANIFEST).get_buff().decode('utf-8')
+    sink = io.StringIO()
+    printer = apkinfo.AXMLPrinter(MANIFEST, sink)
+    assert sink.getvalue() == text
+    assert text.startswith(u'<?xml version="1.0" encoding="utf-8"?>\n'
+                           u'<manifest\nxmlns:android="{}"\n'.format(NS))
+    assert u'android:name="com.example.Activity2"' in text
+    with pytest.raises(ValueError):
+        printer.get_buff()
+
+
+def test_printer_escapes():
+    manifest = benchmark.makeManifest('com.example', 7, 'a<"&\'>b',
+                                      activities=0, permissions=0)
+    text = apkinfo.AXMLPrinter(manifest).get_buff().decode('utf-8')
+    assert u'a<' not in text and u'"&\'' not in text
+    # still well-formed
+    dom = apkinfo.AXMLPrinter(manifest).get_xml_obj()
+    assert dom.documentElement.getAttribute('package') == 'com.example'
+
+
+def test_build_tree():
+    root = apkinfo.build_tree(MANIFEST)
+    assert root.tag == 'manifest'
+    assert root.get('package') == 'com.example'
+    assert root.get('{%s}versionCode' % NS) == '7'
+    application = root.find('application')
+    assert application.get('{%s}label' % NS) == 'Benchmark'
+    assert [a.get('{%s}name' % NS) for a in application] == [
+        'com.example.Activity0', 'com.example.Activity1',
+        'com.example.Activity2']
+
+
+def test_build_tree_custom_builder():
+    calls = []
+
+    class Builder(object):
+        def start(self, tag, attrs):
+            calls.append(('start', tag))
+
+        def end(self, tag):
+            calls.append(('end', tag))
+
+        def data(self, text):
+            calls.append(('data', text))
+
+        def close(self):
+            return len(calls)
+
+    assert apkinfo.build_tree(MANIFEST, Builder()) == 16
+    assert calls[0] == ('start', 'manifest')
+    assert calls[-1] == ('end', 'manifest')
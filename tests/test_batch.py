@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+
+from conftest import packer
+
+
+def byPath(results):
+    return dict((r['path'], r) for r in results)
+
+
+def test_batch_reads_directory_with_pool(variants, tmp_path):
+    results = byPath(packer.batchChannels([str(tmp_path)], jobs=2))
+    assert sorted(results) == sorted(variants + [str(tmp_path / 'app.apk')])
+    assert [results[p]['channel'] for p in variants] == \
+        ['google', 'huawei', 'xiaomi']
+    assert all(r['error'] is None for r in results.values())
+
+
+def test_batch_reports_bad_files_and_goes_on(variants, tmp_path):
+    bad = tmp_path / 'bad.apk'
+    bad.write_bytes(b'not a zip file')
+    results = byPath(packer.batchChannels([str(bad)] + variants, jobs=1))
+    assert results[str(bad)]['error']
+    assert results[variants[2]]['channel'] == 'xiaomi'
+
+
+def test_list_file_sources(variants, tmp_path):
+    listing = tmp_path / 'apks.txt'
+    listing.write_text(u'# release\n{}\n\n{}\n'.format(*variants[:2]))
+    assert list(packer.findApks(['@' + str(listing)])) == variants[:2]
+
+
+def test_write_results_csv(variants):
+    out = io.StringIO()
+    errors = packer.writeResults(packer.batchChannels(variants, jobs=1),
+                                 out, 'csv')
+    lines = out.getvalue().splitlines()
+    assert errors == 0
+    assert lines[0] == ','.join(packer.BATCH_FIELDS)
+    assert len(lines) == 4
+    assert any(os.path.basename(variants[0]) in l and ',google,' in l
+               for l in lines)
+
+
+def test_batch_info_columns(variants):
+    results = list(packer.batchChannels(variants, jobs=1, info=True))
+    assert set(r['package'] for r in results) == {'com.mcxiaoke.benchmark'}
+    assert set(r['version_name'] for r in results) == {'1.0.0'}
+    assert set(r['label'] for r in results) == {'Benchmark'}
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+import zipfile
+
+import benchmark
+from conftest import packer
+
+V2 = packer.APK_SIGNATURE_SCHEME_V2_BLOCK_ID
+
+
+def test_make_apk(tmp_path):
+    path = benchmark.makeApk(str(tmp_path / 'a.apk'), 0x40000, 8,
+                             commentSize=100, blockSize=0x800,
+                             payloadSize=32, channel='bench')
+    with zipfile.ZipFile(path) as z:
+        assert z.testzip() is None
+        assert len(z.infolist()) == 9
+        assert z.comment == b'c' * 100
+    assert abs(os.path.getsize(path) - 0x40000) < 0x2000
+    assert len(packer.findBlocks(path)[V2]) == 0x800
+    assert packer.getValues(path) == {packer.PLUGIN_CHANNEL_KEY: 'bench',
+                                      'padding': 'p' * 32}
+
+
+def test_make_apk_is_reproducible(tmp_path):
+    a = benchmark.makeApk(str(tmp_path / 'a.apk'), 0x10000, 4, blockSize=0)
+    b = benchmark.makeApk(str(tmp_path / 'b.apk'), 0x10000, 4, blockSize=0)
+    with zipfile.ZipFile(a) as za, zipfile.ZipFile(b) as zb:
+        assert [i.CRC for i in za.infolist()] == \
+            [i.CRC for i in zb.infolist()]
+
+
+def test_measure():
+    calls = []
+    result = benchmark.measure(lambda: calls.append(1), minTime=0,
+                               maxRounds=20)
+    assert result['rounds'] == benchmark.MIN_ROUNDS
+    assert len(calls) == benchmark.MIN_ROUNDS + 1
+    assert result['p50_us'] <= result['p99_us'] <= result['max_us']
+
+
+def test_benchmarks_run(apk):
+    benchmarks = benchmark.makeBenchmarks(apk)
+    assert sorted(benchmarks) == sorted(benchmark.BENCHMARKS)
+    for func in benchmarks.values():
+        func()
+
+
+def allocate(size):
+    data = bytearray(size)
+    return {'size': len(data)}
+
+
+def test_run_isolated(apk):
+    result, rss = benchmark.runIsolated(
+        benchmark.runBenchmark, apk, 'getChannel', 0)
+    assert result['rounds'] >= benchmark.MIN_ROUNDS
+    assert rss is None or rss > 0
+
+
+def test_run_isolated_rss_is_its_own():
+    # a large parent does not show up in the child's peak rss
+    ballast = b'x' * (200 << 20)
+    try:
+        _, baseline = benchmark.runIsolated(benchmark.idle)
+        result, rss = benchmark.runIsolated(allocate, 64 << 20)
+    finally:
+        del ballast
+    assert result == {'size': 64 << 20}
+    if baseline is not None:
+        assert baseline < 100 << 10
+        assert 60 << 10 < rss - baseline < 100 << 10
+
+
+def test_run_isolated_error():
+    result, _ = benchmark.runIsolated(allocate, -1)
+    assert result['error'].startswith('ValueError')
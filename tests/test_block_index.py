@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import struct
+
+import pytest
+
+from conftest import packer
+
+V2 = packer.APK_SIGNATURE_SCHEME_V2_BLOCK_ID
+PLUGIN = packer.PLUGIN_BLOCK_ID
+PAIRS = [(V2, b'v2' * 10), (0x42726577, b''), (0x1234, b'custom'),
+         (0x1234, b'second')]
+
+
+def test_index():
+    block = packer.makeApkSigningBlock(PAIRS)
+    index = packer.SigningBlockIndex(block, 1000)
+    assert len(index) == 4
+    assert [e.id for e in index] == [sid for sid, _ in PAIRS]
+    assert isinstance(index[V2], memoryview)
+    assert index[V2].tobytes() == b'v2' * 10
+    assert index.get(0x42726577).tobytes() == b''
+    # the first entry wins
+    assert index[0x1234].tobytes() == b'custom'
+    assert 0x1234 in index and PLUGIN not in index
+    assert index.get(PLUGIN, 'none') == 'none'
+    assert index.entry(PLUGIN) is None
+    entry = index.entry(0x1234)
+    assert block[entry.offset:entry.offset + entry.length] == b'custom'
+    assert index.fileOffset(0x1234) == 1000 + entry.offset
+    assert index.copy([V2, PLUGIN]) == {V2: b'v2' * 10}
+    assert packer.findIdValues(block)[3][1].tobytes() == b'second'
+
+
+@pytest.mark.parametrize('entry', [
+    struct.pack('<Q', 3) + b'abc',
+    struct.pack('<Q', 1000) + b'abcd',
+    b'\0' * 4,
+])
+def test_bad_entries(entry):
+    block = packer.wrapApkSigningBlock(entry)
+    with pytest.raises(packer.SignatureNotFoundException):
+        packer.SigningBlockIndex(block)
+
+
+def test_find_blocks(apk):
+    blocks = packer.findBlocks(apk)
+    assert sorted(blocks) == [V2, PLUGIN]
+    assert isinstance(blocks[PLUGIN], bytes)
+    values = packer.parseValues(blocks[PLUGIN])
+    assert values[packer.PLUGIN_CHANNEL_KEY] == 'base'
+    assert packer.findBlocks(apk, [PLUGIN]) == {PLUGIN: blocks[PLUGIN]}
+
+
+def test_view_index_offsets(apk):
+    with open(apk, 'rb') as f:
+        data = f.read()
+    with packer.ApkView(apk) as v:
+        index = v.blockIndex()
+        assert v.blockIndex() is index
+        offset = index.fileOffset(PLUGIN)
+        value = index[PLUGIN].tobytes()
+        assert data[offset:offset + len(value)] == value
+        del value
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import mmap
+import struct
+
+import apkinfo
+import bytedecoder
+from bytedecoder import ByteDecoder
+
+DATA = struct.pack('<hHiIqQfd', -2, 0xfffe, -3, 0xfffffffd, -4,
+                   0xfffffffffffffffc, 1.5, -2.25) + b'magic'
+
+
+def check(d, offset=0):
+    assert d.getShort(offset) == -2
+    assert d.getUShort(offset + 2) == 0xfffe
+    assert d.getInt(offset + 4) == -3
+    assert d.getUInt(offset + 8) == 0xfffffffd
+    assert d.getLong(offset + 12) == -4
+    assert d.getULong(offset + 20) == 0xfffffffffffffffc
+    assert d.getFloat(offset + 28) == 1.5
+    assert d.getDouble(offset + 32) == -2.25
+    assert b''.join(d.getChars(offset + 40, 5)) == b'magic'
+
+
+def test_buffers(tmp_path):
+    check(ByteDecoder(DATA))
+    check(ByteDecoder(memoryview(b'\0' * 8 + DATA)[8:]))
+    check(ByteDecoder(bytearray(b'\0' * 3 + DATA)), 3)
+    path = tmp_path / 'data'
+    path.write_bytes(DATA)
+    with open(str(path), 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            check(ByteDecoder(mm))
+        finally:
+            mm.close()
+
+
+def test_big_endian():
+    d = ByteDecoder(struct.pack('>hIq', -2, 7, -4), littleEndian=False)
+    assert (d.getShort(), d.getUInt(2), d.getLong(6)) == (-2, 7, -4)
+    assert bytedecoder.chars(4, '>') is bytedecoder.chars(4, '>')
+
+
+def test_buff_handle():
+    buff = apkinfo.BuffHandle(struct.pack('<Ii2I', 1, -1, 2, 3) + b'tail')
+    assert buff.read_uint32() == 1
+    assert buff.read_int32() == -1
+    assert buff.unpack(bytedecoder.UINT32_PAIR) == (2, 3)
+    assert buff.get_idx() == 16
+    assert bytes(buff.read_view(4)) == b'tail'
+    assert buff.end()
+    buff.set_idx(8)
+    assert list(buff.read_array('I', 2)) == [2, 3]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import struct
+import zipfile
+
+import pytest
+
+from conftest import packer
+
+
+def makeZip(path, comment=b''):
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('a.txt', b'a' * 100)
+        z.writestr('b.txt', b'b' * 100)
+        z.comment = comment
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def toZip64(data):
+    # move the central directory fields into a zip64 eocd record
+    eocdOffset = data.rindex(b'PK\x05\x06')
+    eocd = data[eocdOffset:]
+    count, cdSize, cdOffset = struct.unpack_from('<HII', eocd, 10)
+    record = struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0,
+                         count, count, cdSize, cdOffset)
+    locator = struct.pack('<IIQI', 0x07064b50, 0, eocdOffset, 1)
+    eocd = eocd[:8] + struct.pack('<HHII', 0xffff, 0xffff, 0xffffffff,
+                                  0xffffffff) + eocd[20:]
+    return data[:eocdOffset] + record + locator + eocd
+
+
+@pytest.mark.parametrize('comment', [
+    b'', b'x' * 1000, b'PK\x05\x06' + b'\0' * 30, b'c' * 0xffff])
+def test_eocd_with_comment(tmp_path, comment):
+    path = str(tmp_path / 'a.zip')
+    data = makeZip(path, comment)
+    sections = packer.findZipSections(data)
+    assert sections.eocdOffset == len(data) - 22 - len(comment)
+    assert sections.cdRecordCount == 2
+    assert sections.zip64EocdOffset is None
+    assert packer.findEocdStartOffset(data) == sections.eocdOffset
+
+
+def test_eocd_not_found():
+    assert packer.findEocdStartOffset(b'\0' * 100) == -1
+    with pytest.raises(packer.ZipFormatException):
+        packer.findZipSections(b'\0' * 100)
+
+
+def test_zip64(tmp_path):
+    path = str(tmp_path / 'a.zip')
+    plain = packer.findZipSections(makeZip(path))
+    data = toZip64(open(path, 'rb').read())
+    sections = packer.findZipSections(data)
+    assert sections.zip64EocdOffset == plain.eocdOffset
+    assert sections.eocdOffset == plain.eocdOffset + 76
+    assert (sections.cdStartOffset, sections.cdSizeBytes,
+            sections.cdRecordCount) == (plain.cdStartOffset,
+                                        plain.cdSizeBytes, 2)
+    assert sections.cdFollowerOffset() == plain.eocdOffset
+
+
+def test_zip64_bad_record(tmp_path):
+    path = str(tmp_path / 'a.zip')
+    makeZip(path)
+    data = bytearray(toZip64(open(path, 'rb').read()))
+    data[data.index(b'PK\x06\x06')] = 0
+    with pytest.raises(packer.ZipFormatException):
+        packer.findZipSections(bytes(data))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from conftest import packer
+
+V2 = packer.APK_SIGNATURE_SCHEME_V2_BLOCK_ID
+
+
+def test_read_channels_list():
+    assert packer.readChannels(' a, b ,a,,c/d ') == ['a', 'b', 'c_d']
+
+
+def test_read_channels_file(tmp_path):
+    markets = tmp_path / 'markets.txt'
+    markets.write_text(u'google#Google Play\n\nhuawei\n华为 # huawei cn\n'
+                       u'google\n', encoding='utf-8')
+    assert packer.readChannels('@' + str(markets)) == [
+        'google', 'huawei', u'华为']
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_generate_channels(apk, tmp_path, jobs):
+    output = str(tmp_path / 'output')
+    channels = ['google', 'huawei', u'小米']
+    results = list(packer.generateChannels(apk, channels, output, jobs))
+    assert sorted(r[0] for r in results) == sorted(channels)
+    for channel, path, error, ms in results:
+        assert error is None
+        assert os.path.basename(path) == u'app-{}.apk'.format(channel)
+        assert packer.getChannel(path) == channel
+        assert packer.findBlocks(path)[V2] == packer.findBlocks(apk)[V2]
+    assert packer.getChannel(apk) == 'base'
+
+
+def test_generate_main(apk, tmp_path, capsys):
+    output = str(tmp_path / 'output')
+    assert packer.generateMain('packer', [
+        apk, '-c', 'a,b', '-o', output, '-j', '1']) == 0
+    assert sorted(os.listdir(output)) == ['app-a.apk', 'app-b.apk']
+    assert 'Generated 2 of 2' in capsys.readouterr().out
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import benchmark
+from conftest import packer
+
+
+def serve(apk, contentRange=True, headLength=True):
+    # local server answering suffix ranges with 206, optionally without
+    # a total length in Content-Range or Content-Length on HEAD
+    with open(apk, 'rb') as f:
+        data = f.read()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            server.requests.append('HEAD')
+            self.send_response(200)
+            if headLength:
+                self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+
+        def do_GET(self):
+            server.requests.append('GET')
+            spec = self.headers['Range'][len('bytes='):]
+            start, end = spec.split('-')
+            if not start:
+                start, end = len(data) - int(end), len(data) - 1
+            start, end = int(start), min(int(end), len(data) - 1)
+            body = data[start:end + 1]
+            self.send_response(206)
+            if contentRange:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, end, len(data)))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{}/app.apk'.format(server.server_port)
+
+
+@pytest.mark.parametrize('contentRange', [True, False])
+def test_channel_over_http(variants, contentRange):
+    server, url = serve(variants[0], contentRange=contentRange)
+    try:
+        assert packer.getChannel(url) == 'google'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_range_response_without_total_length(variants):
+    server, url = serve(variants[0], contentRange=False, headLength=False)
+    try:
+        with pytest.raises(IOError) as e:
+            packer.HttpSource(url).readTail(1024)
+        assert 'lacks a total length' in str(e.value)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize('entries, blockSize, reads', [
+    # tail holds eocd, central directory and signing block
+    (32, 0x1000, 1),
+    # signing block larger than the tail
+    (32, 0x40000, 2),
+    # central directory larger than the tail, the block is read with
+    # its footer if it fits in one read
+    (3000, 0x1000, 2),
+    (3000, 0x40000, 3),
+])
+def test_remote_lookup_reads(tmp_path, entries, blockSize, reads):
+    apk = benchmark.makeApk(str(tmp_path / 'app.apk'), 0x400000, entries,
+                            blockSize=blockSize, channel='google')
+    server, url = serve(apk)
+    try:
+        with packer.openSource(url) as source:
+            values = packer.getSourceValues(source)
+            assert values[packer.PLUGIN_CHANNEL_KEY] == 'google'
+            assert source.reads == reads
+        assert server.requests == ['GET'] * reads
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_byte_source_is_abstract():
+    with pytest.raises(TypeError):
+        packer.ByteSource()
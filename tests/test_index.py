@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from conftest import packer
+
+
+def refresh(index, sources):
+    return list(packer.batchChannels(sources, jobs=1, index=index))
+
+
+def test_find_returns_absolute_paths(variants, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    with packer.ChannelIndex(str(tmp_path / 'index.db')) as index:
+        results = refresh(index, [os.path.basename(p) for p in variants])
+        assert sorted(r['path'] for r in results) == sorted(variants)
+        assert index.find('huawei') == [variants[1]]
+
+
+def test_prune_from_other_directory_keeps_entries(variants, tmp_path,
+                                                  monkeypatch):
+    db = str(tmp_path / 'index.db')
+    monkeypatch.chdir(str(tmp_path))
+    with packer.ChannelIndex(db) as index:
+        refresh(index, ['app-*.apk'])
+    other = tmp_path / 'other'
+    other.mkdir()
+    monkeypatch.chdir(str(other))
+    with packer.ChannelIndex(db) as index:
+        assert index.prune() == 0
+        assert index.find('google') == [variants[0]]
+        os.remove(variants[0])
+        assert index.prune() == 1
+        assert index.find('google') == []
+
+
+def test_second_refresh_hits_index(variants, tmp_path):
+    stats = packer.enableStats()
+    try:
+        with packer.ChannelIndex(str(tmp_path / 'index.db')) as index:
+            first = refresh(index, variants)
+            assert stats.counters['index_hits'] == 0
+            second = refresh(index, variants)
+            assert stats.counters['index_hits'] == 3
+    finally:
+        packer.disableStats()
+    key = lambda r: r['path']
+    assert [r['channel'] for r in sorted(second, key=key)] == \
+        [r['channel'] for r in sorted(first, key=key)] == \
+        ['google', 'huawei', 'xiaomi']
+
+
+def test_hits_do_not_write(variants, tmp_path):
+    with packer.ChannelIndex(str(tmp_path / 'index.db')) as index:
+        assert packer.getChannel(variants[0], index) == 'google'
+        assert not index.db.in_transaction
+        stats = packer.enableStats()
+        try:
+            for _ in range(3):
+                assert packer.getChannel(variants[0], index) == 'google'
+        finally:
+            packer.disableStats()
+        assert stats.counters['index_hits'] == 3
+        assert not index.db.in_transaction
+        assert list(index.touched) == [tuple(packer.fileKey(variants[0])[:2])]
+        index.commit()
+        assert index.touched == {}
+
+
+def atimes(index):
+    return dict(index.db.execute('SELECT path, atime FROM channels'))
+
+
+def test_eviction_drops_least_recently_used(variants, tmp_path):
+    google, huawei, xiaomi = variants
+    with packer.ChannelIndex(str(tmp_path / 'index.db'), 2) as index:
+        packer.getChannel(google, index)
+        time.sleep(0.01)
+        packer.getChannel(huawei, index)
+        time.sleep(0.01)
+        # a hit makes google the most recently used once committed
+        packer.getChannel(google, index)
+        index.commit()
+        assert atimes(index)[google] > atimes(index)[huawei]
+        time.sleep(0.01)
+        # a new entry goes over the cap, getValues() evicts on its own
+        packer.getChannel(xiaomi, index)
+        assert sorted(atimes(index)) == sorted([google, xiaomi])
+        assert index.find('huawei') == []
+
+
+def test_batch_applies_cap(variants, tmp_path):
+    with packer.ChannelIndex(str(tmp_path / 'index.db'), 2) as index:
+        refresh(index, variants)
+        assert len(atimes(index)) == 2
+        assert index.evict() == 0
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+
+import benchmark
+from conftest import packer
+
+
+def sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def flipBit(path, offset=200):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        b = f.read(1)
+        f.seek(offset)
+        f.write(bytes(bytearray([b[0] ^ 1])))
+
+
+def test_prefix_is_reused_by_default(apk, variants):
+    results = list(packer.digestChannels(apk, variants, ('sha256', 'md5')))
+    assert all(r['shared'] and not r['error'] for r in results)
+    assert [r['sha256'] for r in results] == [sha256(p) for p in variants]
+
+
+def test_other_layout_is_hashed_in_full(apk, tmp_path):
+    other = benchmark.makeApk(str(tmp_path / 'other.apk'), 0x20000, 16,
+                              channel='base', seed=2)
+    results = list(packer.digestChannels(apk, [apk, other], ('sha256',)))
+    assert [r['shared'] for r in results] == [True, False]
+    assert results[1]['sha256'] == sha256(other)
+
+
+def test_full(apk, variants):
+    flipBit(variants[1])
+    results = list(packer.digestChannels(apk, variants, ('sha256',),
+                                         full=True))
+    assert [r['sha256'] for r in results] == [sha256(p) for p in variants]
+    assert not any(r['shared'] or r['error'] for r in results)
+
+
+def test_manifest_main(apk, variants, tmp_path):
+    output = str(tmp_path / 'manifest.json')
+    assert packer.manifestMain('packer', variants + [
+        '-b', apk, '-a', 'sha256', '-o', output]) == 0
+    with open(output) as f:
+        results = [json.loads(line) for line in f]
+    assert all(r['shared'] for r in results)
+    assert packer.manifestMain('packer', variants + [
+        '-b', apk, '-a', 'sha256', '-o', output, '--full']) == 0
+    with open(output) as f:
+        assert not any(json.loads(line)['shared'] for line in f)
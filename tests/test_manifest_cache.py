@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+
+import apkinfo
+
+
+def fields(apk, cache):
+    with apkinfo.APK(apk, cache=cache) as a:
+        return (a.get_package(), a.get_version_code(), a.get_version_name(),
+                a.get_min_sdk_version(), len(a.get_permissions()))
+
+
+def test_cached_fields_match_parsed(variants):
+    cache = apkinfo.ManifestCache()
+    expected = fields(variants[0], None)
+    assert expected == ('com.mcxiaoke.benchmark', '100', '1.0.0', '16', 8)
+    assert [fields(p, cache) for p in variants] == [expected] * 3
+    # all variants share one manifest
+    assert len(cache) == 1
+
+
+def test_files_crc32(apk):
+    import zipfile
+    with apkinfo.APK(apk) as a:
+        crcs = a.files_crc32
+    with zipfile.ZipFile(apk) as z:
+        assert crcs == dict((i.filename, i.CRC) for i in z.infolist())
+
+
+def test_disk_cache_survives_reopen(variants, tmp_path):
+    db = str(tmp_path / 'manifests.db')
+    with apkinfo.ManifestCache(db) as cache:
+        expected = fields(variants[0], cache)
+    with apkinfo.ManifestCache(db) as cache:
+        assert len(cache) == 0
+        assert fields(variants[1], cache) == expected
+        assert len(cache) == 1
+
+
+def test_cache_shared_by_threads(variants, tmp_path):
+    expected = fields(variants[0], None)
+    with apkinfo.ManifestCache(str(tmp_path / 'manifests.db'),
+                               max_size=1) as cache:
+        # a second key keeps the single memory slot churning
+        cache.put((1, 1), {'package': 'other', 'permissions': []})
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(
+                lambda i: fields(variants[i % 3], cache) if i % 2
+                else cache.get((1, 1))['package'], range(200)))
+    assert results == [expected if i % 2 else 'other' for i in range(200)]
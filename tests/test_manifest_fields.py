@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import apkinfo
+import benchmark
+
+MANIFEST = benchmark.makeManifest('com.example', 7, 'v1', activities=2,
+                                  permissions=3)
+# offset of the second start tag chunk, <uses-sdk>
+START_TAG = b'\x02\x01\x10\x00'
+USES_SDK = MANIFEST.index(START_TAG, MANIFEST.index(START_TAG) + 1)
+
+
+def test_fields():
+    assert apkinfo.parse_manifest(MANIFEST) == {
+        'package': 'com.example', 'versionCode': '7', 'versionName': 'v1'}
+
+
+def test_optional_fields():
+    fields = apkinfo.parse_manifest(MANIFEST, sdk=True, permissions=True,
+                                    application=True)
+    assert fields['minSdkVersion'] == '16'
+    assert fields['targetSdkVersion'] == '28'
+    assert fields['permissions'] == [
+        'android.permission.P0', 'android.permission.P1',
+        'android.permission.P2']
+    assert fields['label'] == 'Benchmark'
+
+
+def test_stops_at_manifest_tag():
+    # nothing after <manifest> is needed for the default fields
+    assert apkinfo.parse_manifest(MANIFEST[:USES_SDK]) == \
+        apkinfo.parse_manifest(MANIFEST)
+
+
+def test_same_as_dom():
+    dom = apkinfo.AXMLPrinter(MANIFEST).get_xml_obj()
+    manifest = dom.documentElement
+    fields = apkinfo.parse_manifest(MANIFEST, sdk=True)
+    assert fields['package'] == manifest.getAttribute('package')
+    for name in ('versionCode', 'versionName'):
+        assert fields[name] == manifest.getAttribute('android:' + name)
+    sdk = dom.getElementsByTagName('uses-sdk')[0]
+    assert fields['minSdkVersion'] == sdk.getAttribute('android:minSdkVersion')
+
+
+def test_not_a_manifest():
+    assert apkinfo.parse_manifest(b'\0' * 64) is None
+    layout = MANIFEST.replace(u'manifest'.encode('utf-16-le'),
+                              u'layouts!'.encode('utf-16-le'))
+    assert apkinfo.parse_manifest(layout) is None
+
+
+def test_apk_skips_dom(apk):
+    code = '\n'.join([
+        'import sys',
+        'sys.path.insert(0, {!r})'.format(os.path.dirname(
+            apkinfo.__file__)),
+        'import apkinfo',
+        'with apkinfo.APK({!r}) as a:'.format(apk),
+        '    print(a.get_package(), a.get_version_code(),',
+        '          a.get_version_name(), a.get_min_sdk_version())',
+        'print("xml.dom.minidom" in sys.modules)',
+    ])
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  universal_newlines=True)
+    assert out.split('\n')[:2] == ['com.mcxiaoke.benchmark 100 1.0.0 16',
+                                   'False']
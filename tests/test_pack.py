@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import os
+
+import benchmark
+from conftest import packer
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_pack_roundtrip(apk, variants, tmp_path):
+    pack = str(tmp_path / 'app.pack')
+    assert packer.writePack(pack, apk, variants[:2], ['oppo']) == 3
+    out = tmp_path / 'out'
+    assert packer.packMain('packer', ['extract', pack, '-o', str(out)]) == 0
+    assert read(str(out / 'app-huawei.apk')) == read(variants[1])
+    assert packer.getChannel(str(out / 'app-oppo.apk')) == 'oppo'
+
+
+def test_extract_escapes_channel_names(apk, tmp_path):
+    pack = str(tmp_path / 'app.pack')
+    packer.writePack(pack, apk, channels=['../../evil'])
+    out = tmp_path / 'a' / 'b' / 'out'
+    assert packer.packMain('packer', ['extract', pack, '-o', str(out)]) == 0
+    assert os.listdir(str(out)) == ['app-.._.._evil.apk']
+    assert not (tmp_path / 'evil.apk').exists()
+    assert not (tmp_path / 'a' / 'evil.apk').exists()
+
+
+def test_create_rejects_foreign_apk(apk, tmp_path, capsys):
+    other = benchmark.makeApk(str(tmp_path / 'other.apk'), 0x10000, 4,
+                              seed=2)
+    pack = str(tmp_path / 'app.pack')
+    assert packer.packMain('packer', ['create', '-b', apk, pack, other]) == 1
+    assert 'Not a channel variant' in capsys.readouterr().err
+    assert not os.path.exists(pack)
+
+
+def test_create_reports_bad_channels(apk, variants, tmp_path, capsys):
+    pack = str(tmp_path / 'app.pack')
+    assert packer.packMain('packer', ['create', '-b', apk, '-c', u'a∘b',
+                                      pack]) == 1
+    err = capsys.readouterr().err
+    assert err.startswith('Failed {}: ValueError: Separator'.format(pack))
+    assert len(err.splitlines()) == 1
+    assert packer.packMain('packer', ['create', '-b', apk, '-c', 'google',
+                                      pack, variants[0]]) == 1
+    assert 'ValueError: Duplicate channel: google' in \
+        capsys.readouterr().err
+    assert not os.path.exists(pack)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import struct
+
+import pytest
+
+from conftest import packer
+
+CHANNEL = packer.PLUGIN_CHANNEL_KEY
+VALUES = {CHANNEL: u'华为', 'campaign': 'c' * 500, u'键': u'值', 'empty': ''}
+
+
+@pytest.mark.parametrize('binary, compress', [
+    (False, False), (True, False), (True, True)])
+def test_round_trip(binary, compress):
+    payload = packer.makePayload(VALUES, binary, compress)
+    assert packer.isBinaryPayload(payload) == binary
+    assert packer.parseValues(payload) == VALUES
+    for key, value in VALUES.items():
+        assert packer.parseValue(payload, key) == value
+    assert packer.parseValue(payload, 'missing') is None
+
+
+def test_binary_layout():
+    payload = packer.makeBinaryPayload(VALUES, compress=True)
+    body = packer.readPayloadBody(payload)
+    keys = list(packer.iterPayloadKeys(body))
+    # channel first, the large value compressed
+    assert bytes(keys[0][0]) == CHANNEL.encode('utf-8')
+    flags = dict((bytes(k), f) for k, f, _ in keys)
+    assert flags[b'campaign'] == packer.PAYLOAD_ZLIB
+    assert flags[CHANNEL.encode('utf-8')] == 0
+    assert len(payload) < 500
+
+
+def test_binary_allows_separators():
+    values = {CHANNEL: u'a∘b∙c'}
+    assert packer.parseValues(packer.makeBinaryPayload(values)) == values
+
+
+@pytest.mark.parametrize('damage', [
+    lambda p: p[:-1],
+    lambda p: p[:20] + struct.pack('<H', 9) + p[22:],
+    lambda p: p[:16] + struct.pack('<i', 4) + p[20:],
+])
+def test_bad_binary_payload(damage):
+    payload = damage(packer.makeBinaryPayload({CHANNEL: 'google'}))
+    with pytest.raises(packer.SignatureNotFoundException):
+        packer.parseValues(payload)
+
+
+def test_bad_value_offset():
+    payload = bytearray(packer.makeBinaryPayload({CHANNEL: 'google'}))
+    # value offset of the first directory entry
+    struct.pack_into('<I', payload, 24 + 4, 0xffff)
+    with pytest.raises(packer.SignatureNotFoundException):
+        packer.parseValue(bytes(payload), CHANNEL)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_write_binary(apk, compress):
+    packer.writeValues(apk, VALUES, binary=True, compress=compress,
+                       javaRuntime=False)
+    content = packer.findBlocks(apk)[packer.PLUGIN_BLOCK_ID]
+    assert packer.isBinaryPayload(content)
+    assert packer.getValue(apk, CHANNEL) == u'华为'
+    assert packer.getValue(apk, 'campaign') == 'c' * 500
+    assert packer.getValue(apk, 'missing') is None
+    assert packer.getChannel(apk) == u'华为'
+    # a rewrite keeps the binary format and merges the old values
+    packer.writeChannel(apk, 'google')
+    assert packer.isBinaryPayload(
+        packer.findBlocks(apk)[packer.PLUGIN_BLOCK_ID])
+    assert packer.getValues(apk)['padding'] == 'p' * 64
+    assert packer.getValue(apk, 'campaign') == 'c' * 500
+
+
+def test_text_payload_still_reads(apk):
+    content = packer.findBlocks(apk)[packer.PLUGIN_BLOCK_ID]
+    assert content.startswith(packer.PLUGIN_BLOCK_MAGIC)
+    assert packer.getValue(apk, CHANNEL) == 'base'
+
+
+@pytest.mark.parametrize('binary, compress', [(True, None), (None, True)])
+def test_binary_needs_opt_in(apk, binary, compress):
+    with open(apk, 'rb') as f:
+        data = f.read()
+    with pytest.raises(ValueError):
+        packer.writeValues(apk, VALUES, binary=binary, compress=compress)
+    with open(apk, 'rb') as f:
+        assert f.read() == data
+
+
+def test_write_main_binary_needs_opt_in(apk, capsys):
+    with pytest.raises(SystemExit):
+        packer.writeMain('packer', [apk, 'google', '--binary'])
+    assert '--no-java-runtime' in capsys.readouterr().err
+    assert packer.writeMain('packer', [apk, 'google', '--compress',
+                                       '--no-java-runtime']) == 0
+    assert packer.getChannel(apk) == 'google'
+    # a binary apk keeps its format without asking again
+    packer.writeChannel(apk, 'huawei')
+    assert packer.isBinaryPayload(
+        packer.findBlocks(apk)[packer.PLUGIN_BLOCK_ID])
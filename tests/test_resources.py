@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import apkinfo
+from conftest import RESOURCES
+
+
+@pytest.fixture
+def arsc():
+    return apkinfo.ARSCParser(RESOURCES)
+
+
+@pytest.mark.parametrize('locale, expected', [
+    (None, ['Demo', '2.0-beta', 'Demo']),
+    ('en', ['Demo', '2.0-beta', 'Demo']),
+    ('zh', ['Demo', '2.0-zh', 'Demo']),
+    ('zh-rCN', [u'演示', '2.0-zh', u'演示']),
+    ('zh_CN', [u'演示', '2.0-zh', u'演示']),
+])
+def test_strings_by_locale(arsc, locale, expected):
+    assert [arsc.get_string(0x7f010000 + i, locale)
+            for i in range(3)] == expected
+
+
+def test_index(arsc):
+    package = arsc.packages[0x7f]
+    assert package.name == 'com.mcxiaoke.benchmark'
+    assert sorted(package.types) == [1, 2, 3]
+    assert arsc.get_locales() == ['', 'zh', 'zh-rCN']
+
+
+def test_sparse_offset16_and_compact_entries(arsc):
+    assert arsc.get_string(0x7f020007) == '42'
+    assert arsc.get_string(0x7f020064) == 'Demo'
+    assert arsc.get_value(0x7f020003) is None  # bag
+    assert arsc.get_value(0x7f020004) is None
+    assert arsc.get_string(0x7f030001) == 'true'
+    assert arsc.get_value(0x7f030002) is None
+    assert arsc.get_value(0x7f040000) is None
+    assert arsc.get_value(0x01010000) is None
+
+
+def test_not_a_table():
+    with pytest.raises(apkinfo.ResParserError):
+        apkinfo.ARSCParser(b'\x03\x00\x08\x00' + b'\0' * 16)
+
+
+def test_apk_resolves_references(resourceApk):
+    with apkinfo.APK(resourceApk) as a:
+        assert a.get_version_name() == '2.0-beta'
+        assert a.get_app_name() == 'Demo'
+        assert a.get_app_name('zh-rCN') == u'演示'
+        assert a.resolve_reference('@android:0104000A') == \
+            '@android:0104000A'
+
+
+def test_cached_apk_resolves_references(resourceApk, tmp_path):
+    db = str(tmp_path / 'manifests.db')
+    for _ in range(2):
+        with apkinfo.ManifestCache(db) as cache:
+            with apkinfo.APK(resourceApk, cache=cache) as a:
+                assert a.get_app_name() == 'Demo'
+                assert a.get_version_name() == '2.0-beta'
+
+
+def test_cache_of_older_format_is_a_miss(resourceApk, tmp_path):
+    # a cache file written before labels were cached
+    db = str(tmp_path / 'manifests.db')
+    with apkinfo.APK(resourceApk) as a:
+        info = a.zip.getinfo('AndroidManifest.xml')
+        key = (info.CRC, info.file_size)
+    conn = sqlite3.connect(db)
+    conn.executescript(apkinfo.MANIFEST_CACHE_SCHEMA)
+    conn.execute('INSERT INTO manifests VALUES (?, ?, ?, ?)', key + (
+        '{"package": "com.mcxiaoke.benchmark", "permissions": [], '
+        '"versionCode": "7", "versionName": "@7F010001"}', 0))
+    conn.commit()
+    conn.close()
+    with apkinfo.ManifestCache(db) as cache:
+        assert cache.get(key) is None
+        with apkinfo.APK(resourceApk, cache=cache) as a:
+            assert a.get_app_name() == 'Demo'
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import threading
+from http.client import HTTPConnection
+
+import pytest
+
+from conftest import packer
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 100)),
+    ('bytes=100-', (100, 1000)),
+    ('bytes=-10', (990, 1000)),
+    ('bytes=900-5000', (900, 1000)),
+    ('bytes=5-1', None),
+    ('bytes=0-1,5-6', None),
+    ('items=0-1', None),
+])
+def test_parse_range(header, expected):
+    assert packer.parseRange(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=-0'])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        packer.parseRange(header, 1000)
+
+
+@pytest.fixture
+def server(apk):
+    server = packer.serveChannels([apk], '127.0.0.1', 0,
+                                  ['google', 'huawei', u'华为'])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    for stamped in server.apks.values():
+        stamped.close()
+
+
+def get(server, path, headers={}, method='GET'):
+    conn = HTTPConnection(*server.server_address[:2])
+    try:
+        conn.request(method, path, headers=headers)
+        r = conn.getresponse()
+        return r.status, dict(r.getheaders()), r.read()
+    finally:
+        conn.close()
+
+
+def expected(apk, tmp_path, channel):
+    path = str(tmp_path / 'expected.apk')
+    packer.writeValues(apk, {packer.PLUGIN_CHANNEL_KEY: channel}, path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_get(server, apk, tmp_path):
+    data = expected(apk, tmp_path, 'huawei')
+    status, headers, body = get(server, '/app/huawei.apk')
+    assert status == 200
+    assert body == data
+    assert headers['Content-Length'] == str(len(data))
+    assert headers['Content-Type'] == packer.APK_CONTENT_TYPE
+    assert "app-huawei.apk" in headers['Content-Disposition']
+    status, _, body = get(server, '/%E5%8D%8E%E4%B8%BA.apk')
+    assert status == 200
+    assert body == expected(apk, tmp_path, u'华为')
+
+
+def test_head(server, apk, tmp_path):
+    status, headers, body = get(server, '/app/google.apk', method='HEAD')
+    assert status == 200
+    assert body == b''
+    assert int(headers['Content-Length']) == \
+        len(expected(apk, tmp_path, 'google'))
+
+
+def test_range(server, apk, tmp_path):
+    data = expected(apk, tmp_path, 'google')
+    blockOffset = packer.readLayout(apk).blockOffset
+    start = blockOffset - 100
+    status, headers, body = get(server, '/app/google.apk', {
+        'Range': 'bytes={}-{}'.format(start, blockOffset + 99)})
+    assert status == 206
+    assert body == data[start:blockOffset + 100]
+    assert headers['Content-Range'] == 'bytes {}-{}/{}'.format(
+        start, blockOffset + 99, len(data))
+    status, _, body = get(server, '/app/google.apk', {'Range': 'bytes=-10'})
+    assert (status, body) == (206, data[-10:])
+
+
+def test_if_range(server):
+    _, headers, _ = get(server, '/app/google.apk', method='HEAD')
+    status, _, body = get(server, '/app/google.apk', {
+        'Range': 'bytes=0-9', 'If-Range': headers['ETag']})
+    assert (status, len(body)) == (206, 10)
+    status, _, _ = get(server, '/app/google.apk', {
+        'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert status == 200
+
+
+def test_errors(server):
+    status, headers, _ = get(server, '/app/google.apk',
+                             {'Range': 'bytes=99999999-'})
+    assert status == 416
+    assert headers['Content-Range'].startswith('bytes */')
+    assert get(server, '/app/xiaomi.apk')[0] == 404
+    assert get(server, '/other/google.apk')[0] == 404
+    assert get(server, '/app/google.zip')[0] == 404
+
+
+def test_tail_cache(apk):
+    stamped = packer.StampedApk(apk, cacheSize=2)
+    try:
+        tail = stamped.tail('a')
+        assert stamped.tail('a') is tail
+        stamped.tail('b')
+        stamped.tail('c')
+        assert list(stamped.tails) == ['b', 'c']
+        assert stamped.etag('a') != stamped.etag('b')
+    finally:
+        stamped.close()
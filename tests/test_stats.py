@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from conftest import packer
+
+
+@pytest.fixture
+def stats():
+    stats = packer.enableStats()
+    yield stats
+    packer.disableStats()
+
+
+def test_off_by_default(apk):
+    assert packer.getStats() is None
+    packer.getChannel(apk)
+    assert packer.getStats() is None
+
+
+def test_lookup_phases(apk, stats):
+    assert packer.enableStats() is stats
+    packer.getChannel(apk)
+    data = stats.toDict()
+    for name in ('map', 'eocd', 'signing_block', 'entries', 'values'):
+        assert data['phases'][name]['calls'] >= 1, name
+    assert data['counters']['maps_opened'] >= 1
+    assert data['counters']['bytes_read'] > 0
+    assert packer.disableStats() is stats
+    assert packer.getStats() is None
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_batch_merge(variants, tmp_path, stats, jobs):
+    missing = str(tmp_path / 'missing.apk')
+    results = list(packer.batchChannels(variants + [missing], jobs))
+    assert all('stats' not in r for r in results)
+    counters = stats.toDict()['counters']
+    assert counters['apks'] == 4
+    assert counters['errors'] == 1
+    assert counters['maps_opened'] >= 3
+    assert stats.calls['values'] >= 3
+
+
+def test_merge():
+    a = packer.LookupStats()
+    a.count('apks', 2)
+    a.calls['map'] = 1
+    a.seconds['map'] = 0.5
+    b = packer.LookupStats()
+    b.count('custom')
+    b.merge(a.toDict())
+    b.merge(a.toDict())
+    assert b.counters['apks'] == 4
+    assert b.counters['custom'] == 1
+    assert (b.calls['map'], b.seconds['map']) == (2, 1.0)
+
+
+def test_write_stats(tmp_path):
+    stats = packer.LookupStats()
+    stats.count('apks', 3)
+    stats.calls['eocd'] = 2
+    path = str(tmp_path / 'stats.json')
+    packer.writeStats(stats, path)
+    with open(path) as f:
+        assert json.load(f) == stats.toDict()
+    path = str(tmp_path / 'stats.prom')
+    packer.writeStats(stats, path, 'prometheus')
+    with open(path) as f:
+        text = f.read()
+    assert 'packer_ng_apks_total 3\n' in text
+    assert 'packer_ng_phase_calls_total{phase="eocd"} 2\n' in text
+    assert '# TYPE packer_ng_phase_seconds_total counter\n' in text
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+        ['stats.json', 'stats.prom']
+
+
+def test_batch_main_stats(variants, tmp_path, capsys):
+    path = str(tmp_path / 'stats.json')
+    assert packer.batchMain('packer', variants + [
+        '-j', '1', '--stats', path]) == 0
+    with open(path) as f:
+        assert json.load(f)['counters']['apks'] == 3
+    assert packer.getStats() is None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import struct
+from array import array
+
+import pytest
+
+import apkinfo
+import benchmark
+
+STRINGS = [u'', u'manifest', u'华为', u'x' * 200, u'é' * 100]
+
+
+def length8(n):
+    return struct.pack('>H', n | 0x8000) if n > 0x7f else struct.pack('B', n)
+
+
+def makePool(strings, utf8):
+    # string pool chunk, utf-8 or utf-16 like aapt
+    offsets = []
+    data = b''
+    for s in strings:
+        offsets.append(len(data))
+        if utf8:
+            encoded = s.encode('utf-8')
+            data += length8(len(s)) + length8(len(encoded)) + encoded + b'\0'
+        else:
+            n = len(s)
+            data += (struct.pack('<HH', n >> 16 | 0x8000, n & 0xffff)
+                     if n > 0x7fff else struct.pack('<H', n))
+            data += s.encode('utf-16-le') + b'\0\0'
+    data += b'\0' * (-len(data) % 4)
+    start = 28 + 4 * len(strings)
+    return struct.pack('<HHIIIIII', 0x0001, 28, start + len(data),
+                       len(strings), 0, apkinfo.UTF8_FLAG if utf8 else 0,
+                       start, 0) + \
+        struct.pack('<%di' % len(offsets), *offsets) + data
+
+
+@pytest.mark.parametrize('utf8', [True, False])
+def test_strings(utf8):
+    sb = apkinfo.StringBlock(apkinfo.BuffHandle(makePool(STRINGS, utf8)))
+    assert sb.m_isUTF8 == utf8
+    assert isinstance(sb.m_stringOffsets, array)
+    assert len(sb.m_stringOffsets) == len(STRINGS)
+    assert isinstance(sb.m_charbuff, memoryview)
+    # decoded lazily, then cached
+    assert sb._cache == {}
+    assert [sb.getString(i) for i in range(len(STRINGS))] == STRINGS
+    assert sorted(sb._cache) == list(range(len(STRINGS)))
+    assert sb.getString(len(STRINGS)) == ''
+    assert sb.getString(-1) == ''
+
+
+def test_long_utf16_string():
+    long = u'y' * 0x8001
+    sb = apkinfo.StringBlock(apkinfo.BuffHandle(makePool([long], False)))
+    assert sb.getString(0) == long
+
+
+def test_parser_arrays():
+    axml = apkinfo.AXMLParser(benchmark.makeManifest('com.example', 7, 'v1'))
+    assert axml.next() == apkinfo.START_DOCUMENT
+    assert axml.next() == apkinfo.START_TAG
+    assert isinstance(axml.m_resourceIDs, array)
+    assert list(axml.m_resourceIDs) == list(benchmark.ANDROID_ATTRS.values())
+    assert isinstance(axml.m_attributes, array)
+    assert axml.getAttributeCount() == 3
+    assert len(axml.m_attributes) == 3 * apkinfo.ATTRIBUTE_LENGHT
+    assert axml.sb.getString(axml.m_name) == 'manifest'
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import struct
+import zipfile
+
+import pytest
+
+from conftest import packer
+
+
+def damage(apk, name):
+    # flip one byte in the data of entry name
+    with zipfile.ZipFile(apk) as z:
+        info = z.getinfo(name)
+    with open(apk, 'r+b') as f:
+        f.seek(info.header_offset + 26)
+        nameLength, extraLength = struct.unpack('<HH', f.read(4))
+        offset = info.header_offset + 30 + nameLength + extraLength + 10
+        f.seek(offset)
+        b = f.read(1)
+        f.seek(offset)
+        f.write(bytes(bytearray([b[0] ^ 0xff])))
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_clean_apk(variants, jobs):
+    result = packer.verifyApk(variants[0], jobs)
+    assert result['corrupt'] is None
+    assert result['entries'] == 17
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_corrupt_entry_is_reported(variants, jobs):
+    damage(variants[0], 'res/raw/r00005.bin')
+    damage(variants[0], 'res/raw/r00009.bin')
+    assert packer.verifyApk(variants[0], jobs)['corrupt'] == \
+        'res/raw/r00005.bin'
+
+
+def test_crc_scan_is_opt_in(variants):
+    damage(variants[0], 'res/raw/r00004.bin')
+    assert packer.getValues(variants[0])[packer.PLUGIN_CHANNEL_KEY] == \
+        'google'
+    with pytest.raises(packer.ZipFormatException) as e:
+        packer.getValues(variants[0], verify=True)
+    assert 'r00004.bin' in str(e.value)
+
+
+def test_truncated_block_entry():
+    # the second entry claims more bytes than the block holds
+    entries = struct.pack('<QI', 8, 0x1234) + b'abcd' + \
+        struct.pack('<QI', 1000, packer.PLUGIN_BLOCK_ID) + b'short'
+    size = struct.pack('<Q', len(entries) + 24)
+    block = size + entries + size + b'APK Sig Block 42'
+    with pytest.raises(packer.SignatureNotFoundException):
+        packer.parseApkSigningBlock(block, packer.PLUGIN_BLOCK_ID)
+    assert bytes(packer.parseApkSigningBlock(block, 0x1234)) == b'abcd'
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import struct
+
+import pytest
+
+import benchmark
+from conftest import packer
+
+V2 = packer.APK_SIGNATURE_SCHEME_V2_BLOCK_ID
+ECDSA_SHA256 = 0x0201
+
+
+def lp(*values):
+    # uint32 length prefixed concatenation of values
+    data = b''.join(values)
+    return struct.pack('<I', len(data)) + data
+
+
+def contentDigest(path):
+    '''
+    reference v2 sha-256 content digest, straight from the scheme: 1m
+    chunks of the entries, central directory and eocd (with the central
+    directory offset pointing at the APK Signing Block), each hashed as
+    0xa5 + uint32 length + chunk, then 0x5a + uint32 count + digests
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    eocdOffset = data.rindex(b'PK\x05\x06')
+    cdSize, cdOffset = struct.unpack_from('<II', data, eocdOffset + 12)
+    blockSize = struct.unpack_from('<Q', data, cdOffset - 24)[0]
+    blockOffset = cdOffset - blockSize - 8
+    eocd = data[eocdOffset:eocdOffset + 16] + \
+        struct.pack('<I', blockOffset) + data[eocdOffset + 20:]
+    chunks = []
+    for section in (data[:blockOffset], data[cdOffset:cdOffset + cdSize],
+                    eocd):
+        for i in range(0, len(section), 0x100000):
+            chunk = section[i:i + 0x100000]
+            chunks.append(hashlib.sha256(
+                b'\xa5' + struct.pack('<I', len(chunk)) + chunk).digest())
+    return hashlib.sha256(b'\x5a' + struct.pack('<I', len(chunks)) +
+                          b''.join(chunks)).digest()
+
+
+@pytest.fixture
+def apk(tmp_path):
+    # several 1m chunks in the entries section
+    return benchmark.makeApk(str(tmp_path / 'app.apk'), 0x280000, 40,
+                             channel='base')
+
+
+def makeKey():
+    x509 = pytest.importorskip('cryptography.x509')
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(
+        x509.oid.NameOID.COMMON_NAME, u'packer')])
+    now = datetime.datetime(2020, 1, 1)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()).serial_number(1) \
+        .not_valid_before(now) \
+        .not_valid_after(now + datetime.timedelta(days=3650)) \
+        .sign(key, hashes.SHA256())
+    publicKey = key.public_key().public_bytes(
+        serialization.Encoding.DER,
+        serialization.PublicFormat.SubjectPublicKeyInfo)
+    return key, cert.public_bytes(serialization.Encoding.DER), publicKey
+
+
+def sign(apk, signature=None):
+    # replace the fake v2 block of apk by a real ecdsa p-256 signer
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    key, cert, publicKey = makeKey()
+    signedData = lp(lp(struct.pack('<I', ECDSA_SHA256),
+                       lp(contentDigest(apk)))) + lp(lp(cert)) + lp()
+    if signature is None:
+        signature = key.sign(signedData, ec.ECDSA(hashes.SHA256()))
+    signer = lp(signedData) + \
+        lp(lp(struct.pack('<I', ECDSA_SHA256), lp(signature))) + \
+        lp(publicKey)
+    layout = packer.readLayout(apk)
+    layout.before = packer.encodeIdValues([(V2, lp(lp(signer)))])
+    with open(apk, 'r+b') as f:
+        f.seek(layout.blockOffset)
+        f.write(layout.makeTail({}))
+        f.truncate()
+    return apk
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_content_digests(apk, jobs):
+    assert packer.readLayout(apk).blockOffset > 2 * packer.V2_CHUNK_SIZE
+    with packer.ApkView(apk) as v:
+        digests, _ = packer.computeContentDigests(v, ['sha256'], jobs)
+    assert digests['sha256'] == contentDigest(apk)
+
+
+@pytest.mark.parametrize('jobs', [1, 4])
+def test_verify_signed(apk, jobs):
+    r = packer.verifyV2(sign(apk), jobs)
+    assert r['verified'], r['errors']
+    assert r['signers'] == 1
+    assert r['signatures'] is True
+    assert r['digests'] == {'sha256': True}
+    assert set(r['timings']) == {'entries', 'cd', 'eocd', 'total'}
+
+
+def test_verify_after_channel_write(apk):
+    sign(apk)
+    packer.writeChannel(apk, 'huawei')
+    assert packer.getChannel(apk) == 'huawei'
+    assert packer.verifyV2(apk)['verified']
+
+
+def test_verify_damaged_entry(apk):
+    sign(apk)
+    with open(apk, 'r+b') as f:
+        f.seek(0x1000)
+        data = f.read(1)
+        f.seek(0x1000)
+        f.write(bytes(bytearray([data[0] ^ 0xff])))
+    r = packer.verifyV2(apk)
+    assert not r['verified']
+    assert r['digests'] == {'sha256': False}
+    assert 'sha256 content digest mismatch' in r['errors']
+
+
+def test_verify_bad_signature(apk):
+    r = packer.verifyV2(sign(apk, signature=b'\x30\x06\x02\x01\x01\x02\x01'
+                                                b'\x01'))
+    assert not r['verified']
+    assert r['signatures'] is False
+
+
+def test_parse_signers_truncated():
+    with pytest.raises(packer.SignatureNotFoundException):
+        packer.parseV2Signers(lp(lp(b'\xff\xff')))
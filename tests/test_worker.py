@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import subprocess
+import sys
+
+from conftest import packer
+
+TOOLS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'tools')
+
+
+def serve(lines):
+    out = io.StringIO()
+    errors = packer.serveRequests(io.StringIO(u'\n'.join(lines) + u'\n'),
+                                  out)
+    return errors, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_requests(apk, tmp_path):
+    output = str(tmp_path / 'out.apk')
+    errors, results = serve([
+        apk,
+        '',
+        json.dumps({'op': 'value', 'apk': apk, 'key': 'padding', 'id': 7}),
+        json.dumps({'op': 'write', 'apk': apk, 'channel': u'华为',
+                    'values': {'campaign': 'spring'}, 'output': output}),
+        json.dumps({'op': 'lookup', 'apk': output, 'info': False}),
+        json.dumps({'op': 'read', 'apk': apk, 'verify': True}),
+    ])
+    assert errors == 0
+    assert len(results) == 5
+    assert results[0]['channel'] == 'base'
+    assert (results[1]['value'], results[1]['id']) == ('p' * 64, 7)
+    assert results[2]['path'] == output
+    assert results[3]['channel'] == u'华为'
+    assert results[3]['values']['campaign'] == 'spring'
+    assert results[4]['error'] is None
+    assert packer.getChannel(apk) == 'base'
+
+
+def test_errors_do_not_stop(apk, tmp_path):
+    errors, results = serve([
+        '{not json',
+        json.dumps({'op': 'delete', 'apk': apk}),
+        json.dumps({'op': 'value'}),
+        str(tmp_path / 'missing.apk'),
+        apk,
+    ])
+    assert errors == 4
+    assert results[0]['error'].startswith('JSONDecodeError')
+    assert results[1]['error'] == 'ValueError: Unknown op: delete'
+    assert results[2]['error'] == 'ValueError: Missing apk in request'
+    assert results[3]['error'].startswith('FileNotFoundError')
+    assert results[4]['channel'] == 'base'
+
+
+def test_worker_process(apk):
+    p = subprocess.Popen(
+        [sys.executable, os.path.join(TOOLS, 'packer-ng-v2.py'), 'worker'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        universal_newlines=True)
+    try:
+        for _ in range(2):
+            p.stdin.write(apk + '\n')
+            p.stdin.flush()
+            assert json.loads(p.stdout.readline())['channel'] == 'base'
+    finally:
+        p.stdin.close()
+        assert p.wait(10) == 0
+        p.stdout.close()
+
+
+def test_import_is_lazy(tmp_path):
+    # imports from another dir touch no files, logging and heavy modules
+    code = '\n'.join([
+        'import importlib, logging, sys',
+        'sys.path.insert(0, {!r})'.format(TOOLS),
+        'importlib.import_module("packer-ng-v2")',
+        'import apkinfo',
+        'heavy = ["zipfile", "mmap", "xml.dom.minidom", "random", "imp",',
+        '         "sqlite3", "multiprocessing", "argparse", "http.server"]',
+        'print([m for m in heavy if m in sys.modules])',
+        'print(len(logging.getLogger().handlers))',
+    ])
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  cwd=str(tmp_path), universal_newlines=True)
+    assert out.split('\n')[:2] == ['[]', '0']
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+import zipfile
+
+import pytest
+
+from conftest import packer
+
+V2 = packer.APK_SIGNATURE_SCHEME_V2_BLOCK_ID
+
+
+def entries(apk):
+    with zipfile.ZipFile(apk) as z:
+        assert z.testzip() is None
+        return [(i.filename, i.CRC) for i in z.infolist()]
+
+
+def test_write_in_place(apk):
+    before = entries(apk)
+    v2 = packer.findBlocks(apk)[V2]
+    packer.writeChannel(apk, u'华为')
+    assert packer.getChannel(apk) == u'华为'
+    assert entries(apk) == before
+    assert packer.findBlocks(apk)[V2] == v2
+
+
+def test_write_merges_values_to_output(apk, tmp_path):
+    output = str(tmp_path / 'out.apk')
+    packer.writeValues(apk, {packer.PLUGIN_CHANNEL_KEY: 'huawei',
+                             'campaign': 'spring'}, output)
+    values = packer.getValues(output)
+    assert values['campaign'] == 'spring'
+    assert values['padding'] == 'p' * 64
+    assert packer.getChannel(apk) == 'base'
+
+
+def test_payload_layout_matches_java(apk):
+    packer.writeChannel(apk, 'huawei')
+    payload = packer.findBlocks(apk)[packer.PLUGIN_BLOCK_ID]
+    assert payload.startswith(packer.PLUGIN_BLOCK_MAGIC)
+    assert u'CHANNEL∘huawei∙'.encode('utf-8') in payload
+    assert payload[-4:] == payload[16:20]
+
+
+def test_separators_rejected(apk):
+    with pytest.raises(ValueError):
+        packer.writeChannel(apk, u'a∘b')
+    assert packer.getChannel(apk) == 'base'
+
+
+def test_rewrite_replaces_channel(apk):
+    packer.writeChannel(apk, 'first')
+    packer.writeChannel(apk, 'second')
+    assert packer.getChannel(apk) == 'second'
+    entries(apk)
+
+
+def test_interrupted_write_keeps_apk(apk, tmp_path, monkeypatch):
+    with open(apk, 'rb') as f:
+        data = f.read()
+
+    def copyRange(src, dst, offset, length):
+        dst.write(src.read(length // 2))
+        raise IOError(28, 'No space left on device')
+
+    monkeypatch.setattr(packer, 'copyRange', copyRange)
+    with pytest.raises(IOError):
+        packer.writeChannel(apk, 'huawei')
+    with open(apk, 'rb') as f:
+        assert f.read() == data
+    assert os.listdir(str(tmp_path)) == ['app.apk']
+
+
+def test_write_keeps_mode(apk):
+    os.chmod(apk, 0o640)
+    packer.writeChannel(apk, 'huawei')
+    assert os.stat(apk).st_mode & 0o777 == 0o640
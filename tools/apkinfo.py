@@ -15,21 +15,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import StringIO
-from struct import pack, unpack
-from xml.sax.saxutils import escape
-from zlib import crc32
-import re
-import collections
+from __future__ import print_function
+import io
 import sys
-import os
+import threading
+from array import array
+from collections import OrderedDict, namedtuple
+from struct import pack, unpack
 import logging
-import types
-import random
-import string
-import imp
 
-from xml.dom import minidom
+from bytedecoder import INT32, UINT16, UINT32, UINT8_PAIR, UINT16_PAIR, \
+    UINT32_PAIR, AXML_CHUNK_HEADER, AXML_START_TAG, RES_CHUNK_HEADER, \
+    RES_TABLE_TYPE_HEADER, RES_TABLE_ENTRY, RES_VALUE
+
+log = logging.getLogger(__name__)
 
 NS_ANDROID_URI = 'http://schemas.android.com/apk/res/android'
 
@@ -51,6 +50,14 @@ def sign_apk(filename, keystore, storepass):
     stdout, stderr = compile.communicate()
 
 
+def warning(msg):
+    log.warning(msg)
+
+
+def info(msg):
+    log.info(msg)
+
+
 class Error(Exception):
     """Base class for exceptions in this module."""
     pass
@@ -60,6 +67,10 @@ class FileNotPresent(Error):
     pass
 
 
+class ResParserError(Error):
+    pass
+
+
 ######################################################## APK FORMAT ########################################################
 class APK(object):
     """
@@ -67,19 +78,28 @@ class APK(object):
 
         :param filename: specify the path of the file, or raw data
         :param raw: specify if the filename is a path or raw data (optional)
-        :param mode: specify the mode to open the file (optional)
+        :param mode: only "r", the APK is opened read-only (optional)
         :param magic_file: specify the magic file (optional)
         :param zipmodule: specify the type of zip module to use (0:chilkat, 1:zipfile, 2:patch zipfile)
+        :param cache: a :class:`ManifestCache` to look up the manifest fields in (optional)
 
         :type filename: string
         :type raw: boolean
         :type mode: string
         :type magic_file: string
         :type zipmodule: int
+        :type cache: :class:`ManifestCache`
 
         :Example:
           APK("myfile.apk")
           APK(read("myfile.apk"), raw=True)
+
+        a path is opened lazily, only the central directory and the
+        AndroidManifest.xml entry are read, the file stays open until
+        close() (or the end of a with block), with a cache the
+        AndroidManifest.xml entry is only read when its CRC32 and size
+        are not cached yet, a stored resources.arsc is mapped instead of
+        read, see get_android_resources()
     """
 
     def __init__(self,
@@ -87,11 +107,21 @@ class APK(object):
                  raw=False,
                  mode="r",
                  magic_file=None,
-                 zipmodule=ZIPMODULE):
+                 zipmodule=ZIPMODULE,
+                 cache=None):
+        # the file itself is opened, "w" or "a" would change the APK
+        if mode != "r":
+            raise ValueError("APK can only be opened read-only: %r" % mode)
         self.filename = filename
 
-        self.xml = {}
-        self.axml = {}
+        self.__manifest = None
+        self.__manifest_info = None
+        self.__resources_info = None
+        self.__mmap = None
+        # parse_manifest() fields by option, see __get_fields()
+        self.__fields = {}
+        self.__axml = None
+        self.__xml = None
         self.arsc = {}
 
         self.package = ""
@@ -105,43 +135,131 @@ class APK(object):
 
         self.magic_file = magic_file
 
-        if raw is True:
-            self.__raw = filename
-        else:
-            self.__raw = read(filename)
+        # raw bytes are only kept when passed in, see get_raw()
+        self.__raw = filename if raw is True else None
 
         self.zipmodule = zipmodule
 
         if zipmodule == 0:
-            self.zip = ChilkatZip(self.__raw)
-        elif zipmodule == 2:
-            from androguard.patch import zipfile
-            self.zip = zipfile.ZipFile(StringIO.StringIO(self.__raw), mode=mode)
+            self.zip = ChilkatZip(self.get_raw())
         else:
-            import zipfile
-            self.zip = zipfile.ZipFile(StringIO.StringIO(self.__raw), mode=mode)
+            if zipmodule == 2:
+                from androguard.patch import zipfile
+            else:
+                import zipfile
+            if raw is True:
+                self.zip = zipfile.ZipFile(io.BytesIO(self.__raw))
+            else:
+                self.zip = zipfile.ZipFile(filename)
+
+        for i in self.zip.infolist():
+            self.files_crc32[i.filename] = i.CRC
+            if i.filename == "AndroidManifest.xml":
+                self.__manifest_info = i
+            elif i.filename == "resources.arsc":
+                self.__resources_info = i
 
-        for i in self.zip.namelist():
-            if i == "AndroidManifest.xml":
-                self.axml[i] = AXMLPrinter(self.zip.read(i))
+        if self.__manifest_info is not None:
+            if cache is None:
                 try:
-                    self.xml[i] = minidom.parseString(self.axml[i].get_buff())
+                    fields = parse_manifest(self.get_android_manifest_raw())
+                except Exception:
+                    fields = None
+            else:
+                fields = self.__get_cached_fields(cache)
+
+            if fields is not None:
+                self.package = fields.get("package", "")
+                self.androidversion["Code"] = fields.get(
+                    "versionCode", "")
+                self.androidversion["Name"] = fields.get(
+                    "versionName", "")
+
+                self.valid_apk = True
+
+    def __get_cached_fields(self, cache):
+        # all manifest fields from cache, parsed and stored on a miss
+        info = self.__manifest_info
+        key = (info.CRC, info.file_size)
+        fields = cache.get(key)
+        if fields is None:
+            try:
+                fields = parse_manifest(self.get_android_manifest_raw(),
+                                        sdk=True, permissions=True,
+                                        application=True)
+            except Exception:
+                fields = None
+            # {} marks a manifest that could not be parsed
+            fields = fields or {}
+            cache.put(key, fields)
+        if not fields:
+            return None
+        for option in MANIFEST_OPTIONS:
+            self.__fields[option] = fields
+        self.permissions = list(fields["permissions"])
+        return fields
+
+    def __get_fields(self, option):
+        # parse_manifest() fields with option set, parsed once per option
+        fields = self.__fields.get(option)
+        if fields is None:
+            if self.__manifest_info is not None:
+                try:
+                    fields = parse_manifest(self.get_android_manifest_raw(),
+                                            **{option: True})
+                except Exception:
+                    pass
+            fields = self.__fields[option] = fields or {}
+        return fields
+
+    @property
+    def axml(self):
+        """
+            AXMLPrinter of the AndroidManifest.xml, decoded on first use
+        """
+        if self.__axml is None:
+            self.__axml = {}
+            if self.__manifest_info is not None:
+                self.__axml["AndroidManifest.xml"] = AXMLPrinter(
+                    self.get_android_manifest_raw())
+        return self.__axml
+
+    @property
+    def xml(self):
+        """
+            minidom document of the AndroidManifest.xml, parsed on first use
+        """
+        if self.__xml is None:
+            from xml.dom import minidom
+            self.__xml = {}
+            for i in self.axml:
+                try:
+                    self.__xml[i] = minidom.parseString(
+                        self.axml[i].get_buff())
                 except:
-                    self.xml[i] = None
-
-                if self.xml[i] != None:
-                    self.package = self.xml[i].documentElement.getAttribute(
-                        "package")
-                    self.androidversion[
-                        "Code"
-                    ] = self.xml[i].documentElement.getAttributeNS(
-                        NS_ANDROID_URI, "versionCode")
-                    self.androidversion[
-                        "Name"
-                    ] = self.xml[i].documentElement.getAttributeNS(
-                        NS_ANDROID_URI, "versionName")
-
-                    self.valid_apk = True
+                    self.__xml[i] = None
+        return self.__xml
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+            Close the zip file of the APK and unmap the resources.arsc
+        """
+        if self.zip is not None and hasattr(self.zip, "close"):
+            self.zip.close()
+        if self.__mmap is not None:
+            self.arsc = {}
+            try:
+                self.__mmap.close()
+            except BufferError:
+                # an ARSCParser still in use keeps the table mapped
+                pass
+            self.__mmap = None
 
     def get_AndroidManifest(self):
         """
@@ -185,19 +303,95 @@ class APK(object):
 
     def get_version_name(self):
         """
-            Return the android version name
+            Return the android version name, a string resource reference
+            is resolved for the default configuration
 
             :rtype: string
         """
-        return self.androidversion["Name"]
+        return self.resolve_reference(self.androidversion["Name"])
+
+    def get_app_name(self, locale=None):
+        """
+            Return the android:label of <application>, a string resource
+            reference is resolved for locale (like "zh-rCN", default
+            configuration if None)
+
+            :rtype: string
+        """
+        return self.resolve_reference(
+            self.__get_fields("application").get("label"), locale)
+
+    def get_android_resources(self):
+        """
+            Return the :class:`ARSCParser` of the resources.arsc, indexed
+            on first use, None if the APK has none
+
+            :rtype: :class:`ARSCParser`
+        """
+        if "resources.arsc" not in self.arsc:
+            arsc = None
+            if self.__resources_info is not None:
+                arsc = ARSCParser(self.__map_entry(self.__resources_info))
+            self.arsc["resources.arsc"] = arsc
+        return self.arsc["resources.arsc"]
+
+    def resolve_reference(self, value, locale=None):
+        """
+            Return the resources.arsc value of a reference formatted like
+            "@7F0B0001" by AXMLPrinter, value itself if it is no reference
+            to a resource of this APK or can not be resolved
+
+            :rtype: string
+        """
+        if not value or value[0] != "@" or value.startswith("@android:"):
+            return value
+        try:
+            res_id = int(value[1:], 16)
+        except ValueError:
+            return value
+        arsc = self.get_android_resources()
+        resolved = None if arsc is None else arsc.get_string(res_id, locale)
+        return value if resolved is None else resolved
+
+    def __map_entry(self, info):
+        # memoryview of a stored entry of the mapped apk file, compressed
+        # entries and APKs created from raw data are read from the zip
+        if info.compress_type != 0 or self.__raw is not None or \
+                info.file_size == 0:
+            return self.zip.read(info)
+        import mmap
+        if self.__mmap is None:
+            with open(self.filename, "rb") as f:
+                self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = info.header_offset
+        # local file header: signature, ..., name and extra field lengths
+        if UINT32.unpack_from(self.__mmap, header)[0] != 0x04034b50:
+            return self.zip.read(info)
+        name_len, extra_len = UINT16_PAIR.unpack_from(self.__mmap, header + 26)
+        start = header + 30 + name_len + extra_len
+        return memoryview(self.__mmap)[start:start + info.file_size]
+
+    def get_android_manifest_raw(self):
+        """
+            Return the binary AndroidManifest.xml, read from the zip on
+            first use, None if the APK has none
+
+            :rtype: bytes
+        """
+        if self.__manifest is None and self.__manifest_info is not None:
+            self.__manifest = self.zip.read(self.__manifest_info)
+        return self.__manifest
 
     def get_raw(self):
         """
-            Return raw bytes of the APK
+            Return raw bytes of the APK, read from the file on each
+            call unless the APK was created from raw data
 
             :rtype: string
         """
-        return self.__raw
+        if self.__raw is not None:
+            return self.__raw
+        return read(self.filename)
 
     def get_elements(self, tag_name, attribute):
         """
@@ -256,13 +450,32 @@ class APK(object):
                     return value
         return None
 
+    def get_sdk_version(self, attribute):
+        """
+            Return an attribute of <uses-sdk>, read with parse_manifest()
+
+            :rtype: string
+        """
+        return self.__get_fields("sdk").get(attribute) or None
+
+    def get_permissions(self):
+        """
+            Return the android:name of all <uses-permission> elements
+
+            :rtype: list of string
+        """
+        if "permissions" not in self.__fields:
+            self.permissions = list(
+                self.__get_fields("permissions").get("permissions", []))
+        return self.permissions
+
     def get_max_sdk_version(self):
         """
             Return the android:maxSdkVersion attribute
 
             :rtype: string
         """
-        return self.get_element("uses-sdk", "maxSdkVersion")
+        return self.get_sdk_version("maxSdkVersion")
 
     def get_min_sdk_version(self):
         """
@@ -270,7 +483,7 @@ class APK(object):
 
             :rtype: string
         """
-        return self.get_element("uses-sdk", "minSdkVersion")
+        return self.get_sdk_version("minSdkVersion")
 
     def get_target_sdk_version(self):
         """
@@ -278,7 +491,7 @@ class APK(object):
 
             :rtype: string
         """
-        return self.get_element("uses-sdk", "targetSdkVersion")
+        return self.get_sdk_version("targetSdkVersion")
 
     def get_android_manifest_axml(self):
         """
@@ -304,9 +517,165 @@ class APK(object):
 
     def show(self):
 
-        print "PACKAGE: ", self.get_package()
-        print "VERSION NAME:", self.get_version_name()
-        print "VERSION CODE:", self.get_version_code()
+        print("PACKAGE: ", self.get_package())
+        print("VERSION NAME:", self.get_version_name())
+        print("VERSION CODE:", self.get_version_code())
+
+
+MANIFEST_CACHE_SIZE = 1024
+MANIFEST_CACHE_MAX_ENTRIES = 100000
+# format of the cached fields, bumped whenever parse_manifest() options
+# of APK.__get_cached_fields() change: 2 added the application label
+MANIFEST_CACHE_VERSION = 2
+
+MANIFEST_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifests (
+    crc32 INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    fields TEXT NOT NULL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (crc32, size)
+);
+CREATE INDEX IF NOT EXISTS manifests_atime ON manifests (atime);
+"""
+
+
+class ManifestCache(object):
+    """
+        parse_manifest() results (with sdk levels and permissions) keyed
+        by the (CRC32, size) of the AndroidManifest.xml zip entry, so all
+        channel variants of a build decode their manifest once
+
+        :param path: sqlite file shared between processes and runs (optional)
+        :param max_size: entries kept in memory, least recently used go first
+        :param max_entries: entries kept in the sqlite file, least recently used go first
+
+        one cache can be shared by threads, its memory entries and the
+        sqlite connection are only used under its lock
+
+        :Example:
+          cache = ManifestCache("manifests.db")
+          for apk in apks:
+              with APK(apk, cache=cache) as a:
+                  print(a.get_package(), a.get_permissions())
+    """
+
+    def __init__(self,
+                 path=None,
+                 max_size=MANIFEST_CACHE_SIZE,
+                 max_entries=MANIFEST_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.db = None
+        if path is not None:
+            import os
+            import sqlite3
+            dirname = os.path.dirname(os.path.abspath(path))
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            if version != MANIFEST_CACHE_VERSION:
+                # entries of another format lack fields, all are misses
+                self.db.execute("DROP TABLE IF EXISTS manifests")
+                self.db.execute(
+                    "PRAGMA user_version = %d" % MANIFEST_CACHE_VERSION)
+            self.db.executescript(MANIFEST_CACHE_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        """
+            Close the sqlite file, the memory entries stay usable
+        """
+        with self.lock:
+            if self.db is not None:
+                self.db.commit()
+                self.db.close()
+                self.db = None
+
+    def get(self, key):
+        """
+            Return the cached fields of key, {} for a manifest that
+            could not be parsed, None if key is not cached
+
+            :rtype: dict
+        """
+        with self.lock:
+            fields = self.entries.get(key)
+            if fields is not None:
+                self.entries.move_to_end(key)
+                return fields
+            if self.db is not None:
+                import json
+                import time
+                row = self.db.execute(
+                    "SELECT fields FROM manifests "
+                    "WHERE crc32 = ? AND size = ?", key).fetchone()
+                if row is not None:
+                    self.db.execute(
+                        "UPDATE manifests SET atime = ? "
+                        "WHERE crc32 = ? AND size = ?", (time.time(),) + key)
+                    # commit at once, other processes may write the file too
+                    self.db.commit()
+                    fields = json.loads(row[0])
+                    self.__remember(key, fields)
+            return fields
+
+    def put(self, key, fields):
+        """
+            Store the fields of key in memory and in the sqlite file
+        """
+        with self.lock:
+            self.__remember(key, fields)
+            if self.db is not None:
+                import json
+                import time
+                self.db.execute(
+                    "INSERT OR REPLACE INTO manifests "
+                    "(crc32, size, fields, atime) VALUES (?, ?, ?, ?)",
+                    key + (json.dumps(fields, ensure_ascii=False,
+                                      sort_keys=True), time.time()))
+                self.db.commit()
+                self.evict()
+
+    def evict(self):
+        """
+            Drop the least recently used entries of the sqlite file past
+            max_entries, return how many were dropped
+
+            :rtype: int
+        """
+        with self.lock:
+            if self.db is None:
+                return 0
+            count = self.db.execute(
+                "SELECT COUNT(*) FROM manifests").fetchone()[0]
+            if count > self.max_entries:
+                self.db.execute(
+                    "DELETE FROM manifests WHERE rowid IN (SELECT rowid "
+                    "FROM manifests ORDER BY atime LIMIT ?)",
+                    (count - self.max_entries,))
+                self.db.commit()
+            return max(0, count - self.max_entries)
+
+    def __remember(self, key, fields):
+        self.entries[key] = fields
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
 
 ################################## AXML FORMAT ########################################
 # Translated from
@@ -324,26 +693,20 @@ class StringBlock(object):
         self._cache = {}
         self.header_size, self.header = self.skipNullPadding(buff)
 
-        self.chunkSize = unpack('<i', buff.read(4))[0]
-        self.stringCount = unpack('<i', buff.read(4))[0]
-        self.styleOffsetCount = unpack('<i', buff.read(4))[0]
+        self.chunkSize = buff.read_int32()
+        self.stringCount = buff.read_int32()
+        self.styleOffsetCount = buff.read_int32()
 
-        self.flags = unpack('<i', buff.read(4))[0]
+        self.flags = buff.read_int32()
         self.m_isUTF8 = ((self.flags & UTF8_FLAG) != 0)
 
-        self.stringsOffset = unpack('<i', buff.read(4))[0]
-        self.stylesOffset = unpack('<i', buff.read(4))[0]
-
-        self.m_stringOffsets = []
-        self.m_styleOffsets = []
-        self.m_charbuff = ""
-        self.m_styles = []
+        self.stringsOffset = buff.read_int32()
+        self.stylesOffset = buff.read_int32()
 
-        for i in range(0, self.stringCount):
-            self.m_stringOffsets.append(unpack('<i', buff.read(4))[0])
-
-        for i in range(0, self.styleOffsetCount):
-            self.m_styleOffsets.append(unpack('<i', buff.read(4))[0])
+        # offset arrays are decoded in bulk, strings on first getString()
+        self.m_stringOffsets = buff.read_array('i', self.stringCount)
+        self.m_styleOffsets = buff.read_array('i', self.styleOffsetCount)
+        self.m_styles = array('i')
 
         size = self.chunkSize - self.stringsOffset
         if self.stylesOffset != 0:
@@ -353,7 +716,7 @@ class StringBlock(object):
         if (size % 4) != 0:
             warning("ooo")
 
-        self.m_charbuff = buff.read(size)
+        self.m_charbuff = buff.read_view(size)
 
         if self.stylesOffset != 0:
             size = self.chunkSize - self.stylesOffset
@@ -362,13 +725,12 @@ class StringBlock(object):
             if (size % 4) != 0:
                 warning("ooo")
 
-            for i in range(0, size / 4):
-                self.m_styles.append(unpack('<i', buff.read(4))[0])
+            self.m_styles = buff.read_array('i', size // 4)
 
     def skipNullPadding(self, buff):
 
         def readNext(buff, first_run=True):
-            header = unpack('<i', buff.read(4))[0]
+            header = buff.read_int32()
 
             if header == CHUNK_NULL_TYPE and first_run:
                 info("Skipping null padding in StringBlock header")
@@ -424,37 +786,34 @@ class StringBlock(object):
         return self.decode_bytes(data, 'utf-16', str_len)
 
     def decode_bytes(self, data, encoding, str_len):
-        string = data.decode(encoding, 'replace')
+        string = str(data, encoding, 'replace')
         if len(string) != str_len:
             warning("invalid decoded string length")
         return string
 
     def decodeLength(self, offset, sizeof_char):
-        length = ord(self.m_charbuff[offset])
-
         sizeof_2chars = sizeof_char << 1
-        fmt_chr = 'B' if sizeof_char == 1 else 'H'
-        fmt = "<2" + fmt_chr
+        pair = UINT8_PAIR if sizeof_char == 1 else UINT16_PAIR
 
-        length1, length2 = unpack(fmt, self.m_charbuff[offset:(offset + sizeof_2chars)])
+        length1, length2 = pair.unpack_from(self.m_charbuff, offset)
 
         highbit = 0x80 << (8 * (sizeof_char - 1))
 
-        if (length & highbit) != 0:
+        if (length1 & highbit) != 0:
             return ((length1 & ~highbit) << (8 * sizeof_char)) | length2, sizeof_2chars
         else:
             return length1, sizeof_char
 
     def show(self):
-        print "StringBlock(%x, %x, %x, %x, %x, %x" % (
+        print("StringBlock(%x, %x, %x, %x, %x, %x" % (
             self.start,
             self.header,
             self.header_size,
             self.chunkSize,
             self.stringsOffset,
-            self.flags)
+            self.flags))
         for i in range(0, len(self.m_stringOffsets)):
-            print i, repr(self.getString(i))
+            print(i, repr(self.getString(i)))
 
 START_DOCUMENT = 0
 END_DOCUMENT = 1
@@ -479,6 +838,16 @@ CHUNK_XML_END_TAG = 0x00100103
 CHUNK_XML_TEXT = 0x00100104
 CHUNK_XML_LAST = 0x00100104
 
+# events of iter(AXMLParser), uri is '' without a namespace,
+# namespaces are the (prefix, uri) declared before the tag
+AXMLStartTag = namedtuple(
+    'AXMLStartTag', 'name prefix uri namespaces attributes line')
+AXMLEndTag = namedtuple('AXMLEndTag', 'name prefix uri line')
+AXMLText = namedtuple('AXMLText', 'text line')
+# value is formatted like AXMLPrinter, type and data are raw
+AXMLAttribute = namedtuple(
+    'AXMLAttribute', 'name prefix uri value type data')
+
 
 class AXMLParser(object):
 
@@ -488,14 +857,14 @@ class AXMLParser(object):
         self.valid_axml = True
         self.buff = BuffHandle(raw_buff)
 
-        axml_file = unpack('<L', self.buff.read(4))[0]
+        axml_file = self.buff.read_uint32()
 
         if axml_file == CHUNK_AXML_FILE:
-            self.buff.read(4)
+            self.buff.skip(4)
 
             self.sb = StringBlock(self.buff)
 
-            self.m_resourceIDs = []
+            self.m_resourceIDs = array('I')
             self.m_prefixuri = {}
             self.m_uriprefix = {}
             self.m_prefixuriL = []
@@ -522,6 +891,27 @@ class AXMLParser(object):
         self.doNext()
         return self.m_event
 
+    def __iter__(self):
+        """
+            Iterate over the rest of the document as AXMLStartTag,
+            AXMLEndTag and AXMLText events, one chunk at a time
+        """
+        while self.is_valid():
+            _type = self.next()
+            if _type == START_TAG:
+                yield AXMLStartTag(self.getName(), self.getPrefix(),
+                                   self.sb.getString(self.m_namespaceUri),
+                                   self.getNewNamespaces(),
+                                   self.getAttributes(), self.m_lineNumber)
+            elif _type == END_TAG:
+                yield AXMLEndTag(self.getName(), self.getPrefix(),
+                                 self.sb.getString(self.m_namespaceUri),
+                                 self.m_lineNumber)
+            elif _type == TEXT:
+                yield AXMLText(self.getText(), self.m_lineNumber)
+            elif _type == END_DOCUMENT:
+                break
+
     def doNext(self):
         if self.m_event == END_DOCUMENT:
             return
@@ -543,17 +933,16 @@ class AXMLParser(object):
                 if self.buff.end():
                     self.m_event = END_DOCUMENT
                     break
-                chunkType = unpack('<L', self.buff.read(4))[0]
+                chunkType = self.buff.read_uint32()
 
             if chunkType == CHUNK_RESOURCEIDS:
-                chunkSize = unpack('<L', self.buff.read(4))[0]
+                chunkSize = self.buff.read_uint32()
                 # FIXME
                 if chunkSize < 8 or chunkSize % 4 != 0:
                     warning("Invalid chunk size")
 
-                for i in range(0, chunkSize / 4 - 2):
-                    self.m_resourceIDs.append(
-                        unpack('<L', self.buff.read(4))[0])
+                self.m_resourceIDs.extend(
+                    self.buff.read_array('I', chunkSize // 4 - 2))
 
                 continue
 
@@ -566,14 +955,12 @@ class AXMLParser(object):
                 self.m_event = START_DOCUMENT
                 break
 
-            self.buff.read(4)  # /*chunkSize*/
-            lineNumber = unpack('<L', self.buff.read(4))[0]
-            self.buff.read(4)  # 0xFFFFFFFF
+            # /*chunkSize*/, lineNumber, 0xFFFFFFFF
+            lineNumber = self.buff.unpack(AXML_CHUNK_HEADER)[1]
 
             if chunkType == CHUNK_XML_START_NAMESPACE or chunkType == CHUNK_XML_END_NAMESPACE:
                 if chunkType == CHUNK_XML_START_NAMESPACE:
-                    prefix = unpack('<L', self.buff.read(4))[0]
-                    uri = unpack('<L', self.buff.read(4))[0]
+                    prefix, uri = self.buff.unpack(UINT32_PAIR)
 
                     self.m_prefixuri[prefix] = uri
                     self.m_uriprefix[uri] = prefix
@@ -581,8 +968,7 @@ class AXMLParser(object):
                     self.ns = uri
                 else:
                     self.ns = -1
-                    self.buff.read(4)
-                    self.buff.read(4)
+                    self.buff.skip(8)
                     (prefix, uri) = self.m_prefixuriL.pop()
 
                 continue
@@ -590,42 +976,37 @@ class AXMLParser(object):
             self.m_lineNumber = lineNumber
 
             if chunkType == CHUNK_XML_START_TAG:
-                self.m_namespaceUri = unpack('<L', self.buff.read(4))[0]
-                self.m_name = unpack('<L', self.buff.read(4))[0]
-
-                # FIXME
-                self.buff.read(4)  # flags
+                # FIXME flags
+                (self.m_namespaceUri, self.m_name, _, attributeCount,
+                 self.m_classAttribute) = self.buff.unpack(AXML_START_TAG)
 
-                attributeCount = unpack('<L', self.buff.read(4))[0]
                 self.m_idAttribute = (attributeCount >> 16) - 1
                 attributeCount = attributeCount & 0xFFFF
-                self.m_classAttribute = unpack('<L', self.buff.read(4))[0]
                 self.m_styleAttribute = (self.m_classAttribute >> 16) - 1
 
                 self.m_classAttribute = (self.m_classAttribute & 0xFFFF) - 1
 
-                for i in range(0, attributeCount * ATTRIBUTE_LENGHT):
-                    self.m_attributes.append(unpack('<L', self.buff.read(4))[0])
+                self.m_attributes = self.buff.read_array(
+                    'I', attributeCount * ATTRIBUTE_LENGHT)
 
                 for i in range(ATTRIBUTE_IX_VALUE_TYPE, len(self.m_attributes),
                                ATTRIBUTE_LENGHT):
-                    self.m_attributes[i] = self.m_attributes[i] >> 24
+                    self.m_attributes[i] >>= 24
 
                 self.m_event = START_TAG
                 break
 
             if chunkType == CHUNK_XML_END_TAG:
-                self.m_namespaceUri = unpack('<L', self.buff.read(4))[0]
-                self.m_name = unpack('<L', self.buff.read(4))[0]
+                self.m_namespaceUri, self.m_name = self.buff.unpack(
+                    UINT32_PAIR)
                 self.m_event = END_TAG
                 break
 
             if chunkType == CHUNK_XML_TEXT:
-                self.m_name = unpack('<L', self.buff.read(4))[0]
+                self.m_name = self.buff.read_uint32()
 
                 # FIXME
-                self.buff.read(4)
-                self.buff.read(4)
+                self.buff.skip(8)
 
                 self.m_event = TEXT
                 break
@@ -663,15 +1044,20 @@ class AXMLParser(object):
         uri = self.m_prefixuriL[pos][1]
         return self.sb.getString(uri)
 
-    def getXMLNS(self):
-        buff = ""
+    def getNewNamespaces(self):
+        # (prefix, uri) of the namespaces not returned before
+        namespaces = []
         for i in self.m_uriprefix:
             if i not in self.visited_ns:
-                buff += "xmlns:%s=\"%s\"\n" % (
+                namespaces.append((
                     self.sb.getString(self.m_uriprefix[i]),
-                    self.sb.getString(self.m_prefixuri[self.m_uriprefix[i]]))
+                    self.sb.getString(self.m_prefixuri[self.m_uriprefix[i]])))
                 self.visited_ns.append(i)
-        return buff
+        return namespaces
+
+    def getXMLNS(self):
+        return u"".join(u"xmlns:%s=\"%s\"\n" % ns
+                        for ns in self.getNewNamespaces())
 
     def getNamespaceCount(self, pos):
         pass
@@ -692,7 +1078,7 @@ class AXMLParser(object):
         if self.m_event != START_TAG:
             return -1
 
-        return len(self.m_attributes) / ATTRIBUTE_LENGHT
+        return len(self.m_attributes) // ATTRIBUTE_LENGHT
 
     def getAttributePrefix(self, index):
         offset = self.getAttributeOffset(index)
@@ -739,6 +1125,23 @@ class AXMLParser(object):
         # WIP
         return ""
 
+    def getAttributes(self):
+        # AXMLAttribute of all attributes of the current START_TAG
+        attributes = []
+        for i in range(0, self.getAttributeCount()):
+            offset = i * ATTRIBUTE_LENGHT
+            _type = self.m_attributes[offset + ATTRIBUTE_IX_VALUE_TYPE]
+            _data = self.m_attributes[offset + ATTRIBUTE_IX_VALUE_DATA]
+            attributes.append(AXMLAttribute(
+                self.getAttributeName(i),
+                self.getAttributePrefix(i),
+                self.sb.getString(
+                    self.m_attributes[offset + ATTRIBUTE_IX_NAMESPACE_URI]),
+                format_value(_type, _data,
+                             lambda _: self.getAttributeValue(i)),
+                _type, _data))
+        return attributes
+
 # resource constants
 
 TYPE_ATTRIBUTE = 2
@@ -822,42 +1225,178 @@ def format_value(_type, _data, lookup_string=lambda ix: "<string>"):
     return "<0x%X, type 0x%02X>" % (_data, _type)
 
 
-class AXMLPrinter(object):
+# android: attributes read by parse_manifest(), by resource id so that
+# stripped attribute names still resolve
+MANIFEST_ATTRIBUTES = {
+    0x01010001: "label",
+    0x01010002: "icon",
+    0x01010003: "name",
+    0x0101020c: "minSdkVersion",
+    0x0101021b: "versionCode",
+    0x0101021c: "versionName",
+    0x01010270: "targetSdkVersion",
+    0x01010271: "maxSdkVersion",
+}
+MANIFEST_FIELDS = ("package", "versionCode", "versionName")
+SDK_FIELDS = ("minSdkVersion", "targetSdkVersion", "maxSdkVersion")
+PERMISSION_FIELDS = ("name",)
+APPLICATION_FIELDS = ("label", "icon")
+# keyword options of parse_manifest() beyond the MANIFEST_FIELDS
+MANIFEST_OPTIONS = ("sdk", "permissions", "application")
 
-    def __init__(self, raw_buff):
-        self.axml = AXMLParser(raw_buff)
-        self.xmlns = False
 
-        self.buff = u''
+def get_manifest_attributes(axml, names):
+    """
+        Return the attributes of the current START_TAG of axml whose
+        names are in names, formatted like AXMLPrinter does
 
-        while True and self.axml.is_valid():
-            _type = self.axml.next()
+        :rtype: dict
+    """
+    values = {}
+    ids = axml.m_resourceIDs
+    attributes = axml.m_attributes
+    for i in range(axml.getAttributeCount()):
+        offset = i * ATTRIBUTE_LENGHT
+        name_ix = attributes[offset + ATTRIBUTE_IX_NAME]
+        name = MANIFEST_ATTRIBUTES.get(ids[name_ix]) \
+            if name_ix < len(ids) else None
+        if name is None:
+            name = axml.sb.getString(name_ix)
+            uri = axml.sb.getString(
+                attributes[offset + ATTRIBUTE_IX_NAMESPACE_URI])
+            # package has no namespace, all others are android:
+            if (uri == NS_ANDROID_URI) == (name == "package"):
+                continue
+        if name in names and name not in values:
+            values[name] = format_value(
+                attributes[offset + ATTRIBUTE_IX_VALUE_TYPE],
+                attributes[offset + ATTRIBUTE_IX_VALUE_DATA],
+                lambda _: axml.getAttributeValue(i))
+    return values
 
-            if _type == START_DOCUMENT:
-                self.buff += u'<?xml version="1.0" encoding="utf-8"?>\n'
-            elif _type == START_TAG:
-                self.buff += u'<' + self.getPrefix(self.axml.getPrefix(
-                )) + self.axml.getName() + u'\n'
-                self.buff += self.axml.getXMLNS()
 
-                for i in range(0, self.axml.getAttributeCount()):
-                    self.buff += "%s%s=\"%s\"\n" % (
-                        self.getPrefix(
-                            self.axml.getAttributePrefix(i)),
-                        self.axml.getAttributeName(i),
-                        self._escape(self.getAttributeValue(i)))
+def parse_manifest(raw_buff, sdk=False, permissions=False,
+                   application=False):
+    """
+        Return package, versionCode and versionName of a binary
+        AndroidManifest.xml (and with sdk the <uses-sdk> levels, with
+        permissions the <uses-permission> names as a "permissions"
+        list, with application the label and icon of <application>)
+        from the AXMLParser events, stops once the requested elements
+        were seen without building XML text or a DOM, None if not a
+        manifest
+
+        :rtype: dict
+    """
+    axml = AXMLParser(raw_buff)
+    if not axml.is_valid():
+        return None
+    fields = None
+    depth = 0
+    while True:
+        _type = axml.next()
+        if _type == END_DOCUMENT:
+            break
+        elif _type == START_TAG:
+            depth += 1
+            if depth == 1:
+                if axml.getName() != "manifest":
+                    return None
+                fields = get_manifest_attributes(axml, MANIFEST_FIELDS)
+                if permissions:
+                    fields["permissions"] = []
+            elif depth == 2:
+                name = axml.getName()
+                if sdk and name == "uses-sdk":
+                    fields.update(get_manifest_attributes(axml, SDK_FIELDS))
+                    sdk = False
+                elif application and name == "application":
+                    fields.update(get_manifest_attributes(
+                        axml, APPLICATION_FIELDS))
+                    application = False
+                elif permissions and name == "uses-permission":
+                    permission = get_manifest_attributes(
+                        axml, PERMISSION_FIELDS).get("name")
+                    if permission:
+                        fields["permissions"].append(permission)
+            # permissions may follow anywhere, the others are seen once
+            if not (sdk or permissions or application):
+                break
+        elif _type == END_TAG:
+            depth -= 1
+    return fields
 
-                self.buff += u'>\n'
 
-            elif _type == END_TAG:
-                self.buff += "</%s%s>\n" % (
-                    self.getPrefix(self.axml.getPrefix()), self.axml.getName())
+def build_tree(raw_buff, builder=None):
+    """
+        Feed the events of a binary XML document into an ElementTree
+        TreeBuilder (or any builder with start/end/data/close), names
+        of namespaced tags and attributes are {uri}name
 
-            elif _type == TEXT:
-                self.buff += "%s\n" % self.axml.getText()
+        :rtype: the result of builder.close(), an Element by default
+    """
+    if builder is None:
+        from xml.etree.ElementTree import TreeBuilder
+        builder = TreeBuilder()
+
+    def qname(uri, name):
+        return u'{%s}%s' % (uri, name) if uri else name
+
+    for event in AXMLParser(raw_buff):
+        if isinstance(event, AXMLStartTag):
+            builder.start(qname(event.uri, event.name),
+                          dict((qname(a.uri, a.name), a.value)
+                               for a in event.attributes))
+        elif isinstance(event, AXMLEndTag):
+            builder.end(qname(event.uri, event.name))
+        else:
+            builder.data(event.text)
+    return builder.close()
 
-            elif _type == END_DOCUMENT:
-                break
+
+class AXMLPrinter(object):
+    """
+        XML text of a binary XML document, kept in buff, or written
+        to sink (any file-like object taking str) as it is decoded
+    """
+
+    def __init__(self, raw_buff, sink=None):
+        self.axml = AXMLParser(raw_buff)
+        self.xmlns = False
+
+        if sink is not None:
+            self.buff = None
+            self.write(sink)
+        else:
+            out = io.StringIO()
+            self.write(out)
+            self.buff = out.getvalue()
+
+    def write(self, sink):
+        first = True
+        for event in self.axml:
+            if isinstance(event, AXMLStartTag):
+                if first:
+                    # START_DOCUMENT, only reported before a first tag
+                    sink.write(u'<?xml version="1.0" encoding="utf-8"?>\n')
+                parts = [u'<', self.getPrefix(event.prefix), event.name,
+                         u'\n']
+                for ns in event.namespaces:
+                    parts.append(u'xmlns:%s="%s"\n' % ns)
+                for attribute in event.attributes:
+                    parts.append(u'%s%s="%s"\n' % (
+                        self.getPrefix(attribute.prefix), attribute.name,
+                        self._escape(attribute.value)))
+                parts.append(u'>\n')
+                sink.write(u''.join(parts))
+
+            elif isinstance(event, AXMLEndTag):
+                sink.write(u'</%s%s>\n' % (
+                    self.getPrefix(event.prefix), event.name))
+
+            elif isinstance(event, AXMLText):
+                sink.write(u'%s\n' % event.text)
+            first = False
 
     # pleed patch
     def _escape(self, s):
@@ -866,16 +1405,21 @@ class AXMLPrinter(object):
         s = s.replace("'", "&apos;")
         s = s.replace("<", "&lt;")
         s = s.replace(">", "&gt;")
+        from xml.sax.saxutils import escape
         return escape(s)
 
     def get_buff(self):
+        if self.buff is None:
+            raise ValueError("AXMLPrinter was written to a sink")
         return self.buff.encode('utf-8')
 
     def get_xml(self):
+        from xml.dom import minidom
         return minidom.parseString(self.get_buff()).toprettyxml(
             encoding="utf-8")
 
     def get_xml_obj(self):
+        from xml.dom import minidom
         return minidom.parseString(self.get_buff())
 
     def getPrefix(self, prefix):
@@ -891,6 +1435,283 @@ class AXMLPrinter(object):
         return format_value(_type, _data, lambda _: self.axml.getAttributeValue(index))
 
 
+################################## ARSC FORMAT ########################################
+# Translated from
+# https://android.googlesource.com/platform/frameworks/base/+/master/libs/androidfw/include/androidfw/ResourceTypes.h
+
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+
+# ResTable_type flags
+TYPE_FLAG_SPARSE = 0x01
+TYPE_FLAG_OFFSET16 = 0x02
+
+# ResTable_entry flags
+ENTRY_FLAG_COMPLEX = 0x0001
+ENTRY_FLAG_COMPACT = 0x0008
+
+NO_ENTRY = 0xFFFFFFFF
+NO_ENTRY16 = 0xFFFF
+
+# references followed by ARSCParser.get_string()
+MAX_REFERENCE_DEPTH = 8
+
+# one package of a table, types maps a type id to its ARSCType chunks
+ARSCPackage = namedtuple("ARSCPackage", "id name types")
+# one ResTable_type chunk, absolute offsets of its entry offsets and
+# entries, plain is true if it has no qualifier besides the locale
+ARSCType = namedtuple(
+    "ARSCType", "offsets entries flags entry_count language country plain")
+ARSCValue = namedtuple("ARSCValue", "type data")
+
+
+def unpack_locale(data, base):
+    """
+        Return the language (base "a") or region (base "0") of the two
+        bytes of a ResTable_config, packed three letter codes included
+
+        :rtype: string
+    """
+    first, second = bytearray(data)
+    if first & 0x80:
+        return "".join(chr(c + ord(base)) for c in (
+            second & 0x1f,
+            ((second & 0xe0) >> 5) + ((first & 0x03) << 3),
+            (first & 0x7c) >> 2))
+    if first == 0:
+        return ""
+    return chr(first) + chr(second)
+
+
+def parse_locale(locale):
+    """
+        Return (language, region) of a locale like "zh", "zh-rCN" or
+        "zh_CN", ("", "") for None, the default configuration
+
+        :rtype: tuple
+    """
+    if not locale:
+        return "", ""
+    parts = locale.replace("_", "-").split("-")
+    region = parts[1] if len(parts) > 1 else ""
+    if len(region) == 3 and region[0] == "r":
+        region = region[1:]
+    return parts[0].lower(), region.upper()
+
+
+class ARSCParser(object):
+    """
+        Reader of a resources.arsc that walks only the chunk headers up
+        front, indexing package -> type -> ResTable_type chunks, and
+        decodes the entries and strings of a resource id on demand
+
+        :param raw_buff: the table as bytes, a memoryview or an mmap
+
+        :Example:
+          arsc = ARSCParser(apk.zip.read("resources.arsc"))
+          arsc.get_string(0x7f0b0001, locale="zh-rCN")
+    """
+
+    def __init__(self, raw_buff):
+        self.buff = raw_buff
+        self.packages = {}
+        self.__strings = None
+        self.__strings_offset = None
+
+        if len(raw_buff) < 12:
+            raise ResParserError("resources.arsc too small")
+        _type, header_size, size = RES_CHUNK_HEADER.unpack_from(raw_buff, 0)
+        if _type != RES_TABLE_TYPE:
+            raise ResParserError("Not a resources.arsc: 0x%04x" % _type)
+
+        for offset, _type, header_size, size in self.__chunks(
+                header_size, min(size, len(raw_buff))):
+            if _type == RES_STRING_POOL_TYPE:
+                if self.__strings_offset is None:
+                    self.__strings_offset = offset
+            elif _type == RES_TABLE_PACKAGE_TYPE:
+                package = self.__index_package(offset, header_size, size)
+                self.packages[package.id] = package
+
+    def __chunks(self, offset, end):
+        # (offset, type, header size, size) of the chunks up to end
+        while offset + 8 <= end:
+            _type, header_size, size = RES_CHUNK_HEADER.unpack_from(
+                self.buff, offset)
+            if size < 8 or offset + size > end:
+                raise ResParserError("Invalid chunk size at 0x%x" % offset)
+            yield offset, _type, header_size, size
+            offset += size
+
+    def __index_package(self, offset, header_size, size):
+        buff = self.buff
+        package_id = UINT32.unpack_from(buff, offset + 8)[0]
+        name = str(bytes(buff[offset + 12:offset + 268]), "utf-16-le",
+                   "replace").split("\0", 1)[0]
+        # type ids of the chunks are relative to typeIdOffset, if present
+        type_id_offset = 0
+        if header_size >= 288:
+            type_id_offset = UINT32.unpack_from(buff, offset + 284)[0]
+
+        types = {}
+        # (language, region) by the 4 locale bytes, tables have few locales
+        locales = {b"": ("", "")}
+        for chunk, _type, chunk_header_size, _ in self.__chunks(
+                offset + header_size, offset + size):
+            if _type != RES_TABLE_TYPE_TYPE:
+                continue
+            type_id, flags, _, entry_count, entries_start = \
+                RES_TABLE_TYPE_HEADER.unpack_from(buff, chunk + 8)
+            # ResTable_config: size, imsi, locale, then other qualifiers
+            config_size = UINT32.unpack_from(buff, chunk + 20)[0]
+            config = bytes(buff[chunk + 20:chunk + 20 + config_size])
+            locale = config[8:12]
+            if locale not in locales:
+                locales[locale] = (unpack_locale(locale[:2], "a"),
+                                   unpack_locale(locale[2:], "0"))
+            language, country = locales[locale]
+            plain = config.count(0, 4, 8) == 4 and \
+                config.count(0, 12) == len(config) - 12
+            types.setdefault(type_id + type_id_offset, []).append(ARSCType(
+                chunk + chunk_header_size, chunk + entries_start, flags,
+                entry_count, language, country, plain))
+        return ARSCPackage(package_id, name, types)
+
+    @property
+    def strings(self):
+        """
+            :class:`StringBlock` of the global string pool, read on first use
+        """
+        if self.__strings is None and self.__strings_offset is not None:
+            buff = BuffHandle(self.buff)
+            buff.set_idx(self.__strings_offset)
+            self.__strings = StringBlock(buff)
+        return self.__strings
+
+    def get_pool_string(self, idx):
+        """
+            Return string idx of the global string pool
+
+            :rtype: string
+        """
+        strings = self.strings
+        return "" if strings is None else strings.getString(idx)
+
+    def get_locales(self):
+        """
+            Return the locales of all type chunks, like "zh-rCN", "" for
+            the default configuration
+
+            :rtype: list of string
+        """
+        locales = set()
+        for package in self.packages.values():
+            for chunks in package.types.values():
+                for t in chunks:
+                    locales.add(t.language + ("-r" + t.country
+                                              if t.country else ""))
+        return sorted(locales)
+
+    def __entry_offset(self, t, index):
+        # absolute offset of entry index of type chunk t, None if absent
+        buff = self.buff
+        if t.flags & TYPE_FLAG_SPARSE:
+            # (entry index, offset / 4) pairs sorted by entry index
+            lo, hi = 0, t.entry_count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                idx, offset = UINT16_PAIR.unpack_from(buff, t.offsets + mid * 4)
+                if idx < index:
+                    lo = mid + 1
+                elif idx > index:
+                    hi = mid
+                else:
+                    return t.entries + offset * 4
+            return None
+        if index >= t.entry_count:
+            return None
+        if t.flags & TYPE_FLAG_OFFSET16:
+            offset = UINT16.unpack_from(buff, t.offsets + index * 2)[0]
+            if offset == NO_ENTRY16:
+                return None
+            return t.entries + offset * 4
+        offset = UINT32.unpack_from(buff, t.offsets + index * 4)[0]
+        if offset == NO_ENTRY:
+            return None
+        return t.entries + offset
+
+    def get_value(self, res_id, locale=None):
+        """
+            Return the :class:`ARSCValue` of res_id in the configuration
+            closest to locale: language and region, then language, then
+            the default one, chunks without other qualifiers first, any
+            configuration as a last resort; None if res_id has no entry
+            or is a bag (style, array, plurals)
+
+            :rtype: :class:`ARSCValue`
+        """
+        package = self.packages.get(res_id >> 24)
+        if package is None:
+            return None
+        chunks = package.types.get((res_id >> 16) & 0xFF)
+        if not chunks:
+            return None
+        index = res_id & 0xFFFF
+        language, country = parse_locale(locale)
+
+        best = best_score = None
+        for t in chunks:
+            if not t.language:
+                score = (0, t.plain)
+            elif t.language != language or t.country not in ("", country):
+                continue
+            else:
+                score = (2 if t.country else 1, t.plain)
+            if best_score is not None and score <= best_score:
+                continue
+            offset = self.__entry_offset(t, index)
+            if offset is not None:
+                best, best_score = offset, score
+        if best is None:
+            for t in chunks:
+                best = self.__entry_offset(t, index)
+                if best is not None:
+                    break
+            else:
+                return None
+
+        size, flags, key = RES_TABLE_ENTRY.unpack_from(self.buff, best)
+        if flags & ENTRY_FLAG_COMPACT:
+            # the data is stored in place of the key, its type in flags
+            return ARSCValue(flags >> 8, key)
+        if flags & ENTRY_FLAG_COMPLEX:
+            return None
+        _, _, _type, data = RES_VALUE.unpack_from(self.buff, best + size)
+        return ARSCValue(_type, data)
+
+    def get_string(self, res_id, locale=None):
+        """
+            Return the value of res_id formatted like AXMLPrinter does,
+            references to resources of this table are followed, None if
+            res_id has no value
+
+            :rtype: string
+        """
+        value = self.get_value(res_id, locale)
+        for _ in range(MAX_REFERENCE_DEPTH):
+            if value is None or value.type != TYPE_REFERENCE:
+                break
+            target = self.get_value(value.data, locale)
+            if target is None:
+                break
+            value = target
+        if value is None:
+            return None
+        return format_value(value.type, value.data, self.get_pool_string)
+
+
 class SV(object):
 
     def __init__(self, size, buff):
@@ -949,6 +1770,7 @@ class BuffHandle(object):
 
     def __init__(self, buff):
         self.__buff = buff
+        self.__view = memoryview(buff)
         self.__idx = 0
 
     def size(self):
@@ -979,6 +1801,41 @@ class BuffHandle(object):
 
         return buff
 
+    def read_view(self, size):
+        # zero-copy memoryview of the next size bytes
+        view = self.__view[self.__idx:self.__idx + size]
+        self.__idx += size
+        return view
+
+    def read_array(self, typecode, count):
+        # count little-endian 32-bit values as an array of typecode
+        values = array(typecode)
+        size = count * values.itemsize
+        values.frombytes(self.__view[self.__idx:self.__idx + size])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        self.__idx += size
+        return values
+
+    def read_uint32(self):
+        value = UINT32.unpack_from(self.__buff, self.__idx)[0]
+        self.__idx += 4
+        return value
+
+    def read_int32(self):
+        value = INT32.unpack_from(self.__buff, self.__idx)[0]
+        self.__idx += 4
+        return value
+
+    def unpack(self, st):
+        # all fields of the struct.Struct st at once
+        values = st.unpack_from(self.__buff, self.__idx)
+        self.__idx += st.size
+        return values
+
+    def skip(self, size):
+        self.__idx += size
+
     def end(self):
         return self.__idx == len(self.__buff)
 
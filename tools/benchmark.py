@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+benchmarks of the packer-ng-v2.py lookup hot paths on synthetic apks
+
+each scenario builds an apk with a signing block layout (fake v2 block
+and plugin payload, binary AndroidManifest.xml) of a given size, entry
+count, archive comment, signing block and payload size, each benchmark
+runs in a fresh interpreter, its peak rss is reported next to the rss
+of an interpreter that only imported the benchmark
+
+    python tools/benchmark.py -o before.json
+    python tools/benchmark.py -o after.json --compare before.json
+'''
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import struct
+import zipfile
+import argparse
+import platform
+import tempfile
+import importlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+packer = importlib.import_module('packer-ng-v2')
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# name, apk size, entries, comment, v2 block size, payload size
+SCENARIOS = (
+    ('small', 0x100000, 64, 0, 0x1000, 64),
+    ('medium', 0x1000000, 2000, 0, 0x1000, 64),
+    ('entries', 0x400000, 20000, 0, 0x1000, 64),
+    ('comment', 0x100000, 64, 0xfff0, 0x1000, 64),
+    ('block', 0x400000, 256, 0, 0x40000, 0x10000),
+    ('large', 0x6000000, 4000, 0, 0x2000, 1024),
+)
+
+QUICK_SCENARIOS = ('small', 'comment', 'block')
+
+BENCHMARKS = (
+    'getChannel',
+    'findBlockByPluginMagic',
+    'findBlockBySigningMagic',
+    'findBlockByZipSections',
+    'findBySigningMagic',
+    'findByZipSections',
+    'findEocdStartOffset',
+    'parseValues',
+    'apkinfo.APK',
+)
+
+MIN_TIME = 0.5
+MIN_ROUNDS = 5
+MAX_ROUNDS = 100000
+
+#####################################################################
+
+ANDROID_NS = 'http://schemas.android.com/apk/res/android'
+# android attribute -> resource id
+ANDROID_ATTRS = {
+    'label': 0x01010001,
+    'icon': 0x01010002,
+    'name': 0x01010003,
+    'minSdkVersion': 0x0101020c,
+    'versionCode': 0x0101021b,
+    'versionName': 0x0101021c,
+    'targetSdkVersion': 0x01010270,
+}
+TYPE_REFERENCE = 0x01
+TYPE_STRING = 0x03
+TYPE_INT_DEC = 0x10
+
+
+def makeStringPool(strings):
+    # utf-16 string pool chunk
+    offsets = []
+    data = b''
+    for s in strings:
+        offsets.append(len(data))
+        data += struct.pack('<H', len(s)) + \
+            s.encode('utf-16-le') + b'\0\0'
+    data += b'\0' * (-len(data) % 4)
+    start = 28 + 4 * len(strings)
+    return struct.pack('<HHIIIIII', 0x0001, 28, start + len(data),
+                       len(strings), 0, 0, start, 0) + \
+        b''.join(struct.pack('<I', o) for o in offsets) + data
+
+
+def makeManifest(package, versionCode, versionName, activities=16,
+                 permissions=8, label='Benchmark'):
+    '''
+    binary AndroidManifest.xml as written by aapt, an int versionName
+    or label is a resource reference like @string/app_name
+    '''
+    def kind(value):
+        return TYPE_REFERENCE if isinstance(value, int) else TYPE_STRING
+
+    elements = [
+        ('manifest', [('versionCode', TYPE_INT_DEC, versionCode),
+                      ('versionName', kind(versionName), versionName),
+                      ('package', TYPE_STRING, package)]),
+        ('uses-sdk', [('minSdkVersion', TYPE_INT_DEC, 16),
+                      ('targetSdkVersion', TYPE_INT_DEC, 28)]), None]
+    for i in range(permissions):
+        elements += [('uses-permission', [
+            ('name', TYPE_STRING, 'android.permission.P{}'.format(i))]), None]
+    elements.append(('application', [('label', kind(label), label),
+                                     ('icon', TYPE_INT_DEC, 0x7f020000)]))
+    for i in range(activities):
+        elements += [('activity', [
+            ('name', TYPE_STRING, '{}.Activity{}'.format(package, i))]),
+            None]
+    elements += [None, None]
+    # resource mapped attribute names first, like aapt
+    strings = [a for a in ANDROID_ATTRS]
+
+    def index(s):
+        if s not in strings:
+            strings.append(s)
+        return strings.index(s)
+
+    ns = (index('android'), index(ANDROID_NS))
+    body = struct.pack('<HHIII2I', 0x0100, 16, 24, 1, 0xffffffff, *ns)
+    stack = []
+    for e in elements:
+        if e is None:
+            body += struct.pack('<HHIIIII', 0x0103, 16, 24, 1, 0xffffffff,
+                                0xffffffff, index(stack.pop()))
+            continue
+        name, attrs = e
+        stack.append(name)
+        chunk = struct.pack('<IIHHHHHH', 0xffffffff, index(name),
+                            20, 20, len(attrs), 0, 0, 0)
+        for attr, kind, value in attrs:
+            attrNs = ns[1] if attr in ANDROID_ATTRS else 0xffffffff
+            raw = index(value) if kind == TYPE_STRING else 0xffffffff
+            data = raw if kind == TYPE_STRING else value
+            chunk += struct.pack('<IIIHBBI', attrNs, index(attr), raw,
+                                 8, 0, kind, data)
+        body += struct.pack('<HHIII', 0x0102, 16, 24 + len(chunk) - 8, 1,
+                            0xffffffff) + chunk
+    body += struct.pack('<HHIII2I', 0x0101, 16, 24, 1, 0xffffffff, *ns)
+    resourceMap = struct.pack('<HHI', 0x0180, 8, 8 + 4 * len(ANDROID_ATTRS))
+    resourceMap += b''.join(struct.pack('<I', ANDROID_ATTRS[a])
+                            for a in ANDROID_ATTRS)
+    content = makeStringPool(strings) + resourceMap + body
+    return struct.pack('<HHI', 0x0003, 8, 8 + len(content)) + content
+
+
+def makeApk(path, size, entries, commentSize=0, blockSize=0x1000,
+            payloadSize=64, channel='benchmark', seed=1):
+    '''
+    synthetic apk of about size bytes: manifest, entries stored or
+    deflated, archive comment, APK Signing Block with a fake v2 block of
+    blockSize bytes and a plugin payload padded by payloadSize bytes
+    '''
+    rnd = random.Random(seed)
+    entrySize = max(1, (size - 0x1000) // max(1, entries))
+    pool = bytes(bytearray(rnd.getrandbits(8) for _ in range(0x10000)))
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, True) as z:
+        z.writestr('AndroidManifest.xml',
+                   makeManifest('com.mcxiaoke.benchmark', 100, '1.0.0'),
+                   zipfile.ZIP_DEFLATED)
+        for i in range(entries):
+            start = rnd.randrange(len(pool))
+            data = (pool[start:] + pool) * (entrySize // len(pool) + 1)
+            z.writestr('res/raw/r{:05d}.bin'.format(i), data[:entrySize],
+                       zipfile.ZIP_DEFLATED if i % 4 == 0
+                       else zipfile.ZIP_STORED)
+        z.comment = b'c' * commentSize
+    with packer.ApkView(path) as v:
+        sections = v.sections
+        cdEndOffset = sections.cdStartOffset + sections.cdSizeBytes
+        layout = packer.ApkLayout(
+            sections.cdStartOffset,
+            [(packer.APK_SIGNATURE_SCHEME_V2_BLOCK_ID,
+              os.urandom(blockSize))], {},
+            v.centralDirectory().tobytes(), v.view[cdEndOffset:].tobytes(),
+            sections.eocdOffset - cdEndOffset,
+            sections.zip64EocdOffset is not None)
+    values = {packer.PLUGIN_CHANNEL_KEY: channel}
+    if payloadSize:
+        values['padding'] = 'p' * payloadSize
+    with open(path, 'r+b') as f:
+        f.seek(layout.blockOffset)
+        f.write(layout.makeTail(values))
+        f.truncate()
+    return path
+
+#####################################################################
+
+
+def maxRssKb(usage):
+    # ru_maxrss is kilobytes on linux, bytes on macos
+    if sys.platform == 'darwin':
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+
+def measure(func, minTime=MIN_TIME, maxRounds=MAX_ROUNDS):
+    '''
+    call func until minTime passed, latency stats in microseconds
+    '''
+    func()
+    times = []
+    clock = time.perf_counter
+    start = clock()
+    while len(times) < maxRounds:
+        ts = clock()
+        func()
+        times.append(clock() - ts)
+        if len(times) >= MIN_ROUNDS and ts - start >= minTime:
+            break
+    total = sum(times)
+    times.sort()
+    return {
+        'rounds': len(times),
+        'ops_per_sec': round(len(times) / total, 2) if total else None,
+        'mean_us': round(total / len(times) * 1e6, 3),
+        'p50_us': round(times[len(times) // 2] * 1e6, 3),
+        'p99_us': round(times[min(len(times) - 1,
+                                  int(len(times) * 0.99))] * 1e6, 3),
+        'max_us': round(times[-1] * 1e6, 3),
+    }
+
+
+def peakRssKb():
+    '''
+    peak rss of this process in kilobytes, VmHWM counts only the pages
+    of this interpreter, ru_maxrss may include those of the parent
+    it was forked from before exec
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    if resource is None:
+        return None
+    return maxRssKb(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def runChild(func, args):
+    try:
+        result = func(*args)
+    except Exception as e:
+        result = {'error': '{}: {}'.format(type(e).__name__, e)}
+    return result, peakRssKb()
+
+
+def idle():
+    return {}
+
+
+def runIsolated(func, *args):
+    '''
+    func(*args) in a fresh interpreter, returns (result, peak rss kb),
+    runIsolated(idle) gives the baseline rss of the interpreter with
+    the benchmark modules imported
+    '''
+    import multiprocessing
+    pool = multiprocessing.get_context('spawn').Pool(1)
+    try:
+        return tuple(pool.apply(runChild, (func, args)))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def makeBenchmarks(apk):
+    '''
+    {name: function} of all BENCHMARKS on one apk, inputs of the
+    buffer level functions are prepared outside the timings
+    '''
+    with open(apk, 'rb') as f:
+        f.seek(-min(os.path.getsize(apk), packer.ZIP_EOCD_REC_MIN_SIZE +
+                    packer.UINT16_MAX_VALUE), os.SEEK_END)
+        tail = f.read()
+    block = packer.findBlockByZipSections(apk)
+
+    def apkInfo():
+        from apkinfo import APK
+        with APK(apk) as a:
+            a.get_package()
+
+    return {
+        'getChannel': lambda: packer.getChannel(apk),
+        'findBlockByPluginMagic': lambda: packer.findBlockByPluginMagic(apk),
+        'findBlockBySigningMagic':
+            lambda: packer.findBlockBySigningMagic(apk),
+        'findBlockByZipSections': lambda: packer.findBlockByZipSections(apk),
+        'findBySigningMagic': lambda: packer.findBySigningMagic(apk),
+        'findByZipSections': lambda: packer.findByZipSections(apk),
+        'findEocdStartOffset': lambda: packer.findEocdStartOffset(tail),
+        'parseValues': lambda: packer.parseValues(block),
+        'apkinfo.APK': apkInfo,
+    }
+
+
+def runBenchmark(apk, name, minTime):
+    # inputs are built in the benchmark process, not in the parent
+    return measure(makeBenchmarks(apk)[name], minTime)
+
+
+def compareResults(old, new):
+    # ops/s of new relative to old, one line per benchmark
+    before = dict(((r['scenario'], r['benchmark']), r)
+                  for r in old['results'] if r.get('ops_per_sec'))
+    for r in new['results']:
+        o = before.get((r['scenario'], r['benchmark']))
+        if not o or not r.get('ops_per_sec'):
+            continue
+        print('{:<10} {:<24} {:>12.1f} -> {:>12.1f} ops/s  x{:.2f}'.format(
+            r['scenario'], r['benchmark'], o['ops_per_sec'],
+            r['ops_per_sec'], r['ops_per_sec'] / o['ops_per_sec']),
+            file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='benchmark channel lookups on synthetic apks')
+    parser.add_argument('-o', '--output',
+                        help='json report file (default: stdout)')
+    parser.add_argument('-s', '--scenario', action='append',
+                        help='scenarios to run (default: all), one of ' +
+                        ', '.join(s[0] for s in SCENARIOS))
+    parser.add_argument('-b', '--benchmark', action='append',
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--quick', action='store_true',
+                        help='only the {} scenarios'.format(
+                            ', '.join(QUICK_SCENARIOS)))
+    parser.add_argument('--min-time', type=float, default=MIN_TIME,
+                        help='seconds per benchmark (default: {})'.format(
+                            MIN_TIME))
+    parser.add_argument('--workdir',
+                        help='where apks are built (default: temp dir)')
+    parser.add_argument('--compare', metavar='REPORT',
+                        help='print ops/s change against an older report')
+    opts = parser.parse_args()
+    names = opts.scenario or (QUICK_SCENARIOS if opts.quick else
+                              [s[0] for s in SCENARIOS])
+    scenarios = [s for s in SCENARIOS if s[0] in names]
+    workdir = opts.workdir or tempfile.mkdtemp(prefix='packer-ng-bench-')
+    baseline = runIsolated(idle)[1]
+    report = {
+        'version': packer.getVersion(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'min_time': opts.min_time,
+        'baseline_rss_kb': baseline,
+        'scenarios': [],
+        'results': [],
+    }
+    try:
+        for name, size, entries, comment, blockSize, payload in scenarios:
+            apk = os.path.join(workdir, '{}.apk'.format(name))
+            makeApk(apk, size, entries, comment, blockSize, payload)
+            report['scenarios'].append({
+                'name': name, 'size': os.path.getsize(apk),
+                'entries': entries, 'comment': comment,
+                'block_size': blockSize, 'payload_size': payload})
+            for bench in BENCHMARKS:
+                if opts.benchmark and bench not in opts.benchmark:
+                    continue
+                result, rss = runIsolated(runBenchmark, apk, bench,
+                                          opts.min_time)
+                result.update(scenario=name, benchmark=bench,
+                              peak_rss_kb=rss,
+                              rss_delta_kb=rss - baseline
+                              if rss and baseline else None)
+                report['results'].append(result)
+                print('{:<10} {:<24} {}'.format(
+                    name, bench, result.get('error') or
+                    '{:>12.1f} ops/s  p50 {:>10.1f}us  p99 {:>10.1f}us  '
+                    'rss {}k'.format(result['ops_per_sec'],
+                                     result['p50_us'], result['p99_us'],
+                                     rss)), file=sys.stderr)
+    finally:
+        if not opts.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if opts.compare:
+        with open(opts.compare) as f:
+            compareResults(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+'''
+byte decoding shared by packer-ng-v2.py and apkinfo.py
+
+all formats are compiled once into struct.Struct objects and read with
+unpack_from() straight from bytes, mmap or memoryview, no slices
+https://docs.python.org/3/library/struct.html
+'''
+import struct
+
+INT16 = struct.Struct('<h')
+UINT16 = struct.Struct('<H')
+INT32 = struct.Struct('<i')
+UINT32 = struct.Struct('<I')
+INT64 = struct.Struct('<q')
+UINT64 = struct.Struct('<Q')
+FLOAT = struct.Struct('<f')
+DOUBLE = struct.Struct('<d')
+
+# two unsigned length units of an AXML/ARSC string, utf-8 or utf-16
+UINT8_PAIR = struct.Struct('<2B')
+UINT16_PAIR = struct.Struct('<2H')
+UINT32_PAIR = struct.Struct('<2I')
+
+# AXML chunk after its type: size, line number, comment
+AXML_CHUNK_HEADER = struct.Struct('<3I')
+# AXML start tag: namespace uri, name, flags, attribute count and
+# id index, class and style index
+AXML_START_TAG = struct.Struct('<5I')
+
+# ARSC chunk header: type, header size, size
+RES_CHUNK_HEADER = struct.Struct('<HHI')
+# ARSC type chunk after its chunk header: id, flags, reserved,
+# entry count, entries start
+RES_TABLE_TYPE_HEADER = struct.Struct('<BBHII')
+# ARSC entry: size, flags, key (compact: key, flags, data)
+RES_TABLE_ENTRY = struct.Struct('<HHI')
+# ARSC value: size, reserved, data type, data
+RES_VALUE = struct.Struct('<HBBI')
+
+_LITTLE_ENDIAN = (INT16, UINT16, INT32, UINT32,
+                  INT64, UINT64, FLOAT, DOUBLE)
+_BIG_ENDIAN = tuple(struct.Struct('>' + s.format[-1:])
+                    for s in _LITTLE_ENDIAN)
+
+# getChars() structs by (byte order, size)
+_CHARS = {}
+
+
+def chars(size, sign='<'):
+    s = _CHARS.get((sign, size))
+    if s is None:
+        s = _CHARS[(sign, size)] = struct.Struct(sign + 's' * size)
+    return s
+
+
+class ByteDecoder(object):
+    '''
+    random access decoder for a bytes, mmap or memoryview buffer
+    '''
+    __slots__ = ('buf', 'sign', '_s')
+
+    def __init__(self, buf, littleEndian=True):
+        self.buf = buf
+        self.sign = '<' if littleEndian else '>'
+        self._s = _LITTLE_ENDIAN if littleEndian else _BIG_ENDIAN
+
+    def getShort(self, offset=0):
+        return self._s[0].unpack_from(self.buf, offset)[0]
+
+    def getUShort(self, offset=0):
+        return self._s[1].unpack_from(self.buf, offset)[0]
+
+    def getInt(self, offset=0):
+        return self._s[2].unpack_from(self.buf, offset)[0]
+
+    def getUInt(self, offset=0):
+        return self._s[3].unpack_from(self.buf, offset)[0]
+
+    def getLong(self, offset=0):
+        return self._s[4].unpack_from(self.buf, offset)[0]
+
+    def getULong(self, offset=0):
+        return self._s[5].unpack_from(self.buf, offset)[0]
+
+    def getFloat(self, offset=0):
+        return self._s[6].unpack_from(self.buf, offset)[0]
+
+    def getDouble(self, offset=0):
+        return self._s[7].unpack_from(self.buf, offset)[0]
+
+    def getChars(self, offset=0, size=16):
+        return chars(size, self.sign).unpack_from(self.buf, offset)
@@ -4,26 +4,43 @@
 # @Last Modified by:   mcxiaoke
 # @Last Modified time: 2018-03-23 15:36:57
 from __future__ import print_function
+# importing this module has no side effects and stays cheap, modules
+# only some commands need (argparse, json, mmap, hashlib, zipfile,
+# multiprocessing, http.server ...) are imported where they are used
+import abc
+import io
 import os
+import re
 import sys
-import mmap
 import struct
-import zipfile
+import zlib
 import logging
+import functools
+import itertools
 import time
+import threading
+import collections
+
+from bytedecoder import ByteDecoder, UINT16, UINT32
 
-logging.basicConfig(format='%(levelname)s:%(lineno)s: %(funcName)s() %(message)s',
-                    level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
 AUTHOR = 'mcxiaoke'
-VERSION = '2.0.1'
-try:
-    props = dict(line.strip().split('=') for line in
-                 open('../gradle.properties') if line.strip())
-    VERSION = props.get('VERSION_NAME')
-except Exception as e:
-    VERSION = '2.0.1'
+DEFAULT_VERSION = '2.0.1'
+GRADLE_PROPERTIES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'gradle.properties')
+
+
+@functools.lru_cache(maxsize=None)
+def getVersion():
+    # VERSION_NAME of the gradle.properties next to the tools directory
+    try:
+        with io.open(GRADLE_PROPERTIES, encoding='utf-8') as f:
+            props = dict(line.strip().split('=', 1) for line in f
+                         if line.strip() and '=' in line)
+        return props.get('VERSION_NAME') or DEFAULT_VERSION
+    except Exception:
+        return DEFAULT_VERSION
 
 #####################################################################
 
@@ -38,12 +55,28 @@ ZIP_EOCD_CENTRAL_DIR_SIZE_FIELD_OFFSET = 12
 ZIP_EOCD_CENTRAL_DIR_OFFSET_FIELD_OFFSET = 16
 ZIP_EOCD_COMMENT_LENGTH_FIELD_OFFSET = 20
 ZIP_EOCD_COMMENT_MIN_LENGTH = 0
+ZIP_EOCD_REC_SIG_BYTES = struct.pack('<I', ZIP_EOCD_REC_SIG)
+
+ZIP64_EOCD_LOCATOR_SIG = 0x07064b50
+ZIP64_EOCD_LOCATOR_SIZE = 20
+ZIP64_EOCD_LOCATOR_OFFSET_FIELD_OFFSET = 8
+ZIP64_EOCD_REC_SIG = 0x06064b50
+ZIP64_EOCD_REC_MIN_SIZE = 56
+ZIP64_EOCD_TOTAL_RECORD_COUNT_OFFSET = 32
+ZIP64_EOCD_CENTRAL_DIR_SIZE_FIELD_OFFSET = 40
+ZIP64_EOCD_CENTRAL_DIR_OFFSET_FIELD_OFFSET = 48
+
+ZIP_LFH_SIG = 0x04034b50
+ZIP_LFH_MIN_SIZE = 30
+ZIP_LFH_NAME_LENGTH_FIELD_OFFSET = 26
+ZIP_LFH_EXTRA_LENGTH_FIELD_OFFSET = 28
 
 UINT16_MAX_VALUE = 0xffff  # 65535
+UINT32_MAX_VALUE = 0xffffffff
 
 BlOCK_MAX_SIZE = 0x100000  # 1m=1024k
 
-APK_SIG_BLOCK_MAGIC = 'APK Sig Block 42'
+APK_SIG_BLOCK_MAGIC = b'APK Sig Block 42'
 APK_SIG_BLOCK_MAGIC_HI = 0x3234206b636f6c42
 APK_SIG_BLOCK_MAGIC_LO = 0x20676953204b5041
 APK_SIG_BLOCK_MIN_SIZE = 32
@@ -54,10 +87,21 @@ PLUGIN_CHANNEL_KEY = 'CHANNEL'
 # plugin block id
 PLUGIN_BLOCK_ID = 0x7a786b21
 # plugin block magic
-PLUGIN_BLOCK_MAGIC = 'Packer Ng Sig V2'
-
-SEP_KV = '∘'
-SEP_LINE = '∙'
+PLUGIN_BLOCK_MAGIC = b'Packer Ng Sig V2'
+# plugin block magic of the binary payload, python tools only
+PLUGIN_BLOCK_BINARY_MAGIC = b'Packer Ng Sig V3'
+PLUGIN_BLOCK_MAGIC_PREFIX = b'Packer Ng Sig V'
+
+# binary payload: version, key count
+PAYLOAD_VERSION = 1
+PAYLOAD_HEADER = struct.Struct('<HH')
+# binary payload key directory entry: key length, flags, value offset
+PAYLOAD_DIR_ENTRY = struct.Struct('<HBxI')
+PAYLOAD_ZLIB = 0x1
+PAYLOAD_COMPRESS_MIN_SIZE = 64
+
+SEP_KV = u'∘'
+SEP_LINE = u'∙'
 
 #####################################################################
 
@@ -79,51 +123,111 @@ class MagicNotFoundException(Exception):
 #####################################################################
 
 
-class ByteDecoder(object):
-    '''
-    byte array decoder
-    https://docs.python.org/2/library/struct.html
-    '''
-
-    def __init__(self, buf, littleEndian=True):
-        self.buf = buf
-        self.sign = '<' if littleEndian else '>'
-
-    def getShort(self, offset=0):
-        return struct.unpack('{}h'.format(self.sign),
-                             self.buf[offset:offset + 2])[0]
-
-    def getUShort(self, offset=0):
-        return struct.unpack('{}H'.format(self.sign),
-                             self.buf[offset:offset + 2])[0]
-
-    def getInt(self, offset=0):
-        return struct.unpack('{}i'.format(self.sign),
-                             self.buf[offset:offset + 4])[0]
-
-    def getUInt(self, offset=0):
-        return struct.unpack('{}I'.format(self.sign),
-                             self.buf[offset:offset + 4])[0]
+STATS_PHASES = ('map', 'eocd', 'signing_block', 'entries', 'values')
+STATS_COUNTERS = ('apks', 'errors', 'index_hits', 'maps_opened',
+                  'bytes_read', 'block_entries', 'source_reads',
+                  'source_bytes')
+STATS_PREFIX = 'packer_ng'
 
-    def getLong(self, offset=0):
-        return struct.unpack('{}q'.format(self.sign),
-                             self.buf[offset:offset + 8])[0]
+clock = time.perf_counter
 
-    def getULong(self, offset=0):
-        return struct.unpack('{}Q'.format(self.sign),
-                             self.buf[offset:offset + 8])[0]
+# LookupStats of this process while enabled, the hot paths only
+# test it against None when off
+_stats = None
 
-    def getFloat(self, offset=0):
-        return struct.unpack('{}f'.format(self.sign),
-                             self.buf[offset:offset + 4])[0]
 
-    def getDouble(self, offset=0):
-        return struct.unpack('{}d'.format(self.sign),
-                             self.buf[offset:offset + 8])[0]
-
-    def getChars(self, offset=0, size=16):
-        return struct.unpack('{}{}'.format(self.sign, 's' * size),
-                             self.buf[offset:offset + size])
+class LookupStats(object):
+    '''
+    time and calls per phase of the channel lookup pipeline plus
+    counters, merged across batch worker processes with toDict()/merge()
+
+      map             open and mmap the apk
+      eocd            locate the eocd (and zip64 eocd) record
+      signing_block   locate and validate the APK Signing Block
+      entries         walk the id-value entries of the block
+      values          parse the plugin payload
+    '''
+    __slots__ = ('calls', 'seconds', 'counters')
+
+    def __init__(self):
+        self.calls = dict.fromkeys(STATS_PHASES, 0)
+        self.seconds = dict.fromkeys(STATS_PHASES, 0.0)
+        self.counters = dict.fromkeys(STATS_COUNTERS, 0)
+
+    def phase(self, name, start):
+        self.calls[name] += 1
+        self.seconds[name] += clock() - start
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, data):
+        for name, phase in data['phases'].items():
+            self.calls[name] = self.calls.get(name, 0) + phase['calls']
+            self.seconds[name] = self.seconds.get(name, 0.0) + \
+                phase['seconds']
+        for name, n in data['counters'].items():
+            self.count(name, n)
+
+    def toDict(self):
+        return {
+            'phases': dict((name, {'calls': self.calls[name],
+                                   'seconds': self.seconds[name]})
+                           for name in self.calls),
+            'counters': dict(self.counters),
+        }
+
+    def toPrometheus(self, prefix=STATS_PREFIX):
+        # text exposition format, for the node exporter textfile collector
+        lines = [
+            '# HELP {}_phase_seconds_total Time spent per lookup phase.'
+            .format(prefix),
+            '# TYPE {}_phase_seconds_total counter'.format(prefix)]
+        lines += ['{}_phase_seconds_total{{phase="{}"}} {:.9f}'.format(
+            prefix, name, self.seconds[name]) for name in sorted(self.calls)]
+        lines += [
+            '# HELP {}_phase_calls_total Calls per lookup phase.'
+            .format(prefix),
+            '# TYPE {}_phase_calls_total counter'.format(prefix)]
+        lines += ['{}_phase_calls_total{{phase="{}"}} {}'.format(
+            prefix, name, self.calls[name]) for name in sorted(self.calls)]
+        for name in sorted(self.counters):
+            lines += ['# TYPE {}_{}_total counter'.format(prefix, name),
+                      '{}_{}_total {}'.format(prefix, name,
+                                              self.counters[name])]
+        return '\n'.join(lines) + '\n'
+
+
+def enableStats():
+    # start collecting LookupStats in this process, returns them
+    global _stats
+    if _stats is None:
+        _stats = LookupStats()
+    return _stats
+
+
+def disableStats():
+    # stop collecting, returns the LookupStats collected so far
+    global _stats
+    stats, _stats = _stats, None
+    return stats
+
+
+def getStats():
+    return _stats
+
+
+def writeStats(stats, path, fmt='json'):
+    # replace path atomically, textfile collectors may read it any time
+    import json
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    with io.open(temp, 'w', encoding='utf-8') as f:
+        if fmt == 'prometheus':
+            f.write(stats.toPrometheus())
+        else:
+            f.write(json.dumps(stats.toDict(), indent=2, sort_keys=True))
+            f.write(u'\n')
+    os.replace(temp, path)
 
 #####################################################################
 
@@ -134,19 +238,222 @@ class ZipSections(object):
     long centralDirectorySizeBytes,
     int centralDirectoryRecordCount,
     long eocdOffset,
-    ByteBuffer eocd
+    ByteBuffer eocd,
+    long zip64EocdOffset, None unless ZIP64
     '''
 
     def __init__(self, cdStartOffset,
                  cdSizeBytes,
                  cdRecordCount,
                  eocdOffset,
-                 eocd):
+                 eocd,
+                 zip64EocdOffset=None):
         self.cdStartOffset = cdStartOffset
         self.cdSizeBytes = cdSizeBytes
         self.cdRecordCount = cdRecordCount
         self.eocdOffset = eocdOffset
         self.eocd = eocd
+        self.zip64EocdOffset = zip64EocdOffset
+
+    def cdFollowerOffset(self):
+        # record that must start right after the central directory
+        if self.zip64EocdOffset is not None:
+            return self.zip64EocdOffset
+        return self.eocdOffset
+
+#####################################################################
+
+
+class ApkView(object):
+    '''
+    one read-only mmap of an apk, hands out zero-copy memoryview slices
+    of the EOCD, central directory and APK Signing Block
+
+        with ApkView('app.apk') as v:
+            block = v.findSigningBlock()
+
+    slices are only valid until close()
+    '''
+    __slots__ = ('path', 'size', 'mm', 'view', '_sections', '_block',
+                 '_index')
+
+    def __init__(self, apk):
+        import mmap
+        self.path = apk
+        self.mm = None
+        self.view = None
+        self._sections = None
+        self._block = None
+        self._index = None
+        stats = _stats
+        if stats is not None:
+            ts = clock()
+        with open(apk, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size < ZIP_EOCD_REC_MIN_SIZE:
+                raise ZipFormatException(
+                    "File too small for ZIP: {}".format(self.size))
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        if stats is not None:
+            stats.phase('map', ts)
+            stats.count('maps_opened')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._sections = None
+        self._block = None
+        self._index = None
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                # a slice still alive (e.g. held by a traceback),
+                # the map goes away when the slice is collected
+                pass
+            self.mm = None
+
+    @property
+    def sections(self):
+        if self._sections is None:
+            self._sections = findZipSections(self.view)
+        return self._sections
+
+    def eocd(self):
+        return self.sections.eocd
+
+    def centralDirectory(self):
+        sections = self.sections
+        return self.view[sections.cdStartOffset:
+                         sections.cdStartOffset + sections.cdSizeBytes]
+
+    def tailOffset(self):
+        # search window of the magic based lookups, page aligned
+        import mmap
+        offset = max(0, self.size - BlOCK_MAX_SIZE)
+        return offset - offset % mmap.PAGESIZE
+
+    def findPluginBlockByMagic(self):
+        magicLen = len(PLUGIN_BLOCK_MAGIC)
+        start = self.mm.rfind(PLUGIN_BLOCK_MAGIC_PREFIX, self.tailOffset())
+        if start == -1:
+            return None
+        logger.debug('magic start offset=%s', start)
+        payloadLen = ByteDecoder(self.view).getInt(start + magicLen)
+        logger.debug('magic payloadLen=%s', payloadLen)
+        end = start + magicLen + 4 + payloadLen + 4
+        logger.debug('magic end offset=%s', end)
+        return self.view[start:end]
+
+    def findSigningBlockByMagic(self):
+        index = self.mm.rfind(APK_SIG_BLOCK_MAGIC, self.tailOffset())
+        if index == -1:
+            raise MagicNotFoundException(
+                'APK Signing Block Magic not found')
+        logger.debug('magic index=%s', index)
+        bEnd = index + 16
+        bSize = ByteDecoder(self.view).getLong(bEnd - 24) + 8
+        logger.debug('block size=%s', bSize)
+        bStart = bEnd - bSize
+        if bStart < 0:
+            raise SignatureNotFoundException(
+                "APK Signing Block offset out of range: {}".format(bStart))
+        return self.view[bStart:bEnd]
+
+    def findSigningBlockOffset(self):
+        return self.sections.cdStartOffset - len(self.findSigningBlock())
+
+    def findSigningBlock(self):
+        # findApkSigningBlockUsingZipSections
+        if self._block is None:
+            view = self.view
+            self._block = findSigningBlockInSections(
+                self.sections, lambda offset, size: view[offset:offset + size])
+        return self._block
+
+    def blockIndex(self):
+        # SigningBlockIndex of the APK Signing Block, walked once
+        if self._index is None:
+            block = self.findSigningBlock()
+            self._index = SigningBlockIndex(
+                block, self.sections.cdStartOffset - len(block))
+        return self._index
+
+
+def findSigningBlockInSections(sections, read):
+    '''
+    the APK Signing Block right before the central directory,
+    read(offset, size) returns size bytes of the apk at offset,
+    called once for the block footer and once for the whole block
+    '''
+    stats = _stats
+    if stats is not None:
+        ts = clock()
+    debug = logger.isEnabledFor(logging.DEBUG)
+    centralDirStartOffset = sections.cdStartOffset
+    centralDirEndOffset = centralDirStartOffset + sections.cdSizeBytes
+    eocdStartOffset = sections.cdFollowerOffset()
+    if debug:
+        logger.debug('centralDirStartOffset:%s', centralDirStartOffset)
+        logger.debug('centralDirEndOffset:%s', centralDirEndOffset)
+        logger.debug('eocdStartOffset:%s', eocdStartOffset)
+    if centralDirEndOffset != eocdStartOffset:
+        raise SignatureNotFoundException(
+            "ZIP Central Directory is not "
+            "immediately followed by "
+            "End of Central Directory. CD end: {} eocd start: {}"
+            .format(centralDirEndOffset, eocdStartOffset))
+    if centralDirStartOffset < APK_SIG_BLOCK_MIN_SIZE:
+        raise SignatureNotFoundException(
+            "APK too small for APK Signing Block. "
+            "ZIP Central Directory offset:{} "
+            .format(centralDirStartOffset))
+
+    fd = ByteDecoder(read(centralDirStartOffset - 24, 24))
+    magic = b''.join(fd.getChars(8, 16))
+    if magic != APK_SIG_BLOCK_MAGIC:
+        raise SignatureNotFoundException(
+            "No APK Signing Block before ZIP Central Directory")
+
+    apkSigBlockSizeInFooter = fd.getLong(0)
+    if debug:
+        logger.debug('apkSigBlockSizeInFooter:%s', apkSigBlockSizeInFooter)
+    if apkSigBlockSizeInFooter < 24 or \
+            apkSigBlockSizeInFooter > sys.maxsize - 8:
+        raise SignatureNotFoundException(
+            "APK Signing Block size out of range: {}"
+            .format(apkSigBlockSizeInFooter))
+
+    totalSize = apkSigBlockSizeInFooter + 8
+    apkSigBlockOffset = centralDirStartOffset - totalSize
+    if debug:
+        logger.debug('apkSigBlockOffset:%s', apkSigBlockOffset)
+    if apkSigBlockOffset < 0:
+        raise SignatureNotFoundException(
+            "APK Signing Block offset out of range: {}"
+            .format(apkSigBlockOffset))
+
+    block = read(apkSigBlockOffset, totalSize)
+    apkSigBlockSizeInHeader = ByteDecoder(block).getLong(0)
+    if debug:
+        logger.debug('apkSigBlockSizeInHeader:%s', apkSigBlockSizeInHeader)
+    if apkSigBlockSizeInHeader != apkSigBlockSizeInFooter:
+        raise SignatureNotFoundException(
+            "APK Signing Block sizes in header and"
+            "footer do not match: {} vs {}"
+            .format(apkSigBlockSizeInHeader, apkSigBlockSizeInFooter))
+    if stats is not None:
+        stats.phase('signing_block', ts)
+        stats.count('bytes_read', 24 + totalSize)
+    return block
 
 #####################################################################
 
@@ -161,167 +468,149 @@ def parseValues(content):
       @-4      payload length      same as @+16 4 bytes
     '''
     magicLen = len(PLUGIN_BLOCK_MAGIC)
-    logger.debug('content:%s', content)
     if not content or len(content) < magicLen + 4 * 2:
         return None
-    content = content[magicLen + 4: -4]
-    values = dict(line.split(SEP_KV)
-                  for line in content.split(SEP_LINE) if line.strip())
-    logger.debug('values:%s', values)
+    stats = _stats
+    if stats is not None:
+        ts = clock()
+    if isBinaryPayload(content):
+        values = parseBinaryValues(content)
+    else:
+        content = bytes(content[magicLen + 4: -4]).decode('utf-8')
+        values = dict(line.split(SEP_KV)
+                      for line in content.split(SEP_LINE) if line.strip())
+    if stats is not None:
+        stats.phase('values', ts)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('values:%s', values)
     return values
 
 
-def createMap(apk):
-    with open(apk, "rb") as f:
-        size = os.path.getsize(apk)
-        offset = max(0, size - BlOCK_MAX_SIZE)
-        length = min(size, BlOCK_MAX_SIZE)
-        offset = offset - offset % mmap.PAGESIZE
-        logger.debug('file size=%s', size)
-        logger.debug('file offset=%s', offset)
-        return mmap.mmap(f.fileno(),
-                         length=length,
-                         offset=offset,
-                         access=mmap.ACCESS_READ)
+def parseValue(content, key):
+    # value of key in a plugin payload, None if missing
+    if not content or len(content) < len(PLUGIN_BLOCK_MAGIC) + 4 * 2:
+        return None
+    if not isBinaryPayload(content):
+        return parseValues(content).get(key)
+    stats = _stats
+    if stats is not None:
+        ts = clock()
+    value = parseBinaryValues(content, key)
+    if stats is not None:
+        stats.phase('values', ts)
+    return value
+
+
+def isBinaryPayload(content):
+    return content[:len(PLUGIN_BLOCK_BINARY_MAGIC)] == \
+        PLUGIN_BLOCK_BINARY_MAGIC
+
+
+def readPayloadBody(content):
+    '''
+      BINARY PLUGIN BLOCK LAYOUT
+      OFFSET    DATA TYPE           DESCRIPTION
+      @+0       magic string        'Packer Ng Sig V3' 16 bytes
+      @+16      body length         int 4 bytes
+      @+20      version             uint16 2 bytes
+      @+22      key count           uint16 2 bytes
+      @+24      key directory       per key: uint16 key length,
+                                    uint8 flags, 1 byte padding,
+                                    uint32 value offset, utf-8 key
+                values              at value offset from @+20:
+                                    uint32 length, value bytes
+                                    (utf-8, zlib with flag 0x1)
+      @-4       body length         same as @+16 4 bytes
+    '''
+    magicLen = len(PLUGIN_BLOCK_BINARY_MAGIC)
+    size = struct.unpack_from('<i', content, magicLen)[0]
+    if size < PAYLOAD_HEADER.size or magicLen + 8 + size != len(content) \
+            or struct.unpack_from('<i', content, len(content) - 4)[0] != size:
+        raise SignatureNotFoundException(
+            "Bad binary plugin payload length: {}".format(size))
+    body = content[magicLen + 4:magicLen + 4 + size]
+    version = PAYLOAD_HEADER.unpack_from(body, 0)[0]
+    if version != PAYLOAD_VERSION:
+        raise SignatureNotFoundException(
+            "Unsupported binary plugin payload version: {}".format(version))
+    return body
+
+
+def iterPayloadKeys(body):
+    # (key, flags, value offset) of the key directory, key not decoded
+    count = PAYLOAD_HEADER.unpack_from(body, 0)[1]
+    position = PAYLOAD_HEADER.size
+    for _ in range(count):
+        keyLen, flags, offset = PAYLOAD_DIR_ENTRY.unpack_from(body, position)
+        position += PAYLOAD_DIR_ENTRY.size
+        yield body[position:position + keyLen], flags, offset
+        position += keyLen
+
+
+def readPayloadValue(body, flags, offset):
+    size = UINT32.unpack_from(body, offset)[0]
+    start = offset + 4
+    if start + size > len(body):
+        raise SignatureNotFoundException(
+            "Binary plugin payload value out of range: {}".format(offset))
+    value = bytes(body[start:start + size])
+    if flags & PAYLOAD_ZLIB:
+        value = zlib.decompress(value)
+    return value.decode('utf-8')
+
+
+def parseBinaryValues(content, key=None):
+    '''
+    all values of a binary plugin payload, or with key only the value
+    of key, found through the key directory without decoding the rest
+    '''
+    body = readPayloadBody(content)
+    name = key.encode('utf-8') if key is not None else None
+    values = {}
+    try:
+        for k, flags, offset in iterPayloadKeys(body):
+            if name is None:
+                values[bytes(k).decode('utf-8')] = \
+                    readPayloadValue(body, flags, offset)
+            elif k == name:
+                return readPayloadValue(body, flags, offset)
+    except (struct.error, zlib.error) as e:
+        raise SignatureNotFoundException(
+            "Bad binary plugin payload: {}".format(e))
+    return values if name is None else None
 
 
 def findBlockByPluginMagic(apk):
-    mm = createMap(apk)
-    magicLen = len(PLUGIN_BLOCK_MAGIC)
-    start = mm.rfind(PLUGIN_BLOCK_MAGIC)
-    if start == -1:
-        return None
-    d = ByteDecoder(mm)
-    logger.debug('magic start offset=%s', start)
-    magic = ''.join(d.getChars(start, magicLen))
-    logger.debug('magic start string=%s', magic)
-    payloadLen = d.getInt(start + magicLen)
-    logger.debug('magic payloadLen1=%s', payloadLen)
-
-    end = start + magicLen + 4 + payloadLen + 4
-    logger.debug('magic end offset=%s', end)
-    logger.debug('magic payloadLen2=%s', d.getInt(end - 4))
-
-    block = mm[start:end]
-    mm.close()
-    return block
+    with ApkView(apk) as v:
+        block = v.findPluginBlockByMagic()
+        return block.tobytes() if block is not None else None
 
 
 def findBlockBySigningMagic(apk):
     # search APK Signing Block Magic words
-    signingBlock = findBySigningMagic(apk)
-    if signingBlock:
-        return parseApkSigningBlock(signingBlock, PLUGIN_BLOCK_ID)
+    with ApkView(apk) as v:
+        block = parseApkSigningBlock(v.findSigningBlockByMagic(),
+                                     PLUGIN_BLOCK_ID)
+        return block.tobytes() if block is not None else None
 
 
 def findBlockByZipSections(apk):
     # find zip centralDirectory, then find apkSigningBlock
-    signingBlock = findByZipSections(apk)
-    if signingBlock:
-        return parseApkSigningBlock(signingBlock, PLUGIN_BLOCK_ID)
+    with ApkView(apk) as v:
+        block = parseApkSigningBlock(v.findSigningBlock(), PLUGIN_BLOCK_ID)
+        return block.tobytes() if block is not None else None
 
 
 def findBySigningMagic(apk):
     # findApkSigningBlockUsingSigningMagic
-    mm = createMap(apk)
-    index = mm.rfind(APK_SIG_BLOCK_MAGIC)
-    if index == -1:
-        raise MagicNotFoundException(
-            'APK Signing Block Magic not found')
-    d = ByteDecoder(mm)
-    logger.debug('magic index=%s', index)
-    logger.debug('magic string=%s', ''.join(d.getChars(index, 16)))
-    bEnd = index + 16
-    logger.debug('block end=%s', bEnd)
-    bSize = d.getLong(bEnd - 24) + 8
-    logger.debug('block size=%s', bSize)
-    bStart = bEnd - bSize
-    logger.debug('block start=%s', bStart)
-    block = mm[bStart:bEnd]
-    mm.close()
-    return block
+    with ApkView(apk) as v:
+        return v.findSigningBlockByMagic().tobytes()
 
 
 def findByZipSections(apk):
     # findApkSigningBlockUsingZipSections
-    with open(apk, "rb") as f:
-        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        sections = findZipSections(mm)
-
-        centralDirStartOffset = sections.cdStartOffset
-        centralDirEndOffset = centralDirStartOffset + sections.cdSizeBytes
-        eocdStartOffset = sections.eocdOffset
-        logger.debug('centralDirStartOffset:%s', centralDirStartOffset)
-        logger.debug('centralDirEndOffset:%s', centralDirEndOffset)
-        logger.debug('eocdStartOffset:%s', eocdStartOffset)
-        if centralDirEndOffset != eocdStartOffset:
-            raise SignatureNotFoundException(
-                "ZIP Central Directory is not "
-                "immediately followed by "
-                "End of Central Directory. CD end: {} eocd start: {}"
-                .format(centralDirEndOffset, eocdStartOffset))
-        if centralDirStartOffset < APK_SIG_BLOCK_MIN_SIZE:
-            raise SignatureNotFoundException(
-                "APK too small for APK Signing Block. "
-                "ZIP Central Directory offset:{} "
-                .format(centralDirStartOffset))
-
-        fStart = centralDirStartOffset - 24
-        mStart = centralDirStartOffset - 16
-        fEnd = centralDirStartOffset
-        logger.debug('fStart:%s', fStart)
-        logger.debug('mStart:%s', mStart)
-        logger.debug('fEnd:%s', fEnd)
-        footer = mm[fStart:fEnd]
-        footerSize = len(footer)
-        # logger.debug('footer:%s',to_hex(footer))
-        fd = ByteDecoder(footer)
-        magic = ''.join(fd.getChars(8, 16))
-        # logger.debug('magic str:%s', magic)
-        lo = fd.getLong(8)
-        hi = fd.getLong(16)
-        logger.debug('magic lo:%s', hex(lo))
-        logger.debug('magic hi:%s', hex(hi))
-
-        if magic != APK_SIG_BLOCK_MAGIC:
-            raise SignatureNotFoundException(
-                "No APK Signing Block before ZIP Central Directory")
-        # if lo != APK_SIG_BLOCK_MAGIC_LO or hi != APK_SIG_BLOCK_MAGIC_HI:
-        #     raise SignatureNotFoundException(
-        #         "No APK Signing Block before ZIP Central Directory")
-
-        apkSigBlockSizeInFooter = fd.getLong(0)
-        logger.debug('apkSigBlockSizeInFooter:%s', apkSigBlockSizeInFooter)
-
-        if apkSigBlockSizeInFooter < footerSize or \
-                apkSigBlockSizeInFooter > sys.maxsize - 8:
-            raise SignatureNotFoundException(
-                "APK Signing Block size out of range: {}"
-                .format(apkSigBlockSizeInFooter))
-
-        totalSize = apkSigBlockSizeInFooter + 8
-        logger.debug('totalSize:%s', totalSize)
-        apkSigBlockOffset = centralDirStartOffset - totalSize
-        logger.debug('apkSigBlockOffset:%s', apkSigBlockOffset)
-
-        if apkSigBlockOffset < 0:
-            raise SignatureNotFoundException(
-                "APK Signing Block offset out of range: " + apkSigBlockOffset)
-
-        apkSigBlock = mm[apkSigBlockOffset:apkSigBlockOffset + 8]
-        # logger.debug('apkSigBlock:%s', to_hex(apkSigBlock))
-        apkSigBlockSizeInHeader = ByteDecoder(apkSigBlock).getLong(0)
-        logger.debug('apkSigBlockSizeInHeader:%s', apkSigBlockSizeInHeader)
-
-        if apkSigBlockSizeInHeader != apkSigBlockSizeInFooter:
-            raise SignatureNotFoundException(
-                "APK Signing Block sizes in header and"
-                "footer do not match: {} vs {}"
-                .format(apkSigBlockSizeInHeader, apkSigBlockSizeInFooter))
-
-        block = mm[apkSigBlockOffset:apkSigBlockOffset + totalSize]
-        mm.close()
-        return block
+    with ApkView(apk) as v:
+        return v.findSigningBlock().tobytes()
 
 
 def parseApkSigningBlock(block, blockId):
@@ -337,179 +626,590 @@ def parseApkSigningBlock(block, blockId):
         // * @-24 bytes uint64:    size in bytes(same as the one above)
         // * @-16 bytes uint128:   magic
     '''
+    stats = _stats
+    if stats is not None:
+        ts = clock()
+    debug = logger.isEnabledFor(logging.DEBUG)
     totalSize = len(block)
     bd0 = ByteDecoder(block)
     blockSizeInHeader = bd0.getULong(0)
-    logger.debug('blockSizeInHeader:%s', blockSizeInHeader)
     blockSizeInFooter = bd0.getULong(totalSize - 24)
-    logger.debug('blockSizeInFooter:%s', blockSizeInFooter)
     # slice only payload
     block = block[8:-24]
     bd = ByteDecoder(block)
     size = len(block)
-    logger.debug('payloadSize:%s', size)
+    if debug:
+        logger.debug('blockSizeInHeader:%s', blockSizeInHeader)
+        logger.debug('blockSizeInFooter:%s', blockSizeInFooter)
+        logger.debug('payloadSize:%s', size)
 
     entryCount = 0
     position = 0
-    signingBlock = None
-    channelBlock = None
+    pluginBlock = None
     while position < size:
         entryCount += 1
-        logger.debug('entryCount:%s', entryCount)
         if size - position < 8:
             raise SignatureNotFoundException(
                 "Insufficient data to read size "
                 "of APK Signing Block entry: {}"
                 .format(entryCount))
         lenLong = bd.getLong(position)
-        logger.debug('lenLong:%s', lenLong)
         position += 8
         if lenLong < 4 or lenLong > sys.maxsize - 8:
             raise SignatureNotFoundException(
                 "APK Signing Block entry #{} size out of range: {}"
                 .format(entryCount, lenLong))
         nextEntryPos = position + lenLong
-        logger.debug('nextEntryPos:%s', nextEntryPos)
         if nextEntryPos > size:
-            SignatureNotFoundException(
-                "APK Signing Block entry #{}, available: {}"
-                .format(entryCount, (size - position)))
+            raise SignatureNotFoundException(
+                "APK Signing Block entry #{} size out of range: {}"
+                ", available: {}"
+                .format(entryCount, lenLong, size - position))
         sid = bd.getInt(position)
-        logger.debug('blockId:%s', hex(sid))
         position += 4
-        if sid == APK_SIGNATURE_SCHEME_V2_BLOCK_ID:
-            logger.debug('found signingBlock')
-            signingBlock = block[position:position + lenLong - 4]
-            signingBlockSize = len(signingBlock)
-            logger.debug('signingBlockSize:%s', signingBlockSize)
-            # logger.debug('signingBlockHex:%s', to_hex(signingBlock[0:32]))
-        elif sid == blockId:
-            logger.debug('found pluginBlock')
+        if debug:
+            logger.debug('entry:%s blockId:%s lenLong:%s',
+                         entryCount, hex(sid), lenLong)
+        if sid == blockId:
             pluginBlock = block[position:position + lenLong - 4]
-            pluginBlockSize = len(pluginBlock)
-            logger.debug('pluginBlockSize:%s', pluginBlockSize)
-            logger.debug('pluginBlock:%s', pluginBlock)
-            # logger.debug('pluginBlockHex:%s', to_hex(pluginBlock))
-            return pluginBlock
-        else:
-            logger.debug('found unknown block:%s', hex(sid))
+            if debug:
+                logger.debug('found pluginBlock:%s', pluginBlock)
+            break
         position = nextEntryPos
+    if stats is not None:
+        stats.phase('entries', ts)
+        stats.count('block_entries', entryCount)
+    return pluginBlock
+
+
+def findIdValues(block):
+    '''
+    all (id, value) pairs of the APK Signing Block in file order
+    '''
+    return [(entry.id, entry.value) for entry in SigningBlockIndex(block)]
+
+
+class BlockEntry(object):
+    '''
+    one id-value pair of the APK Signing Block, offset and length
+    of the value within the block, value is sliced only on access
+    '''
+    __slots__ = ('id', 'offset', 'length', 'block')
 
+    def __init__(self, sid, offset, length, block):
+        self.id = sid
+        self.offset = offset
+        self.length = length
+        self.block = block
+
+    def __repr__(self):
+        return 'BlockEntry(id={:#x}, offset={}, length={})'.format(
+            self.id, self.offset, self.length)
+
+    @property
+    def value(self):
+        # zero-copy memoryview of the value
+        return self.block[self.offset:self.offset + self.length]
+
+    def tobytes(self):
+        return self.value.tobytes()
+
+
+class SigningBlockIndex(object):
+    '''
+    all id-value pairs of an APK Signing Block from a single walk,
+    values stay memoryview slices of the block until asked for
+
+        index = SigningBlockIndex(v.findSigningBlock(), blockOffset)
+        channel = parseValues(index.get(PLUGIN_BLOCK_ID))
+        signers = index.get(APK_SIGNATURE_SCHEME_V2_BLOCK_ID)
+
+    the first entry wins if an id appears more than once,
+    base is the file offset of the block for fileOffset()
+    '''
+    __slots__ = ('block', 'base', 'entries', '_ids')
+
+    def __init__(self, block, base=0):
+        self.block = block if isinstance(block, memoryview) \
+            else memoryview(block)
+        self.base = base
+        self.entries = self.walk()
+        self._ids = None
+
+    def walk(self):
+        stats = _stats
+        if stats is not None:
+            ts = clock()
+        block = self.block
+        bd = ByteDecoder(block)
+        size = len(block) - 24
+        position = 8
+        entries = []
+        while position < size:
+            if size - position < 8:
+                raise SignatureNotFoundException(
+                    "Insufficient data to read size "
+                    "of APK Signing Block entry: {}".format(len(entries) + 1))
+            lenLong = bd.getLong(position)
+            position += 8
+            if lenLong < 4 or lenLong > size - position:
+                raise SignatureNotFoundException(
+                    "APK Signing Block entry #{} size out of range: {}"
+                    .format(len(entries) + 1, lenLong))
+            entries.append(BlockEntry(bd.getUInt(position), position + 4,
+                                      lenLong - 4, block))
+            position += lenLong
+        if stats is not None:
+            stats.phase('entries', ts)
+            stats.count('block_entries', len(entries))
+        return entries
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            ids = {}
+            for entry in self.entries:
+                ids.setdefault(entry.id, entry)
+            self._ids = ids
+        return self._ids
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, sid):
+        return sid in self.ids
+
+    def __getitem__(self, sid):
+        return self.ids[sid].value
+
+    def entry(self, sid):
+        return self.ids.get(sid)
+
+    def get(self, sid, default=None):
+        entry = self.ids.get(sid)
+        return entry.value if entry is not None else default
+
+    def fileOffset(self, sid):
+        # offset of the value of sid in the apk
+        return self.base + self.ids[sid].offset
+
+    def copy(self, ids=None):
+        # {id: bytes} of ids, or of all entries
+        if ids is None:
+            ids = self.ids
+        return dict((sid, self.ids[sid].tobytes())
+                    for sid in ids if sid in self.ids)
+
+
+def findBlocks(apk, ids=None):
+    '''
+    {id: bytes} of the given ids (default: all) of the APK Signing
+    Block, a single open and walk for any number of blocks
+    '''
+    with ApkView(apk) as v:
+        return v.blockIndex().copy(ids)
 
-def findZipSections(mm):
-    eocd = findEocdRecord(mm)
+
+def findZipSections(mm, base=0):
+    # mm holds the apk from offset base to its end, usually all of it
+    stats = _stats
+    if stats is not None:
+        ts = clock()
+    eocd = findEocdRecord(mm, base)
     if not eocd:
         raise ZipFormatException(
             "ZIP End of Central Directory record not found")
     eocdOffset, eocdBuf = eocd
     ed = ByteDecoder(eocdBuf)
-    # logger.debug('eocdBuf:%s', to_hex(eocdBuf))
     cdStartOffset = ed.getUInt(ZIP_EOCD_CENTRAL_DIR_OFFSET_FIELD_OFFSET)
-    logger.debug('cdStartOffset:%s', cdStartOffset)
-    if cdStartOffset > eocdOffset:
+    cdSizeBytes = ed.getUInt(ZIP_EOCD_CENTRAL_DIR_SIZE_FIELD_OFFSET)
+    cdRecordCount = ed.getUShort(
+        ZIP_EOCD_CENTRAL_DIR_TOTAL_RECORD_COUNT_OFFSET)
+    zip64EocdOffset = findZip64EocdRecord(mm, eocdOffset, base)
+    if zip64EocdOffset is not None:
+        # archives over 4g or 65535 entries, the eocd fields may be
+        # saturated, the zip64 eocd record holds the real values
+        zd = ByteDecoder(mm)
+        recordOffset = zip64EocdOffset - base
+        cdStartOffset = zd.getULong(
+            recordOffset + ZIP64_EOCD_CENTRAL_DIR_OFFSET_FIELD_OFFSET)
+        cdSizeBytes = zd.getULong(
+            recordOffset + ZIP64_EOCD_CENTRAL_DIR_SIZE_FIELD_OFFSET)
+        cdRecordCount = zd.getULong(
+            recordOffset + ZIP64_EOCD_TOTAL_RECORD_COUNT_OFFSET)
+        endOffset = zip64EocdOffset
+    else:
+        endOffset = eocdOffset
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('cdStartOffset:%s', cdStartOffset)
+        logger.debug('cdSizeBytes:%s', cdSizeBytes)
+        logger.debug('cdRecordCount:%s', cdRecordCount)
+        logger.debug('zip64EocdOffset:%s', zip64EocdOffset)
+    if cdStartOffset > endOffset:
         raise ZipFormatException(
             "ZIP Central Directory start offset out of range: {}"
             ". ZIP End of Central Directory offset: {}"
-            .format(cdStartOffset, eocdOffset))
-    cdSizeBytes = ed.getUInt(ZIP_EOCD_CENTRAL_DIR_SIZE_FIELD_OFFSET)
-    logger.debug('cdSizeBytes:%s', cdSizeBytes)
+            .format(cdStartOffset, endOffset))
     cdEndOffset = cdStartOffset + cdSizeBytes
-    logger.debug('cdEndOffset:%s', cdEndOffset)
-    if cdEndOffset > eocdOffset:
+    if cdEndOffset > endOffset:
         raise ZipFormatException(
             "ZIP Central Directory overlaps with End of Central Directory"
             ". CD end: {}, EoCD start: {}"
-            .format(cdEndOffset, eocdOffset))
-    cdRecordCount = ed.getUShort(
-        ZIP_EOCD_CENTRAL_DIR_TOTAL_RECORD_COUNT_OFFSET)
-    logger.debug('cdRecordCount:%s', cdRecordCount)
+            .format(cdEndOffset, endOffset))
     sections = ZipSections(cdStartOffset,
                            cdSizeBytes,
                            cdRecordCount,
                            eocdOffset,
-                           eocdBuf)
+                           eocdBuf,
+                           zip64EocdOffset)
+    if stats is not None:
+        stats.phase('eocd', ts)
+        stats.count('bytes_read', len(eocdBuf) if zip64EocdOffset is None
+                    else eocdOffset + len(eocdBuf) - zip64EocdOffset)
     return sections
 
 
-def findEocdRecord(mm):
-    fileSize = mm.size()
-    logger.debug('fileSize:%s', fileSize)
+def findZip64EocdRecord(mm, eocdOffset, base=0):
+    # offset of the zip64 eocd record, None if there is no zip64 locator
+    locatorOffset = eocdOffset - ZIP64_EOCD_LOCATOR_SIZE
+    if locatorOffset < base:
+        return None
+    d = ByteDecoder(mm)
+    if d.getUInt(locatorOffset - base) != ZIP64_EOCD_LOCATOR_SIG:
+        return None
+    recordOffset = d.getULong(
+        locatorOffset - base + ZIP64_EOCD_LOCATOR_OFFSET_FIELD_OFFSET)
+    if recordOffset > locatorOffset - ZIP64_EOCD_REC_MIN_SIZE or \
+            recordOffset < base or \
+            d.getUInt(recordOffset - base) != ZIP64_EOCD_REC_SIG:
+        raise ZipFormatException(
+            "ZIP64 End of Central Directory record not found at {}"
+            .format(recordOffset))
+    return recordOffset
+
+
+def findEocdRecord(mm, base=0):
+    fileSize = len(mm)
     if fileSize < ZIP_EOCD_REC_MIN_SIZE:
         return None
 
     # 99.99% of APKs have a zero-length comment field
     maxCommentSize = min(UINT16_MAX_VALUE, fileSize - ZIP_EOCD_REC_MIN_SIZE)
     maxEocdSize = ZIP_EOCD_REC_MIN_SIZE + maxCommentSize
-    logger.debug('maxCommentSize:%s', maxCommentSize)
-    logger.debug('maxEocdSize:%s', maxEocdSize)
     bufOffsetInFile = fileSize - maxEocdSize
-    logger.debug('bufOffsetInFile:%s', bufOffsetInFile)
     buf = mm[bufOffsetInFile:bufOffsetInFile + maxEocdSize]
-    # logger.debug('buf:%s',to_hex(buf))
     eocdOffsetInBuf = findEocdStartOffset(buf)
-    logger.debug('eocdOffsetInBuf:%s', eocdOffsetInBuf)
     if eocdOffsetInBuf != -1:
-        return bufOffsetInFile + eocdOffsetInBuf, buf[eocdOffsetInBuf:]
+        return base + bufOffsetInFile + eocdOffsetInBuf, \
+            buf[eocdOffsetInBuf:]
 
 
 def findEocdStartOffset(buf):
+    '''
+    offset of the eocd record in the tail buf, -1 if not found,
+    candidates are searched from the end and a signature only
+    counts if its comment length reaches exactly to the end of buf
+    '''
     archiveSize = len(buf)
-    logger.debug('archiveSize:%s', archiveSize)
-    maxCommentLength = min(
-        archiveSize - ZIP_EOCD_REC_MIN_SIZE, UINT16_MAX_VALUE)
-    logger.debug('maxCommentLength:%s', maxCommentLength)
     eocdEmptyCommentStartPos = archiveSize - ZIP_EOCD_REC_MIN_SIZE
-    logger.debug('eocdEmptyCommentStartPos:%s',
-                 eocdEmptyCommentStartPos)
-    expectedCommentLength = 0
-    eocdOffsetInBuf = -1
-    while expectedCommentLength <= maxCommentLength:
-        eocdStartPos = eocdEmptyCommentStartPos - expectedCommentLength
-        logger.debug('expectedCommentLength:%s', expectedCommentLength)
-        # logger.debug('eocdStartPos:%s', eocdStartPos)
-        seg = ByteDecoder(buf).getInt(eocdStartPos)
-        logger.debug('seg:%s', hex(seg))
-        if seg == ZIP_EOCD_REC_SIG:
-            actualCommentLength = ByteDecoder(buf).getUShort(
-                eocdStartPos + ZIP_EOCD_COMMENT_LENGTH_FIELD_OFFSET)
-            logger.debug('actualCommentLength:%s', actualCommentLength)
-            if actualCommentLength == expectedCommentLength:
-                logger.debug('found eocdStartPos:%s', eocdStartPos)
-                return eocdStartPos
-        expectedCommentLength += 1
-    return -1
+    if eocdEmptyCommentStartPos < 0:
+        return -1
+    # fast path, no comment, no copy
+    if UINT32.unpack_from(buf, eocdEmptyCommentStartPos)[0] == \
+            ZIP_EOCD_REC_SIG and \
+            UINT16.unpack_from(buf, archiveSize - 2)[0] == 0:
+        return eocdEmptyCommentStartPos
+    data = buf if hasattr(buf, 'rfind') else bytes(buf)
+    minPos = max(0, eocdEmptyCommentStartPos - UINT16_MAX_VALUE)
+    end = eocdEmptyCommentStartPos + 4
+    while True:
+        pos = data.rfind(ZIP_EOCD_REC_SIG_BYTES, minPos, end)
+        if pos == -1:
+            return -1
+        commentLength = UINT16.unpack_from(
+            data, pos + ZIP_EOCD_COMMENT_LENGTH_FIELD_OFFSET)[0]
+        if commentLength == eocdEmptyCommentStartPos - pos:
+            return pos
+        end = pos + 3
 
 
 #####################################################################
 
 
-def timeit(method):
+# first read of a byte source, the eocd with the longest comment
+# and a zip64 locator always fit, the central directory often does
+SOURCE_TAIL_SIZE = 0x20000  # 128k
+# minimum size of the following reads, enough for most signing blocks
+SOURCE_READ_SIZE = 0x10000  # 64k
+SOURCE_MAX_SEGMENTS = 4
+HTTP_TIMEOUT = 30
 
-    def timed(*args, **kw):
-        ts = time.time() * 1000
-        result = method(*args, **kw)
-        te = time.time() * 1000
 
-        print('%s() executed in %.2f msec' % (method.__name__, te - ts))
-        return result
+class ByteSource(abc.ABC):
+    '''
+    random access reads of an apk, subclasses provide size and
+    read(offset, length), readTail(length) returns (offset, data)
+    of the last length bytes
+    '''
+    name = None
+    size = None
 
-    return timed
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @abc.abstractmethod
+    def read(self, offset, length):
+        pass
+
+    def readTail(self, length):
+        offset = max(0, self.size - length)
+        return offset, self.read(offset, self.size - offset)
+
+    def close(self):
+        pass
+
+
+class FileSource(ByteSource):
+    '''
+    local file
+    '''
+
+    def __init__(self, path):
+        self.name = path
+        self.f = open(path, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+
+    def read(self, offset, length):
+        self.f.seek(offset)
+        return self.f.read(length)
+
+    def close(self):
+        self.f.close()
+
+
+class BufferSource(ByteSource):
+    '''
+    bytes, bytearray, mmap or memoryview in memory
+    '''
+
+    def __init__(self, buf, name='<buffer>'):
+        self.name = name
+        self.view = memoryview(buf)
+        self.size = len(self.view)
+
+    def read(self, offset, length):
+        return self.view[offset:offset + length]
+
+    def close(self):
+        self.view.release()
+
+
+class HttpSource(ByteSource):
+    '''
+    http(s) url read with Range requests, the tail is read with a
+    suffix range so its response also tells the size, servers without
+    range support send the whole file once, it is kept in memory
+    '''
+
+    def __init__(self, url, timeout=HTTP_TIMEOUT, headers=None):
+        self.name = url
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.body = None
+        self._size = None
+
+    @property
+    def size(self):
+        if self._size is None:
+            self.request('HEAD')
+        return self._size
+
+    def request(self, method='GET', ranges=None):
+        # (status, body), updates the size from the response headers
+        from urllib.request import Request, urlopen
+        headers = dict(self.headers)
+        if ranges:
+            headers['Range'] = 'bytes=' + ranges
+        logger.debug('%s %s %s', method, self.name, ranges)
+        response = urlopen(Request(self.name, headers=headers,
+                                   method=method), timeout=self.timeout)
+        try:
+            status = response.status
+            body = response.read()
+            contentRange = response.headers.get('Content-Range')
+            length = response.headers.get('Content-Length')
+        finally:
+            response.close()
+        if status == 206 and contentRange and '/' in contentRange:
+            total = contentRange.rsplit('/', 1)[1].strip()
+            if total != '*':
+                self._size = int(total)
+        elif method == 'HEAD' and length is not None:
+            self._size = int(length)
+        elif status == 200 and method == 'GET':
+            # ranges ignored, got the whole file
+            self.body = memoryview(body)
+            self._size = len(body)
+        return status, body
+
+    def read(self, offset, length):
+        if length <= 0:
+            return b''
+        if self.body is None:
+            status, body = self.request(
+                ranges='{}-{}'.format(offset, offset + length - 1))
+            if status == 206:
+                return body
+        return self.body[offset:offset + length]
+
+    def readTail(self, length):
+        status, body = self.request(ranges='-{}'.format(length))
+        if status == 206:
+            # without a total length in Content-Range ask with HEAD
+            if self.size is None:
+                raise IOError('Range response of {} lacks a total length'
+                              .format(self.name))
+            return self._size - len(body), body
+        if self.body is None:
+            raise IOError('Unexpected HTTP status {} for {}'.format(
+                status, self.name))
+        return max(0, self._size - length), self.body[-length:]
+
+
+class CachedSource(ByteSource):
+    '''
+    keeps the last segments read from a source, zip metadata is parsed
+    from the end of the file towards its start, so a miss is read as
+    at least readSize bytes ending at the end of the requested range
+    '''
+
+    def __init__(self, source, readSize=SOURCE_READ_SIZE,
+                 maxSegments=SOURCE_MAX_SEGMENTS):
+        self.source = source
+        self.name = source.name
+        self.readSize = readSize
+        self.maxSegments = maxSegments
+        self.segments = []
+        self.reads = 0
+        self.bytesRead = 0
+
+    @property
+    def size(self):
+        return self.source.size
+
+    def add(self, offset, data):
+        self.reads += 1
+        self.bytesRead += len(data)
+        if _stats is not None:
+            _stats.count('source_reads')
+            _stats.count('source_bytes', len(data))
+        self.segments.insert(0, (offset, memoryview(data)))
+        del self.segments[self.maxSegments:]
+
+    def read(self, offset, length):
+        end = offset + length
+        for start, data in self.segments:
+            if start <= offset and end <= start + len(data):
+                return data[offset - start:end - start]
+        start = max(0, min(offset, end - self.readSize))
+        self.add(start, self.source.read(start, end - start))
+        return self.segments[0][1][offset - start:end - start]
+
+    def readTail(self, length):
+        offset, data = self.source.readTail(length)
+        self.add(offset, data)
+        return offset, self.segments[0][1]
+
+    def close(self):
+        self.segments = []
+        self.source.close()
+
+
+def isUrl(apk):
+    return apk.startswith(('http://', 'https://'))
+
+
+def openSource(apk):
+    # byte source of an apk path or http(s) url, with a tail cache
+    source = HttpSource(apk) if isUrl(apk) else FileSource(apk)
+    return CachedSource(source)
+
+
+def findSigningBlockInSource(source, tailSize=SOURCE_TAIL_SIZE):
+    '''
+    APK Signing Block of a byte source in two or three reads, the tail
+    with the eocd, the bytes before the central directory and only if
+    the block does not fit in there, the rest of the block
+    '''
+    if not isinstance(source, CachedSource):
+        source = CachedSource(source)
+    base, tail = source.readTail(tailSize)
+    sections = findZipSections(tail, base)
+    return findSigningBlockInSections(sections, source.read)
+
+
+def getSourceValues(source):
+    block = findSigningBlockInSource(source)
+    return parseValues(parseApkSigningBlock(block, PLUGIN_BLOCK_ID))
+
+#####################################################################
 
 
 def to_hex(s):
     return " ".join("{:02x}".format(ord(c)) for c in s) if s else ""
 
 
-def getChannel(apk):
-    apk = os.path.abspath(apk)
+def getValues(apk, verify=False):
+    # only the tail of the apk is read unless verify is set,
+    # http(s) urls are read with range requests
+    if isUrl(apk):
+        if verify:
+            raise ZipFormatException(
+                "Can not verify CRC-32 of remote apk: {}".format(apk))
+        with openSource(apk) as source:
+            return getSourceValues(source)
+    if verify:
+        result = verifyApk(apk, jobs=1)
+        if result['corrupt']:
+            raise ZipFormatException(
+                "Bad CRC-32 for file '{}'".format(result['corrupt']))
+    content = findBlockByZipSections(apk)
+    return parseValues(content)
+
+
+def getValue(apk, key):
+    '''
+    value of key in the plugin payload of apk, None if missing,
+    binary payloads decode only that value
+    '''
+    if isUrl(apk):
+        with openSource(apk) as source:
+            block = findSigningBlockInSource(source)
+            return parseValue(parseApkSigningBlock(block, PLUGIN_BLOCK_ID),
+                              key)
+    with ApkView(apk) as v:
+        return parseValue(parseApkSigningBlock(v.findSigningBlock(),
+                                               PLUGIN_BLOCK_ID), key)
+
+
+def getChannel(apk, index=None):
+    # index: optional ChannelIndex consulted before reading the apk
+    if not isUrl(apk):
+        apk = os.path.abspath(apk)
     logger.debug('apk:%s', apk)
     try:
-        zp = zipfile.ZipFile(apk)
-        zp.testzip()
-        content = findBlockByZipSections(apk)
-        values = parseValues(content)
-        if values:
+        if index:
+            values = index.getValues(apk) or {}
             channel = values.get(PLUGIN_CHANNEL_KEY)
+        else:
+            channel = getValue(apk, PLUGIN_CHANNEL_KEY)
+        if channel is not None:
             logger.debug('channel:%s', channel)
             return channel
         else:
@@ -521,24 +1221,2235 @@ def getChannel(apk):
 def showInfo(apk):
     try:
         from apkinfo import APK
-        info = APK(apk)
-        print('Package: \t{}'.format(info.get_package()))
-        print('Version: \t{}'.format(info.get_version_name()))
-        print('Build: \t\t{}'.format(info.get_version_code()))
+        with APK(apk) as info:
+            print('Package: \t{}'.format(info.get_package()))
+            print('Version: \t{}'.format(info.get_version_name()))
+            print('Build: \t\t{}'.format(info.get_version_code()))
         print('File: \t\t{}'.format(os.path.basename(apk)))
         print('Size: \t\t{}'.format(os.path.getsize(apk)))
     except Exception as e:
         pass
 
+#####################################################################
+
+
+COPY_BUFFER_SIZE = 0x400000  # 4m
+
+
+def makePayload(values, binary=False, compress=False):
+    '''
+    same layout as PackerCommon.wrapPayload(mapToString(values)),
+    or the binary layout of readPayloadBody() if binary or compress
+    '''
+    if binary or compress:
+        return makeBinaryPayload(values, compress)
+    lines = []
+    for key, value in values.items():
+        for s in (key, value):
+            if SEP_KV in s or SEP_LINE in s:
+                raise ValueError(
+                    'Separator characters not allowed: {!r}'.format(s))
+        lines.append(key + SEP_KV + value + SEP_LINE)
+    payload = u''.join(lines).encode('utf-8')
+    size = struct.pack('<i', len(payload))
+    return PLUGIN_BLOCK_MAGIC + size + payload + size
+
+
+def makeBinaryPayload(values, compress=False):
+    # channel first, so its lookup stops at the first directory entry
+    items = []
+    for key, value in sorted(values.items(),
+                             key=lambda kv: kv[0] != PLUGIN_CHANNEL_KEY):
+        key = key.encode('utf-8')
+        value = value.encode('utf-8')
+        if len(key) > UINT16_MAX_VALUE:
+            raise ValueError('Key too long: {!r}'.format(key[:32]))
+        flags = 0
+        if compress and len(value) >= PAYLOAD_COMPRESS_MIN_SIZE:
+            packed = zlib.compress(value, 9)
+            if len(packed) < len(value):
+                value = packed
+                flags |= PAYLOAD_ZLIB
+        items.append((key, flags, value))
+    if len(items) > UINT16_MAX_VALUE:
+        raise ValueError('Too many values: {}'.format(len(items)))
+    offset = PAYLOAD_HEADER.size + sum(PAYLOAD_DIR_ENTRY.size + len(key)
+                                       for key, _, _ in items)
+    directory = [PAYLOAD_HEADER.pack(PAYLOAD_VERSION, len(items))]
+    data = []
+    for key, flags, value in items:
+        directory.append(PAYLOAD_DIR_ENTRY.pack(len(key), flags, offset))
+        directory.append(key)
+        data.append(UINT32.pack(len(value)))
+        data.append(value)
+        offset += 4 + len(value)
+    payload = b''.join(directory + data)
+    size = struct.pack('<i', len(payload))
+    return PLUGIN_BLOCK_BINARY_MAGIC + size + payload + size
+
+
+def encodeIdValues(pairs):
+    return b''.join(struct.pack('<QI', len(value) + 4, sid) + bytes(value)
+                    for sid, value in pairs)
+
+
+def wrapApkSigningBlock(idValues):
+    '''
+    same layout as ApkSigningBlock.writeTo()
+    '''
+    size = struct.pack('<Q', len(idValues) + 24)
+    return size + idValues + size + APK_SIG_BLOCK_MAGIC
+
+
+def makeApkSigningBlock(pairs):
+    return wrapApkSigningBlock(encodeIdValues(pairs))
+
+
+def copyRange(src, dst, offset, length, bufsize=COPY_BUFFER_SIZE):
+    # copy length bytes at offset of src to dst through one reused buffer
+    src.seek(offset)
+    buf = memoryview(bytearray(min(bufsize, length) or 1))
+    while length > 0:
+        n = src.readinto(buf[:min(len(buf), length)])
+        if not n:
+            raise ZipFormatException(
+                'Unexpected end of file at offset {}'.format(src.tell()))
+        dst.write(buf[:n])
+        length -= n
+
+
+class ApkLayout(object):
+    '''
+    long blockOffset,   size of the unchanged entries section
+    bytes before,       encoded id-value pairs before the plugin block
+    bytes after,        encoded id-value pairs after the plugin block
+    dict values,        values of the existing plugin block
+    bytes cd,           central directory
+    bytes eocd,         everything after the central directory
+    int eocdIndex,      offset of the eocd record in eocd
+    bool zip64          eocd starts with zip64 eocd record and locator
+    bool binary         write the binary payload format
+    bool compress       zlib compress large values of binary payloads
+    '''
+
+    def __init__(self, blockOffset, pairs, values, cd, eocd,
+                 eocdIndex=0, zip64=False, binary=False, compress=False):
+        ids = [sid for sid, _ in pairs]
+        index = ids.index(PLUGIN_BLOCK_ID) \
+            if PLUGIN_BLOCK_ID in ids else len(pairs)
+        self.blockOffset = blockOffset
+        self.before = encodeIdValues(pairs[:index])
+        self.after = encodeIdValues(pairs[index + 1:])
+        self.values = values
+        self.cd = cd
+        self.eocd = eocd
+        self.eocdIndex = eocdIndex
+        self.zip64 = zip64
+        self.binary = binary
+        self.compress = compress
+
+    def makeTail(self, values):
+        # signing block with merged values + central directory + eocd
+        newValues = dict(self.values)
+        newValues.update(values)
+        block = wrapApkSigningBlock(
+            self.before +
+            encodeIdValues([(PLUGIN_BLOCK_ID, makePayload(
+                newValues, self.binary, self.compress))]) +
+            self.after)
+        cdStartOffset = self.blockOffset + len(block)
+        eocd = bytearray(self.eocd)
+        if self.zip64:
+            struct.pack_into('<Q', eocd,
+                             ZIP64_EOCD_CENTRAL_DIR_OFFSET_FIELD_OFFSET,
+                             cdStartOffset)
+            struct.pack_into('<Q', eocd,
+                             self.eocdIndex - ZIP64_EOCD_LOCATOR_SIZE +
+                             ZIP64_EOCD_LOCATOR_OFFSET_FIELD_OFFSET,
+                             cdStartOffset + len(self.cd))
+        elif cdStartOffset > UINT32_MAX_VALUE:
+            raise ZipFormatException(
+                "ZIP Central Directory offset out of range: {}"
+                .format(cdStartOffset))
+        struct.pack_into('<I', eocd,
+                         self.eocdIndex +
+                         ZIP_EOCD_CENTRAL_DIR_OFFSET_FIELD_OFFSET,
+                         min(cdStartOffset, UINT32_MAX_VALUE))
+        return b''.join((block, self.cd, bytes(eocd)))
+
+
+def readLayout(apk):
+    with ApkView(apk) as v:
+        index = v.blockIndex()
+        sections = v.sections
+        blockOffset = index.base
+        logger.debug('blockOffset:%s', blockOffset)
+        if APK_SIGNATURE_SCHEME_V2_BLOCK_ID not in index:
+            raise SignatureNotFoundException(
+                "No APK Signature Scheme v2 block in APK Signing Block")
+        pairs = [(entry.id, entry.tobytes()) for entry in index]
+        content = index.get(PLUGIN_BLOCK_ID)
+        values = parseValues(content) or {}
+        # a rewrite keeps the payload format of the apk
+        binary = compress = False
+        if values and isBinaryPayload(content):
+            binary = True
+            compress = any(flags & PAYLOAD_ZLIB for _, flags, _ in
+                           iterPayloadKeys(readPayloadBody(content)))
+        cd = v.centralDirectory().tobytes()
+        cdEndOffset = sections.cdStartOffset + sections.cdSizeBytes
+        eocd = v.view[cdEndOffset:].tobytes()
+    return ApkLayout(blockOffset, pairs, values, cd, eocd,
+                     sections.eocdOffset - cdEndOffset,
+                     sections.zip64EocdOffset is not None,
+                     binary, compress)
+
+
+def writeValues(apk, values, output=None, binary=None, compress=None,
+                javaRuntime=True):
+    '''
+    merge values into the plugin block like PackerCommon.writeValues(),
+    replace apk, or write a new apk to output,
+    binary and compress default to the payload format of apk,
+    switching to them needs javaRuntime=False: PackerNg in the app
+    only reads the text payload and finds no channel in a binary one
+    '''
+    layout = readLayout(apk)
+    if (binary or compress) and javaRuntime and not layout.binary:
+        raise ValueError('Binary payload is not read by the PackerNg '
+                         'runtime library, only for apps not using it')
+    if binary is not None:
+        layout.binary = binary
+    if compress is not None:
+        layout.compress = compress
+    tail = layout.makeTail(values)
+    # written next to the target and renamed over it, an interrupted
+    # write or a full disk never leaves a broken apk behind
+    import shutil
+    import tempfile
+    target = output or apk
+    fd, temp = tempfile.mkstemp(
+        prefix='.{}.'.format(os.path.basename(target)), suffix='.tmp',
+        dir=os.path.dirname(os.path.abspath(target)))
+    try:
+        with open(apk, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            copyRange(src, dst, 0, layout.blockOffset)
+            dst.write(tail)
+        shutil.copymode(apk, temp)
+        os.replace(temp, target)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def writeChannel(apk, channel, output=None):
+    writeValues(apk, {PLUGIN_CHANNEL_KEY: channel}, output)
+
+
+def writeMain(prog, args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='{} write'.format(prog),
+        description='write channel and values into apk')
+    parser.add_argument('apk', help='signed apk file')
+    parser.add_argument('channel', help='channel name')
+    parser.add_argument('-o', '--output',
+                        help='output apk (default: replace apk)')
+    parser.add_argument('-v', '--value', action='append', default=[],
+                        metavar='KEY=VALUE', help='extra payload value')
+    parser.add_argument('--binary', action='store_true', default=None,
+                        help='write the indexed binary payload format, '
+                        'read by the python tools only')
+    parser.add_argument('--compress', action='store_true', default=None,
+                        help='binary payload with zlib compressed values')
+    parser.add_argument('--no-java-runtime', dest='java_runtime',
+                        action='store_false',
+                        help='the app does not read its channel with the '
+                        'PackerNg runtime library, required by --binary '
+                        'and --compress, the library can not read them')
+    opts = parser.parse_args(args)
+    if (opts.binary or opts.compress) and opts.java_runtime:
+        parser.error('--binary and --compress need --no-java-runtime, '
+                     'PackerNg.getChannel() returns null for them')
+    values = dict(v.split('=', 1) for v in opts.value)
+    values[PLUGIN_CHANNEL_KEY] = opts.channel
+    writeValues(opts.apk, values, opts.output, opts.binary, opts.compress,
+                opts.java_runtime)
+    return 0
+
+#####################################################################
+
+
+BATCH_FIELDS = ('path', 'channel', 'values', 'size', 'latency_ms', 'error')
+INFO_FIELDS = ('package', 'label', 'version_name', 'version_code')
+
+
+@functools.lru_cache(maxsize=None)
+def manifestCache(path=None):
+    '''
+    apkinfo.ManifestCache of this process, in memory only without
+    a path, channel variants of a build share their manifest so it
+    is decoded once per process (once in all with a sqlite path)
+    '''
+    from apkinfo import ManifestCache
+    return ManifestCache(path)
+
+
+def readInfo(apk, result, cachePath=None):
+    # manifest package, label and version of a local apk into result,
+    # string resource references are resolved from resources.arsc
+    from apkinfo import APK
+    with APK(apk, cache=manifestCache(cachePath)) as a:
+        # fields stay None without a readable AndroidManifest.xml
+        if a.is_valid_APK():
+            result['package'] = a.get_package() or None
+            result['label'] = a.get_app_name() or None
+            result['version_name'] = a.get_version_name() or None
+            result['version_code'] = a.get_version_code() or None
+
+
+def absPath(apk):
+    # absolute path of a local apk, urls are left as they are
+    return apk if isUrl(apk) else os.path.abspath(apk)
+
+
+def findApks(sources):
+    '''
+    expand apk files, directories, glob patterns and @list files
+    (one path per line, '@-' reads stdin) into absolute apk paths,
+    so results and index entries do not depend on the current dir
+    '''
+    import glob
+    for source in sources:
+        if source.startswith('@'):
+            name = source[1:]
+            f = sys.stdin if name == '-' else open(name)
+            try:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        yield absPath(line)
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+        elif os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith('.apk'):
+                        yield absPath(os.path.join(root, name))
+        elif any(c in source for c in '*?['):
+            for path in sorted(glob.glob(source)):
+                yield absPath(path)
+        else:
+            yield absPath(source)
+
+
+def readResult(apk, verify=False, stats=False, info=False,
+               cachePath=None):
+    # batch worker, never raises so one bad file can not stop the pool,
+    # with stats the LookupStats of this apk are returned in 'stats',
+    # with info the INFO_FIELDS are read through manifestCache(cachePath)
+    global _stats
+    if stats:
+        saved, _stats = _stats, LookupStats()
+        _stats.count('apks')
+    ts = time.time()
+    result = dict.fromkeys(BATCH_FIELDS + INFO_FIELDS if info
+                           else BATCH_FIELDS)
+    result['path'] = apk
+    try:
+        if isUrl(apk) and not verify:
+            with openSource(apk) as source:
+                values = getSourceValues(source)
+                result['size'] = source.size
+        else:
+            result['size'] = os.path.getsize(apk)
+            values = getValues(apk, verify)
+        if values:
+            result['values'] = values
+            result['channel'] = values.get(PLUGIN_CHANNEL_KEY)
+        if info and not isUrl(apk):
+            readInfo(apk, result, cachePath)
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['latency_ms'] = round((time.time() - ts) * 1000, 3)
+    if stats:
+        if result['error']:
+            _stats.count('errors')
+        result['stats'] = _stats.toDict()
+        _stats = saved
+    return result
+
+
+def batchChannels(sources, jobs=None, chunksize=4, verify=False,
+                  index=None, info=False, cachePath=None):
+    '''
+    read channels of all apks found in sources using a pool of
+    jobs processes, yield result dicts in completion order,
+    with a ChannelIndex only new or changed apks are read,
+    while stats are enabled the workers' LookupStats are merged in,
+    with info the manifest INFO_FIELDS are added, each distinct
+    manifest is decoded once per worker, or once in all when the
+    workers share a manifest cache file at cachePath
+    '''
+    import multiprocessing
+    stats = _stats
+    apks = findApks(sources)
+    if index is not None:
+        keys = {}
+        for apk in apks:
+            result = index.lookupResult(apk, keys)
+            if result:
+                if info:
+                    # the index only holds channel values, a sqlite
+                    # cache is left to the workers, they fork from here
+                    result.update(dict.fromkeys(INFO_FIELDS))
+                    try:
+                        readInfo(apk, result)
+                    except Exception as e:
+                        result['error'] = '{}: {}'.format(
+                            type(e).__name__, e)
+                if stats is not None:
+                    stats.count('apks')
+                    stats.count('index_hits')
+                yield result
+        index.commit()
+        apks = list(keys)
+    read = functools.partial(readResult, verify=verify,
+                             stats=stats is not None, info=info,
+                             cachePath=cachePath)
+    if jobs == 1 or apks == []:
+        results = (read(apk) for apk in apks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap_unordered(read, apks, chunksize)
+    try:
+        for result in results:
+            if stats is not None:
+                stats.merge(result.pop('stats'))
+            if index is not None and not result['error']:
+                index.store(result['path'], keys[result['path']],
+                            result['values'])
+            yield result
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        if index is not None:
+            index.commit()
+
+
+def writeResults(results, out, fmt='json', fields=BATCH_FIELDS):
+    # stream results as json lines or csv rows, return error count
+    import csv
+    import json
+    errors = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(fields)
+    for result in results:
+        if result['error']:
+            errors += 1
+        if fmt == 'csv':
+            row = dict(result)
+            if row['values'] is not None:
+                row['values'] = json.dumps(row['values'],
+                                           ensure_ascii=False,
+                                           sort_keys=True)
+            writer.writerow([row[k] for k in fields])
+        else:
+            out.write(json.dumps(result, ensure_ascii=False,
+                                 sort_keys=True) + '\n')
+        out.flush()
+    return errors
+
+
+def batchMain(prog, args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='{} batch'.format(prog),
+        description='read channels of many apks with a process pool')
+    parser.add_argument('sources', nargs='+',
+                        help='apk files, directories, glob patterns '
+                        'or @list files (@- for stdin)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: cpu count)')
+    parser.add_argument('-f', '--format', choices=('json', 'csv'),
+                        default='json',
+                        help='output format (default: json lines)')
+    parser.add_argument('-o', '--output',
+                        help='output file (default: stdout)')
+    parser.add_argument('--chunksize', type=int, default=4,
+                        help='apks handed to a worker at once')
+    parser.add_argument('--verify', action='store_true',
+                        help='also check crc-32 of all zip entries')
+    parser.add_argument('--index', metavar='DB',
+                        help='channel index to consult and update')
+    parser.add_argument('--info', action='store_true',
+                        help='also read package and version from the '
+                        'manifest, decoded once per distinct manifest')
+    parser.add_argument('--manifest-cache', metavar='DB',
+                        help='manifest cache file shared by the workers '
+                        'and later runs (default: in memory)')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='write per-phase lookup stats to FILE')
+    parser.add_argument('--stats-format', choices=('json', 'prometheus'),
+                        default='json',
+                        help='stats format (default: json)')
+    opts = parser.parse_args(args)
+    index = ChannelIndex(opts.index) if opts.index else None
+    if opts.stats:
+        enableStats()
+    try:
+        results = batchChannels(opts.sources, opts.jobs, opts.chunksize,
+                                opts.verify, index, opts.info,
+                                opts.manifest_cache)
+        fields = BATCH_FIELDS + INFO_FIELDS if opts.info else BATCH_FIELDS
+        if opts.output:
+            with io.open(opts.output, 'w', encoding='utf-8',
+                         newline='') as out:
+                errors = writeResults(results, out, opts.format, fields)
+        else:
+            errors = writeResults(results, sys.stdout, opts.format, fields)
+    finally:
+        if index is not None:
+            index.close()
+        if opts.stats:
+            writeStats(disableStats(), opts.stats, opts.stats_format)
+    return 1 if errors else 0
+
+#####################################################################
+
+
+ASYNC_LIMIT = 16
+
+LOOKUP_FIELDS = ('path', 'channel', 'values', 'package', 'label',
+                 'version_name', 'version_code', 'size', 'latency_ms',
+                 'error')
+
+
+def lookupApk(apk, info=True):
+    '''
+    channel, values and with info the manifest package and version of
+    apk as a dict, never raises, errors are reported in the dict,
+    manifests shared by channel variants are decoded once per process
+    '''
+    ts = time.time()
+    result = dict.fromkeys(LOOKUP_FIELDS)
+    result['path'] = apk
+    try:
+        if isUrl(apk):
+            with openSource(apk) as source:
+                values = getSourceValues(source)
+                result['size'] = source.size
+        else:
+            result['size'] = os.path.getsize(apk)
+            values = getValues(apk)
+        if values:
+            result['values'] = values
+            result['channel'] = values.get(PLUGIN_CHANNEL_KEY)
+        if info and not isUrl(apk):
+            readInfo(apk, result)
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['latency_ms'] = round((time.time() - ts) * 1000, 3)
+    return result
+
+
+class AsyncLookup(object):
+    '''
+    asyncio counterpart of lookupApk(), the blocking reads run in an
+    executor (default: the loop thread pool, pass a process pool for
+    cpu bound manifest parsing) and at most limit lookups run at once
+
+        lookup = AsyncLookup(limit=32)
+        result = await lookup.lookup('app.apk')
+        results = await lookup.lookupAll(apks)
+    '''
+
+    def __init__(self, limit=ASYNC_LIMIT, executor=None, info=True):
+        if limit < 1:
+            raise ValueError('limit must be positive: {}'.format(limit))
+        self.limit = limit
+        self.executor = executor
+        self.info = info
+        self._loop = None
+        self._semaphore = None
+
+    def semaphore(self):
+        # one semaphore per event loop, asyncio.run() makes a new loop
+        import asyncio
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def lookup(self, apk, info=None):
+        import asyncio
+        if info is None:
+            info = self.info
+        async with self.semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, lookupApk, apk, info)
+
+    async def lookupAll(self, apks, info=None):
+        # results in the order of apks
+        import asyncio
+        return await asyncio.gather(*[self.lookup(apk, info)
+                                      for apk in apks])
+
+    async def getChannel(self, apk):
+        return (await self.lookup(apk, info=False))['channel']
+
+
+#####################################################################
+
+
+def handleRequest(request):
+    '''
+    answer one worker request, a path or url reads it like batch,
+    a dict names the operation in 'op' (default: read):
+
+      read      apk, verify           batch result
+      value     apk, key              value of one key
+      write     apk, channel, values, output, binary, compress,
+                java_runtime (false required by binary and compress)
+      lookup    apk, info             lookupApk() result
+
+    never raises, errors are reported in 'error', 'id' is echoed
+    '''
+    if not isinstance(request, dict):
+        request = {'apk': request}
+    op = request.get('op', 'read')
+    apk = request.get('apk')
+    try:
+        if not isinstance(apk, str) or not apk:
+            raise ValueError('Missing apk in request')
+        if op == 'read':
+            result = readResult(apk, bool(request.get('verify')))
+        elif op == 'lookup':
+            result = lookupApk(apk, request.get('info', True))
+        elif op == 'value':
+            key = request.get('key', PLUGIN_CHANNEL_KEY)
+            result = {'path': apk, 'key': key, 'value': getValue(apk, key),
+                      'error': None}
+        elif op == 'write':
+            values = dict(request.get('values') or {})
+            if request.get('channel') is not None:
+                values[PLUGIN_CHANNEL_KEY] = request['channel']
+            output = request.get('output')
+            writeValues(apk, values, output, request.get('binary'),
+                        request.get('compress'),
+                        request.get('java_runtime', True))
+            result = {'path': output or apk, 'error': None}
+        else:
+            raise ValueError('Unknown op: {}'.format(op))
+    except Exception as e:
+        result = {'path': apk,
+                  'error': '{}: {}'.format(type(e).__name__, e)}
+    if 'id' in request:
+        result['id'] = request['id']
+    return result
+
+
+def serveRequests(inp, out):
+    '''
+    one warm process for a whole build: read newline-delimited paths
+    or json requests from inp, write one json line per request to out
+    in order, until eof, return error count
+    '''
+    import json
+    errors = 0
+    for line in iter(inp.readline, ''):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                result = {'path': None,
+                          'error': '{}: {}'.format(type(e).__name__, e)}
+            else:
+                result = handleRequest(request)
+        else:
+            result = handleRequest(line)
+        if result['error']:
+            errors += 1
+        if _stats is not None:
+            _stats.count('apks')
+            _stats.count('errors', 1 if result['error'] else 0)
+        out.write(json.dumps(result, ensure_ascii=False,
+                             sort_keys=True) + '\n')
+        out.flush()
+    return errors
+
+
+def workerMain(prog, args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='{} worker'.format(prog),
+        description='answer apk requests from stdin on stdout, one json '
+        'line per request, a line is a path, url or json request '
+        'like {"op": "write", "apk": "app.apk", "channel": "Google", '
+        '"output": "app-google.apk"}')
+    parser.add_argument('--stats', metavar='FILE',
+                        help='write per-phase lookup stats to FILE at exit')
+    parser.add_argument('--stats-format', choices=('json', 'prometheus'),
+                        default='json',
+                        help='stats format (default: json)')
+    opts = parser.parse_args(args)
+    if opts.stats:
+        enableStats()
+    try:
+        serveRequests(sys.stdin, sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if opts.stats:
+            writeStats(disableStats(), opts.stats, opts.stats_format)
+    return 0
+
+
+#####################################################################
+
+
+INDEX_MAX_ENTRIES = 1000000
+# recency of index hits is written in batches, not per hit
+INDEX_TOUCH_BATCH = 1000
+INDEX_TOUCH_INTERVAL = 60  # seconds
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS channels (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    cdOffset INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    channel TEXT,
+    vals TEXT NOT NULL,
+    atime REAL NOT NULL,
+    PRIMARY KEY (dev, ino)
+);
+CREATE INDEX IF NOT EXISTS channels_channel ON channels (channel);
+CREATE INDEX IF NOT EXISTS channels_path ON channels (path);
+CREATE INDEX IF NOT EXISTS channels_atime ON channels (atime);
+'''
+
+
+def defaultIndexPath():
+    return os.path.join(os.path.expanduser('~'), '.cache',
+                        'packer-ng', 'channels.db')
+
+
+def readCdOffset(apk, size):
+    # central directory offset from the eocd, one small read if no comment
+    with open(apk, 'rb') as f:
+        if size >= ZIP_EOCD_REC_MIN_SIZE:
+            f.seek(size - ZIP_EOCD_REC_MIN_SIZE)
+            eocd = f.read(ZIP_EOCD_REC_MIN_SIZE)
+            d = ByteDecoder(eocd)
+            if d.getUInt(0) == ZIP_EOCD_REC_SIG and \
+                    d.getUShort(ZIP_EOCD_COMMENT_LENGTH_FIELD_OFFSET) == 0:
+                offset = d.getUInt(ZIP_EOCD_CENTRAL_DIR_OFFSET_FIELD_OFFSET)
+                if offset != UINT32_MAX_VALUE:
+                    return offset
+    with ApkView(apk) as v:
+        return v.sections.cdStartOffset
+
+
+def fileKey(apk):
+    # (device, inode, size, mtime, central directory offset)
+    st = os.stat(apk)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+            readCdOffset(apk, st.st_size))
+
+
+class ChannelIndex(object):
+    '''
+    persistent sqlite index of parseValues() results, keyed by
+    (device, inode, size, mtime, central directory offset), with
+    reverse channel -> path lookup and LRU eviction past maxEntries,
+    paths are stored absolute, hits only write their recency on
+    commit(), or once INDEX_TOUCH_BATCH hits or INDEX_TOUCH_INTERVAL
+    seconds are pending, commit() also evicts after new entries
+    '''
+
+    def __init__(self, path=None, maxEntries=INDEX_MAX_ENTRIES):
+        import sqlite3
+        self.path = path or defaultIndexPath()
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.maxEntries = maxEntries
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(INDEX_SCHEMA)
+        # (dev, ino) -> (path, atime) of hits not written yet
+        self.touched = {}
+        self.touchedSince = time.time()
+        self.stored = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.db is not None:
+            self.commit()
+            self.db.close()
+            self.db = None
+
+    def commit(self):
+        self.flushTouched()
+        if self.stored:
+            self.stored = False
+            self.trim()
+        self.db.commit()
+
+    def touch(self, apk, key):
+        now = time.time()
+        self.touched[key[:2]] = (apk, now)
+        if len(self.touched) >= INDEX_TOUCH_BATCH or \
+                now - self.touchedSince >= INDEX_TOUCH_INTERVAL:
+            self.commit()
+
+    def flushTouched(self):
+        if self.touched:
+            self.db.executemany(
+                'UPDATE channels SET path = ?, atime = ? '
+                'WHERE dev = ? AND ino = ?',
+                [value + key for key, value in self.touched.items()])
+            self.touched = {}
+        self.touchedSince = time.time()
+
+    def lookup(self, apk, key=None):
+        '''
+        cached values of apk, {} if it has no plugin block,
+        None if it is not indexed or has changed
+        '''
+        import json
+        apk = os.path.abspath(apk)
+        key = key or fileKey(apk)
+        row = self.db.execute(
+            'SELECT size, mtime, cdOffset, vals FROM channels '
+            'WHERE dev = ? AND ino = ?', key[:2]).fetchone()
+        if row is None or tuple(row[:3]) != key[2:]:
+            return None
+        self.touch(apk, key)
+        return json.loads(row[3])
+
+    def lookupResult(self, apk, misses):
+        # batch result dict for a cached apk, else record its key in misses
+        ts = time.time()
+        try:
+            key = fileKey(apk)
+            values = self.lookup(apk, key)
+        except Exception:
+            # unreadable, let the batch worker report the error
+            misses[apk] = None
+            return None
+        if values is None:
+            misses[apk] = key
+            return None
+        result = dict.fromkeys(BATCH_FIELDS)
+        result['path'] = apk
+        result['size'] = key[2]
+        if values:
+            result['values'] = values
+            result['channel'] = values.get(PLUGIN_CHANNEL_KEY)
+        result['latency_ms'] = round((time.time() - ts) * 1000, 3)
+        return result
+
+    def store(self, apk, key, values):
+        import json
+        if key is None:
+            return
+        apk = os.path.abspath(apk)
+        values = values or {}
+        self.db.execute(
+            'INSERT OR REPLACE INTO channels (dev, ino, size, mtime, '
+            'cdOffset, path, channel, vals, atime) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            key + (apk, values.get(PLUGIN_CHANNEL_KEY),
+                   json.dumps(values, ensure_ascii=False, sort_keys=True),
+                   time.time()))
+        self.touched.pop(key[:2], None)
+        self.stored = True
+
+    def getValues(self, apk):
+        # getValues() through the index
+        key = fileKey(apk)
+        values = self.lookup(apk, key)
+        if values is None:
+            values = getValues(apk) or {}
+            self.store(apk, key, values)
+            self.commit()
+        elif _stats is not None:
+            _stats.count('index_hits')
+        return values or None
+
+    def find(self, channel):
+        # reverse lookup, paths of all indexed apks with this channel
+        return [row[0] for row in self.db.execute(
+            'SELECT path FROM channels WHERE channel = ? ORDER BY path',
+            (channel,))]
+
+    def evict(self):
+        # drop least recently used entries past maxEntries, return count
+        self.flushTouched()
+        evicted = self.trim()
+        self.db.commit()
+        return evicted
+
+    def trim(self):
+        count = self.db.execute('SELECT COUNT(*) FROM channels').fetchone()[0]
+        if count > self.maxEntries:
+            self.db.execute(
+                'DELETE FROM channels WHERE rowid IN (SELECT rowid '
+                'FROM channels ORDER BY atime LIMIT ?)',
+                (count - self.maxEntries,))
+        return max(0, count - self.maxEntries)
+
+    def prune(self):
+        # drop entries whose file is gone or changed, relative paths
+        # of older indexes can not be checked from here and are kept
+        stale = []
+        for path, dev, ino in self.db.execute(
+                'SELECT path, dev, ino FROM channels').fetchall():
+            if not os.path.isabs(path):
+                continue
+            try:
+                st = os.stat(path)
+                if (st.st_dev, st.st_ino) == (dev, ino):
+                    continue
+            except OSError:
+                pass
+            stale.append((dev, ino))
+        self.db.executemany(
+            'DELETE FROM channels WHERE dev = ? AND ino = ?', stale)
+        self.commit()
+        return len(stale)
+
+
+def indexMain(prog, args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='{} index'.format(prog),
+        description='persistent channel index with reverse lookup')
+    parser.add_argument('--db', default=None,
+                        help='index file (default: {})'.format(
+                            defaultIndexPath()))
+    parser.add_argument('--max-entries', type=int,
+                        default=INDEX_MAX_ENTRIES,
+                        help='entries kept, least recently used go first')
+    sub = parser.add_subparsers(dest='action')
+    p = sub.add_parser('refresh', help='index new and changed apks')
+    p.add_argument('sources', nargs='+',
+                   help='apk files, directories, glob patterns or @list')
+    p.add_argument('-j', '--jobs', type=int, default=None,
+                   help='worker processes (default: cpu count)')
+    p.add_argument('--prune', action='store_true',
+                   help='also drop entries of deleted or replaced files')
+    p = sub.add_parser('find', help='paths of apks with a channel')
+    p.add_argument('channel')
+    p = sub.add_parser('show', help='channel of apks, read if not indexed')
+    p.add_argument('apks', nargs='+')
+    opts = parser.parse_args(args)
+    if not opts.action:
+        parser.error('missing action')
+    with ChannelIndex(opts.db, opts.max_entries) as index:
+        if opts.action == 'refresh':
+            total = errors = 0
+            for result in batchChannels(opts.sources, opts.jobs,
+                                        index=index):
+                total += 1
+                if result['error']:
+                    errors += 1
+                    print('{}\t{}'.format(result['path'], result['error']),
+                          file=sys.stderr)
+            pruned = index.prune() if opts.prune else 0
+            print('{} apks, {} errors, {} pruned'.format(
+                total, errors, pruned))
+            return 1 if errors else 0
+        elif opts.action == 'find':
+            paths = index.find(opts.channel)
+            for path in paths:
+                print(path)
+            return 0 if paths else 1
+        else:
+            for apk in opts.apks:
+                print('{}\t{}'.format(apk, getChannel(apk, index)))
+            return 0
+
+#####################################################################
+
+
+# (layout, view, outputDir, baseName, extName) of the base apk,
+# set before the pool forks so workers share the mapping copy-on-write
+_generator = None
+
+
+def channelFileName(name):
+    # channel name escaped for file names like the java cli
+    return re.sub(r'[\\/:*?"\'<>|]', '_', name)
+
+
+def readChannels(value):
+    '''
+    channels from '@file' in markets.txt format (name#comment) or
+    a comma separated list, escaped for file names like the java cli
+    '''
+    if value.startswith('@'):
+        with io.open(value[1:], encoding='utf-8') as f:
+            names = [line.split('#')[0].strip() for line in f]
+    else:
+        names = [name.strip() for name in value.split(',')]
+    channels = []
+    seen = set()
+    for name in names:
+        name = channelFileName(name)
+        if name and name not in seen:
+            seen.add(name)
+            channels.append(name)
+    return channels
+
+
+def generateOne(channel):
+    layout, view, outputDir, baseName, extName = _generator
+    ts = time.time()
+    path = os.path.join(outputDir, u'{}-{}{}'.format(
+        baseName, channel, extName))
+    error = None
+    try:
+        with open(path, 'wb') as f:
+            f.write(view[:layout.blockOffset])
+            f.write(layout.makeTail({PLUGIN_CHANNEL_KEY: channel}))
+        values = parseValues(findBlockByZipSections(path))
+        if not values or values.get(PLUGIN_CHANNEL_KEY) != channel:
+            raise ZipFormatException('Failed to verify APK: ' + path)
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+        if os.path.exists(path):
+            os.remove(path)
+    return channel, path, error, round((time.time() - ts) * 1000, 3)
+
+
+def generateChannels(apk, channels, outputDir, jobs=None, chunksize=16):
+    '''
+    write one apk per channel into outputDir, the base apk is parsed and
+    mapped once, yield (channel, path, error, ms) in completion order
+    '''
+    import multiprocessing
+    global _generator
+    layout = readLayout(apk)
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+    baseName, extName = os.path.splitext(os.path.basename(apk))
+    base = ApkView(apk)
+    _generator = (layout, base.view, outputDir, baseName, extName)
+    pool = None
+    try:
+        if jobs == 1 or not hasattr(os, 'fork'):
+            results = (generateOne(channel) for channel in channels)
+        else:
+            pool = multiprocessing.get_context('fork').Pool(jobs)
+            results = pool.imap_unordered(generateOne, channels, chunksize)
+        for result in results:
+            yield result
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        _generator = None
+        base.close()
+
+
+def generateMain(prog, args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='{} generate'.format(prog),
+        description='write one apk per channel from a base apk')
+    parser.add_argument('apk', help='signed base apk file')
+    parser.add_argument('-c', '--channels', required=True,
+                        help='@file in markets.txt format or ch1,ch2,ch3')
+    parser.add_argument('-o', '--output', default='output',
+                        help='output directory (default: output)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: cpu count)')
+    opts = parser.parse_args(args)
+    ts = time.time()
+    channels = readChannels(opts.channels)
+    failed = 0
+    for channel, path, error, ms in generateChannels(
+            opts.apk, channels, opts.output, opts.jobs):
+        if error:
+            failed += 1
+            print('Failed {}: {}'.format(channel, error), file=sys.stderr)
+        else:
+            print('Generating {}'.format(os.path.basename(path)))
+    print('Generated {} of {} apks in {:.2f}s'.format(
+        len(channels) - failed, len(channels), time.time() - ts))
+    return 1 if failed else 0
+
+#####################################################################
+
+
+SERVE_PORT = 8080
+SERVE_TAIL_CACHE_SIZE = 256
+APK_CONTENT_TYPE = 'application/vnd.android.package-archive'
+
+
+class StampedApk(object):
+    '''
+    base apk parsed once and kept open, the apk of a channel is the
+    first blockOffset bytes of the base followed by a tail built per
+    channel, recently used tails are cached
+    '''
+
+    def __init__(self, apk, cacheSize=SERVE_TAIL_CACHE_SIZE):
+        self.path = apk
+        self.name = os.path.splitext(os.path.basename(apk))[0]
+        self.layout = readLayout(apk)
+        self.f = open(apk, 'rb')
+        st = os.fstat(self.f.fileno())
+        self.mtime = st.st_mtime
+        self.tag = '{:x}-{:x}'.format(st.st_size, int(st.st_mtime))
+        self.cacheSize = cacheSize
+        self.tails = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def tail(self, channel):
+        with self.lock:
+            tail = self.tails.pop(channel, None)
+        if tail is None:
+            tail = self.layout.makeTail({PLUGIN_CHANNEL_KEY: channel})
+        with self.lock:
+            self.tails[channel] = tail
+            while len(self.tails) > self.cacheSize:
+                self.tails.popitem(last=False)
+        return tail
+
+    def etag(self, channel):
+        return '"{}-{:08x}"'.format(
+            self.tag, zlib.crc32(channel.encode('utf-8')) & 0xffffffff)
+
+    def send(self, sock, start, end, tail):
+        # bytes [start, end) of the channel apk, prefix without copies
+        blockOffset = self.layout.blockOffset
+        if start < blockOffset:
+            self.sendPrefix(sock, start, min(end, blockOffset) - start)
+        if end > blockOffset:
+            sock.sendall(memoryview(tail)[max(start, blockOffset) -
+                                          blockOffset:end - blockOffset])
+
+    def sendPrefix(self, sock, offset, count):
+        if hasattr(os, 'sendfile'):
+            # explicit offsets, the file is shared by all threads
+            out, fd = sock.fileno(), self.f.fileno()
+            while count > 0:
+                sent = os.sendfile(out, fd, offset, count)
+                if not sent:
+                    raise ZipFormatException(
+                        'Unexpected end of file at offset {}'.format(offset))
+                offset += sent
+                count -= sent
+            return
+        while count > 0:
+            with self.lock:
+                self.f.seek(offset)
+                data = self.f.read(min(count, COPY_BUFFER_SIZE))
+            if not data:
+                raise ZipFormatException(
+                    'Unexpected end of file at offset {}'.format(offset))
+            sock.sendall(data)
+            offset += len(data)
+            count -= len(data)
+
+    def close(self):
+        self.f.close()
+
+
+def parseRange(header, size):
+    '''
+    (start, end) of a single 'bytes=' range, end exclusive, None if the
+    whole file should be sent, ValueError if the range can not be met
+    '''
+    m = re.match(r'^bytes=(\d*)-(\d*)$', header.strip())
+    if not m or m.groups() == ('', ''):
+        # invalid or multiple ranges, may be ignored (rfc 7233)
+        return None
+    first, last = m.groups()
+    if not first:
+        if int(last) == 0:
+            raise ValueError('Empty suffix range')
+        return max(0, size - int(last)), size
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError('Range start out of range: {}'.format(start))
+    return start, end
+
+
+class StampHandler(object):
+    '''
+    GET and HEAD of /<base>/<channel>.apk, or /<channel>.apk with a
+    single base, supports Range and If-Range for resumable downloads,
+    mixed into BaseHTTPRequestHandler by stampHandlerClass()
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.info('%s %s', self.address_string(), format % args)
+
+    def do_HEAD(self):
+        self.stamp(False)
+
+    def do_GET(self):
+        self.stamp(True)
+
+    def route(self):
+        # (StampedApk, channel) or None
+        from urllib.parse import unquote, urlsplit
+        path = unquote(urlsplit(self.path).path).strip('/')
+        if not path.endswith('.apk'):
+            return None
+        parts = path[:-len('.apk')].split('/')
+        apks = self.server.apks
+        if len(parts) == 2:
+            apk = apks.get(parts[0])
+        elif len(parts) == 1 and len(apks) == 1:
+            apk = list(apks.values())[0]
+        else:
+            return None
+        channel = parts[-1]
+        allowed = self.server.channels
+        if not apk or not channel or \
+                (allowed is not None and channel not in allowed):
+            return None
+        return apk, channel
+
+    def stamp(self, body):
+        from urllib.parse import quote
+        target = self.route()
+        if not target:
+            self.send_error(404)
+            return
+        apk, channel = target
+        try:
+            tail = apk.tail(channel)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        size = apk.layout.blockOffset + len(tail)
+        etag = apk.etag(channel)
+        span = None
+        header = self.headers.get('Range')
+        ifRange = self.headers.get('If-Range')
+        if header and (not ifRange or ifRange == etag):
+            try:
+                span = parseRange(header, size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        start, end = span or (0, size)
+        self.send_response(206 if span else 200)
+        if span:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                start, end - 1, size))
+        self.send_header('Content-Type', APK_CONTENT_TYPE)
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Content-Disposition',
+                         "attachment; filename*=UTF-8''{}".format(
+                             quote(u'{}-{}.apk'.format(apk.name, channel))))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified',
+                         self.date_time_string(int(apk.mtime)))
+        self.end_headers()
+        if not body:
+            return
+        try:
+            apk.send(self.connection, start, end, tail)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            # client went away, resumes with a Range request
+            logger.debug('send aborted: %s', e)
+            self.close_connection = True
+
+
+@functools.lru_cache(maxsize=None)
+def stampHandlerClass():
+    # http.server is only imported once a server is started
+    from http.server import BaseHTTPRequestHandler
+    return type('StampHandler', (StampHandler, BaseHTTPRequestHandler),
+                {'server_version': 'packer-ng/{}'.format(getVersion())})
+
+
+def serveChannels(apks, host='', port=SERVE_PORT, channels=None):
+    '''
+    http server stamping channel apks on request, apks are parsed once,
+    channels limits the names served (default: any channel)
+    '''
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((host, port), stampHandlerClass())
+    server.apks = collections.OrderedDict()
+    for apk in apks:
+        stamped = StampedApk(apk)
+        server.apks[stamped.name] = stamped
+    server.channels = set(channels) if channels is not None else None
+    return server
+
+
+def serveMain(prog, args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='{} serve'.format(prog),
+        description='serve channel apks built on request from base apks')
+    parser.add_argument('apks', nargs='+', help='signed base apk files')
+    parser.add_argument('-H', '--host', default='',
+                        help='listen address (default: all)')
+    parser.add_argument('-p', '--port', type=int, default=SERVE_PORT,
+                        help='listen port (default: {})'.format(SERVE_PORT))
+    parser.add_argument('-c', '--channels',
+                        help='@file in markets.txt format or ch1,ch2,ch3 '
+                        '(default: any channel)')
+    opts = parser.parse_args(args)
+    channels = readChannels(opts.channels) if opts.channels else None
+    server = serveChannels(opts.apks, opts.host, opts.port, channels)
+    host, port = server.server_address[:2]
+    for name in server.apks:
+        print('Serving http://{}:{}/{}/<channel>.apk'.format(
+            host, port, name))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for apk in server.apks.values():
+            apk.close()
+    return 0
+
+#####################################################################
+
+
+PACK_MAGIC = b'Packer Ng Pack\x00\x00'
+PACK_VERSION = 1
+PACK_EXT = '.apkpack'
+# magic, version, count, prefix offset and size, cd offset and size,
+# records, hash table offset and slots, names offset and size
+PACK_HEADER = struct.Struct('<16sIIQQQQQQIQQ')
+# segment offset, signing block size, eocd size, name offset and size
+PACK_RECORD = struct.Struct('<QIIII')
+# crc-32 of the name, record index + 1, 0 for an empty slot
+PACK_SLOT = struct.Struct('<II')
+
+
+def channelHash(channel):
+    return zlib.crc32(channel.encode('utf-8')) & 0xffffffff
+
+
+def copyFileRange(src, dst, offset, length):
+    # in kernel (or reflink) copy where available, else copyRange()
+    if hasattr(os, 'copy_file_range'):
+        dst.flush()
+        inFd, outFd = src.fileno(), dst.fileno()
+        outOffset = dst.tell()
+        try:
+            while length > 0:
+                n = os.copy_file_range(inFd, outFd, length, offset, outOffset)
+                if not n:
+                    break
+                offset += n
+                outOffset += n
+                length -= n
+        except OSError:
+            pass
+        dst.seek(outOffset)
+        if not length:
+            return
+    copyRange(src, dst, offset, length)
+
+
+def packSegments(layout, sources=(), channels=()):
+    '''
+    yield (channel, signing block, eocd) of channel variants of the base
+    layout, from existing apks sharing its prefix and central directory
+    and from channel names stamped like generate
+    '''
+    for apk in sources:
+        with ApkView(apk) as v:
+            sections = v.sections
+            block = v.findSigningBlock()
+            blockOffset = sections.cdStartOffset - len(block)
+            if blockOffset != layout.blockOffset or \
+                    v.centralDirectory() != layout.cd:
+                raise ZipFormatException(
+                    'Not a channel variant of the base apk: {}'.format(apk))
+            values = parseValues(parseApkSigningBlock(block, PLUGIN_BLOCK_ID))
+            channel = values.get(PLUGIN_CHANNEL_KEY) if values else None
+            if not channel:
+                raise MagicNotFoundException(
+                    'No channel found in apk: {}'.format(apk))
+            cdEndOffset = sections.cdStartOffset + sections.cdSizeBytes
+            yield channel, block.tobytes(), v.view[cdEndOffset:].tobytes()
+    for channel in channels:
+        tail = layout.makeTail({PLUGIN_CHANNEL_KEY: channel})
+        blockSize = len(tail) - len(layout.cd) - len(layout.eocd)
+        yield channel, tail[:blockSize], tail[blockSize + len(layout.cd):]
+
+
+def writePack(output, base, sources=(), channels=()):
+    '''
+    pack the channel variants of base into output, the entries section
+    and the central directory are stored once, each channel only adds
+    its signing block and eocd, returns the number of channels
+
+      PACK LAYOUT
+      header | prefix | central directory | segments (signing block +
+      eocd) per channel | records | hash table by channel | names
+    '''
+    layout = readLayout(base)
+    temp = output + '.tmp'
+    try:
+        count = writePackFile(temp, base, layout, sources, channels)
+        os.replace(temp, output)
+        return count
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def writePackFile(output, base, layout, sources, channels):
+    # body of writePack(), leaves a partial file behind on errors
+    records = []
+    names = []
+    seen = set()
+    namesSize = 0
+    with open(base, 'rb') as src, open(output, 'wb') as f:
+        f.write(b'\0' * PACK_HEADER.size)
+        prefixOffset = f.tell()
+        copyFileRange(src, f, 0, layout.blockOffset)
+        cdOffset = f.tell()
+        f.write(layout.cd)
+        for channel, block, eocd in packSegments(layout, sources, channels):
+            if channel in seen:
+                raise ValueError('Duplicate channel: {}'.format(channel))
+            seen.add(channel)
+            name = channel.encode('utf-8')
+            records.append((f.tell(), len(block), len(eocd),
+                            namesSize, len(name)))
+            names.append(name)
+            namesSize += len(name)
+            f.write(block)
+            f.write(eocd)
+        recordsOffset = f.tell()
+        for record in records:
+            f.write(PACK_RECORD.pack(*record))
+        # open addressing, at most half full
+        slots = 1
+        while slots < len(records) * 2:
+            slots *= 2
+        table = [(0, 0)] * slots
+        for i, name in enumerate(names):
+            h = zlib.crc32(name) & 0xffffffff
+            slot = h & (slots - 1)
+            while table[slot][1]:
+                slot = (slot + 1) & (slots - 1)
+            table[slot] = (h, i + 1)
+        tableOffset = f.tell()
+        f.write(b''.join(PACK_SLOT.pack(*t) for t in table))
+        namesOffset = f.tell()
+        f.write(b''.join(names))
+        f.seek(0)
+        f.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, len(records),
+                                 prefixOffset, layout.blockOffset,
+                                 cdOffset, len(layout.cd), recordsOffset,
+                                 tableOffset, slots, namesOffset, namesSize))
+    return len(records)
+
+
+class ChannelPack(object):
+    '''
+    read-only channel pack, lookup by channel name is one hash table
+    probe on a mmap of the pack, apks are rebuilt with ranged copies
+
+        with ChannelPack('release.apkpack') as pack:
+            pack.extract('Google_Market', 'app-Google_Market.apk')
+    '''
+
+    def __init__(self, path):
+        import mmap
+        self.path = path
+        self.f = open(path, 'rb')
+        self.mm = None
+        try:
+            size = os.fstat(self.f.fileno()).st_size
+            if size < PACK_HEADER.size:
+                raise ZipFormatException(
+                    'File too small for channel pack: {}'.format(size))
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, version, self.count, self.prefixOffset,
+             self.prefixSize, self.cdOffset, self.cdSize, self.recordsOffset,
+             self.tableOffset, self.slots, self.namesOffset,
+             self.namesSize) = PACK_HEADER.unpack_from(self.mm, 0)
+            if magic != PACK_MAGIC:
+                raise MagicNotFoundException('Channel pack magic not found')
+            if version != PACK_VERSION:
+                raise ZipFormatException(
+                    'Unsupported channel pack version: {}'.format(version))
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, channel):
+        return self.find(channel) is not None
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.f.close()
+
+    def record(self, index):
+        return PACK_RECORD.unpack_from(
+            self.mm, self.recordsOffset + index * PACK_RECORD.size)
+
+    def name(self, record):
+        start = self.namesOffset + record[3]
+        return self.mm[start:start + record[4]].decode('utf-8')
+
+    def channels(self):
+        # channel names in pack order
+        return [self.name(self.record(i)) for i in range(self.count)]
+
+    def find(self, channel):
+        # record of channel or None
+        if not self.slots:
+            return None
+        h = channelHash(channel)
+        mask = self.slots - 1
+        slot = h & mask
+        while True:
+            sh, index = PACK_SLOT.unpack_from(
+                self.mm, self.tableOffset + slot * PACK_SLOT.size)
+            if not index:
+                return None
+            if sh == h:
+                record = self.record(index - 1)
+                if self.name(record) == channel:
+                    return record
+            slot = (slot + 1) & mask
+
+    def size(self, record):
+        return self.prefixSize + record[1] + self.cdSize + record[2]
+
+    def extract(self, channel, output):
+        '''
+        write the apk of channel to output, prefix and central directory
+        are copied from the pack in the kernel where possible
+        '''
+        record = self.find(channel)
+        if record is None:
+            raise KeyError('Channel not in pack: {}'.format(channel))
+        segmentOffset, blockSize, eocdSize = record[:3]
+        eocd = bytearray(self.mm[segmentOffset + blockSize:
+                                 segmentOffset + blockSize + eocdSize])
+        with open(output, 'wb') as f:
+            copyFileRange(self.f, f, self.prefixOffset, self.prefixSize)
+            f.write(self.mm[segmentOffset:segmentOffset + blockSize])
+            copyFileRange(self.f, f, self.cdOffset, self.cdSize)
+            f.write(eocd)
+        return output
+
+
+def packMain(prog, args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='{} pack'.format(prog),
+        description='channel pack: one base apk plus per channel deltas')
+    sub = parser.add_subparsers(dest='action')
+    p = sub.add_parser('create', help='pack channel apks of one base')
+    p.add_argument('pack', help='output pack file ({})'.format(PACK_EXT))
+    p.add_argument('-b', '--base', required=True, help='signed base apk')
+    p.add_argument('-c', '--channels',
+                   help='@file in markets.txt format or ch1,ch2,ch3')
+    p.add_argument('sources', nargs='*',
+                   help='channel apks of base: files, directories, '
+                   'glob patterns or @list')
+    p = sub.add_parser('list', help='channels and apk sizes in a pack')
+    p.add_argument('pack')
+    p = sub.add_parser('extract', help='rebuild channel apks')
+    p.add_argument('pack')
+    p.add_argument('-c', '--channels',
+                   help='@file or ch1,ch2,ch3 (default: all)')
+    p.add_argument('-o', '--output', default='output',
+                   help='output directory (default: output)')
+    opts = parser.parse_args(args)
+    if not opts.action:
+        parser.error('missing action')
+    if opts.action == 'create':
+        if not opts.channels and not opts.sources:
+            parser.error('channels or sources required')
+        channels = readChannels(opts.channels) if opts.channels else ()
+        ts = time.time()
+        try:
+            count = writePack(opts.pack, opts.base,
+                              findApks(opts.sources), channels)
+        except (IOError, ValueError, ZipFormatException,
+                SignatureNotFoundException, MagicNotFoundException) as e:
+            print('Failed {}: {}: {}'.format(
+                opts.pack, type(e).__name__, e), file=sys.stderr)
+            return 1
+        print('Packed {} channels into {} ({} bytes) in {:.2f}s'.format(
+            count, opts.pack, os.path.getsize(opts.pack), time.time() - ts))
+        return 0
+    with ChannelPack(opts.pack) as pack:
+        if opts.action == 'list':
+            for i in range(len(pack)):
+                record = pack.record(i)
+                print('{}\t{}'.format(pack.name(record), pack.size(record)))
+            return 0
+        if not os.path.isdir(opts.output):
+            os.makedirs(opts.output)
+        baseName = os.path.splitext(os.path.basename(opts.pack))[0]
+        channels = readChannels(opts.channels) if opts.channels \
+            else pack.channels()
+        failed = 0
+        for channel in channels:
+            # names come from the pack file, escape them like readChannels
+            # so no channel can write outside the output directory
+            path = os.path.join(opts.output, u'{}-{}.apk'.format(
+                baseName, channelFileName(channel)))
+            try:
+                pack.extract(channel, path)
+                print('Extracting {}'.format(os.path.basename(path)))
+            except Exception as e:
+                failed += 1
+                print('Failed {}: {}: {}'.format(
+                    channel, type(e).__name__, e), file=sys.stderr)
+        return 1 if failed else 0
+
+#####################################################################
+
+
+DIGEST_ALGORITHMS = ('sha256', 'sha1', 'md5')
+
+
+def hashViews(views, algorithms=DIGEST_ALGORITHMS):
+    # one hasher per algorithm fed with all views, hashlib releases the GIL
+    # so the algorithms run side by side on a thread each
+    import hashlib
+    import multiprocessing.pool
+    def run(name):
+        h = hashlib.new(name)
+        for view in views:
+            h.update(view)
+        return h
+    if len(algorithms) == 1:
+        return [run(algorithms[0])]
+    pool = multiprocessing.pool.ThreadPool(len(algorithms))
+    try:
+        return pool.map(run, algorithms)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class PrefixDigest(object):
+    '''
+    hash state of a base apk up to its APK Signing Block, channel
+    variants share these bytes, so each variant only hashes its
+    signing block, central directory and eocd on a copy of the state,
+    a variant with the same block offset and central directory is taken
+    to share the entries bytes, they are not read again
+    '''
+
+    def __init__(self, apk, algorithms=DIGEST_ALGORITHMS):
+        self.algorithms = tuple(algorithms)
+        with ApkView(apk) as v:
+            self.blockOffset = v.findSigningBlockOffset()
+            self.cd = v.centralDirectory().tobytes()
+            prefix = v.view[:self.blockOffset]
+            try:
+                self.hashers = hashViews([prefix], self.algorithms)
+            finally:
+                prefix.release()
+
+    def digest(self, apk):
+        '''
+        {algorithm: hexdigest} of apk and whether the shared prefix was
+        used, apks with a different entries section are hashed in full
+        '''
+        with ApkView(apk) as v:
+            try:
+                shared = v.findSigningBlockOffset() == self.blockOffset and \
+                    v.centralDirectory() == self.cd
+            except (ZipFormatException, SignatureNotFoundException):
+                shared = False
+            if shared:
+                hashers = [h.copy() for h in self.hashers]
+                tail = v.view[self.blockOffset:]
+                for h in hashers:
+                    h.update(tail)
+                tail.release()
+            else:
+                hashers = hashViews([v.view], self.algorithms)
+        return dict((a, h.hexdigest())
+                    for a, h in zip(self.algorithms, hashers)), shared
+
+
+def digestChannels(base, apks, algorithms=DIGEST_ALGORITHMS, full=False):
+    '''
+    yield one dict per apk with path, size, shared and a hexdigest per
+    algorithm, the entries section of base is read once and reused for
+    all variants with the same layout (see PrefixDigest), with full
+    every apk is hashed in full
+    '''
+    algorithms = tuple(algorithms)
+    prefix = None if full else PrefixDigest(base, algorithms)
+    for apk in apks:
+        result = dict.fromkeys(('path', 'size', 'shared', 'error') +
+                               algorithms)
+        result['path'] = apk
+        try:
+            result['size'] = os.path.getsize(apk)
+            if prefix is None:
+                with ApkView(apk) as v:
+                    hashers = hashViews([v.view], algorithms)
+                digests = dict((a, h.hexdigest())
+                               for a, h in zip(algorithms, hashers))
+                result['shared'] = False
+            else:
+                digests, result['shared'] = prefix.digest(apk)
+            result.update(digests)
+        except Exception as e:
+            result['error'] = '{}: {}'.format(type(e).__name__, e)
+        yield result
+
+
+def manifestMain(prog, args):
+    import argparse
+    import csv
+    import json
+    parser = argparse.ArgumentParser(
+        prog='{} manifest'.format(prog),
+        description='digest manifest of channel apks sharing one base')
+    parser.add_argument('sources', nargs='+',
+                        help='apk files, directories, glob patterns '
+                        'or @list files (@- for stdin)')
+    parser.add_argument('-b', '--base',
+                        help='base apk (default: first apk found)')
+    parser.add_argument('--full', action='store_true',
+                        help='hash every apk in full instead of reusing '
+                        'the entries section of the base for variants '
+                        'with the same layout')
+    parser.add_argument('-a', '--algorithms',
+                        default=','.join(DIGEST_ALGORITHMS),
+                        help='hashlib names (default: sha256,sha1,md5)')
+    parser.add_argument('-f', '--format', choices=('json', 'csv'),
+                        default='json',
+                        help='output format (default: json lines)')
+    parser.add_argument('-o', '--output',
+                        help='output file (default: stdout)')
+    opts = parser.parse_args(args)
+    algorithms = tuple(a.strip() for a in opts.algorithms.split(',')
+                       if a.strip())
+    apks = findApks(opts.sources)
+    base = opts.base
+    if not base:
+        first = next(apks, None)
+        if first is None:
+            parser.error('no apk found')
+        base = first
+        apks = itertools.chain([first], apks)
+    fields = ('path', 'size') + algorithms + ('shared', 'error')
+    out = io.open(opts.output, 'w', encoding='utf-8', newline='') \
+        if opts.output else sys.stdout
+    errors = 0
+    try:
+        if opts.format == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(fields)
+        for result in digestChannels(base, apks, algorithms, opts.full):
+            if result['error']:
+                errors += 1
+            if opts.format == 'csv':
+                writer.writerow([result[k] for k in fields])
+            else:
+                out.write(json.dumps(result, sort_keys=True) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if errors else 0
+
+#####################################################################
+
+
+VERIFY_CHUNK_SIZE = 0x100000  # 1m
+
+
+def listEntries(apk):
+    # (name, localHeaderOffset, compressType, compressSize, crc) by offset
+    import zipfile
+    zp = zipfile.ZipFile(apk)
+    try:
+        return sorted(((i.filename, i.header_offset, i.compress_type,
+                        i.compress_size, i.CRC) for i in zp.infolist()),
+                      key=lambda e: e[1])
+    finally:
+        zp.close()
+
+
+def checkEntry(view, entry):
+    # inflate and crc-32 one entry in place, return its name if corrupt
+    import zipfile
+    name, offset, compressType, compressSize, crc = entry
+    d = ByteDecoder(view)
+    if d.getUInt(offset) != ZIP_LFH_SIG:
+        return name
+    start = offset + ZIP_LFH_MIN_SIZE + \
+        d.getUShort(offset + ZIP_LFH_NAME_LENGTH_FIELD_OFFSET) + \
+        d.getUShort(offset + ZIP_LFH_EXTRA_LENGTH_FIELD_OFFSET)
+    data = view[start:start + compressSize]
+    try:
+        if len(data) != compressSize:
+            return name
+        actual = 0
+        if compressType == zipfile.ZIP_STORED:
+            actual = zlib.crc32(data)
+        elif compressType == zipfile.ZIP_DEFLATED:
+            z = zlib.decompressobj(-zlib.MAX_WBITS)
+            for i in range(0, compressSize, VERIFY_CHUNK_SIZE):
+                actual = zlib.crc32(
+                    z.decompress(data[i:i + VERIFY_CHUNK_SIZE]), actual)
+            actual = zlib.crc32(z.flush(), actual)
+        else:
+            raise ZipFormatException(
+                "Unsupported compression method {} for file '{}'"
+                .format(compressType, name))
+        return name if actual & 0xffffffff != crc else None
+    except zlib.error:
+        return name
+    finally:
+        data.release()
+
+
+def verifyApk(apk, jobs=None):
+    '''
+    crc-32 check all zip entries with a pool of jobs threads sharing
+    one mmap of the apk, zlib releases the GIL while inflating
+    '''
+    import multiprocessing.pool
+    ts = time.time()
+    entries = listEntries(apk)
+    total = sum(e[3] for e in entries)
+    corrupt = None
+    with ApkView(apk) as v:
+        check = functools.partial(checkEntry, v.view)
+        if jobs == 1:
+            results = (check(e) for e in entries)
+            pool = None
+        else:
+            pool = multiprocessing.pool.ThreadPool(jobs)
+            results = pool.imap(check, entries, 16)
+        try:
+            # in archive order, so the first corrupt entry is reported
+            for name in results:
+                if name:
+                    corrupt = name
+                    break
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+    elapsed = time.time() - ts
+    return {
+        'path': apk,
+        'entries': len(entries),
+        'bytes': total,
+        'corrupt': corrupt,
+        'elapsed_ms': round(elapsed * 1000, 3),
+        'mbps': round(total / 1048576.0 / elapsed, 2) if elapsed else None,
+    }
+
+
+def verifyMain(prog, args):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='{} verify'.format(prog),
+        description='check crc-32 of all zip entries in parallel')
+    parser.add_argument('apks', nargs='+', help='apk files')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker threads (default: cpu count)')
+    parser.add_argument('--v2', action='store_true',
+                        help='check the APK Signature Scheme v2 '
+                        'signature instead of crc-32')
+    opts = parser.parse_args(args)
+    if opts.v2:
+        return verifyV2Main(opts)
+    failed = 0
+    for apk in opts.apks:
+        try:
+            r = verifyApk(apk, opts.jobs)
+        except Exception as e:
+            failed += 1
+            print('ERROR\t{}\t{}: {}'.format(apk, type(e).__name__, e))
+            continue
+        if r['corrupt']:
+            failed += 1
+            print('CORRUPT\t{}\t{}'.format(apk, r['corrupt']))
+        else:
+            print('OK\t{}\t{} entries, {:.1f} MB in {:.0f} ms ({} MB/s)'
+                  .format(apk, r['entries'], r['bytes'] / 1048576.0,
+                          r['elapsed_ms'], r['mbps']))
+    return 1 if failed else 0
+
+
+def verifyV2Main(opts):
+    failed = 0
+    for apk in opts.apks:
+        try:
+            r = verifyV2(apk, opts.jobs)
+        except Exception as e:
+            failed += 1
+            print('ERROR\t{}\t{}: {}'.format(apk, type(e).__name__, e))
+            continue
+        t = r['timings']
+        if not r['verified']:
+            failed += 1
+            print('FAILED\t{}\t{}'.format(apk, '; '.join(r['errors'])))
+            continue
+        print('OK\t{}\tv2 {} signer(s), {}{}, entries {:.0f} ms, '
+              'cd {:.1f} ms, eocd {:.1f} ms, total {:.0f} ms'
+              .format(apk, r['signers'], ','.join(sorted(r['digests'])),
+                      '' if r['signatures'] else
+                      ' (signatures not checked, cryptography missing)',
+                      t['entries'], t['cd'], t['eocd'], t['total']))
+    return 1 if failed else 0
+
+#####################################################################
+
+
+# signature algorithm id -> (content digest, signature scheme)
+V2_SIGNATURE_ALGORITHMS = {
+    0x0101: ('sha256', 'rsa-pss'),
+    0x0102: ('sha512', 'rsa-pss'),
+    0x0103: ('sha256', 'rsa-pkcs1'),
+    0x0104: ('sha512', 'rsa-pkcs1'),
+    0x0201: ('sha256', 'ecdsa'),
+    0x0202: ('sha512', 'ecdsa'),
+    0x0301: ('sha256', 'dsa'),
+}
+
+V2_CHUNK_SIZE = 0x100000  # 1m
+V2_CHUNK_PREFIX = b'\xa5'
+V2_DIGEST_PREFIX = b'\x5a'
+
+
+def readLengthPrefixed(buf, offset, what):
+    # (value, next offset) of an uint32 length prefixed value
+    if len(buf) - offset < 4:
+        raise SignatureNotFoundException(
+            "Insufficient data to read length of {}".format(what))
+    size = UINT32.unpack_from(buf, offset)[0]
+    start = offset + 4
+    if size > len(buf) - start:
+        raise SignatureNotFoundException(
+            "{} length out of range: {}, available: {}"
+            .format(what, size, len(buf) - start))
+    return buf[start:start + size], start + size
+
+
+def readSequence(buf, what):
+    # all values of a sequence of length prefixed values
+    items = []
+    position = 0
+    while position < len(buf):
+        item, position = readLengthPrefixed(buf, position, what)
+        items.append(item)
+    return items
+
+
+def readAlgorithmValues(buf, what):
+    # [(algorithm id, value)] of a sequence of digests or signatures
+    pairs = []
+    for item in readSequence(buf, what):
+        if len(item) < 8:
+            raise SignatureNotFoundException(
+                "{} record too short: {}".format(what, len(item)))
+        value, _ = readLengthPrefixed(item, 4, what)
+        pairs.append((UINT32.unpack_from(item, 0)[0], value))
+    return pairs
+
+
+def parseV2Signers(value):
+    '''
+    signers of an APK Signature Scheme v2 block value, each one a dict
+    of signedData, digests, certificates, signatures and publicKey
+    https://source.android.com/security/apksigning/v2
+    '''
+    value = bytes(value)
+    signersBuf, _ = readLengthPrefixed(value, 0, 'signers')
+    signers = []
+    for signer in readSequence(signersBuf, 'signer'):
+        signedData, position = readLengthPrefixed(signer, 0, 'signed data')
+        signatures, position = readLengthPrefixed(
+            signer, position, 'signatures')
+        publicKey, _ = readLengthPrefixed(signer, position, 'public key')
+        digests, position = readLengthPrefixed(signedData, 0, 'digests')
+        certificates, _ = readLengthPrefixed(
+            signedData, position, 'certificates')
+        signers.append({
+            'signedData': signedData,
+            'digests': readAlgorithmValues(digests, 'digest'),
+            'certificates': readSequence(certificates, 'certificate'),
+            'signatures': readAlgorithmValues(signatures, 'signature'),
+            'publicKey': publicKey,
+        })
+    return signers
+
+
+def findV2Block(v):
+    # value of the APK Signature Scheme v2 block of an ApkView
+    value = v.blockIndex().get(APK_SIGNATURE_SCHEME_V2_BLOCK_ID)
+    if value is not None:
+        return value
+    raise SignatureNotFoundException(
+        'No APK Signature Scheme v2 block in APK Signing Block')
+
+
+def digestChunks(pool, view, algorithms, chunkSize=V2_CHUNK_SIZE):
+    # [[digest per algorithm]] of all chunks of view, in order
+    import hashlib
+    def run(start):
+        chunk = view[start:start + chunkSize]
+        try:
+            prefix = V2_CHUNK_PREFIX + UINT32.pack(len(chunk))
+            digests = []
+            for name in algorithms:
+                h = hashlib.new(name, prefix)
+                h.update(chunk)
+                digests.append(h.digest())
+            return digests
+        finally:
+            chunk.release()
+    return pool.map(run, range(0, len(view), chunkSize))
+
+
+def computeContentDigests(v, algorithms, jobs=None):
+    '''
+    1m chunked digests of the entries, central directory and eocd of an
+    ApkView, the eocd central directory offset is replaced by the APK
+    Signing Block offset, chunks are hashed by a pool of jobs threads
+
+    returns ({algorithm: digest}, {section: ms})
+    '''
+    import hashlib
+    import multiprocessing.pool
+    sections = v.sections
+    if sections.zip64EocdOffset is not None:
+        raise ZipFormatException(
+            'ZIP64 APK not supported by APK Signature Scheme v2')
+    blockOffset = v.findSigningBlockOffset()
+    eocd = bytearray(v.view[sections.eocdOffset:])
+    struct.pack_into('<I', eocd, ZIP_EOCD_CENTRAL_DIR_OFFSET_FIELD_OFFSET,
+                     blockOffset)
+    parts = (('entries', v.view[:blockOffset]),
+             ('cd', v.centralDirectory()),
+             ('eocd', memoryview(bytes(eocd))))
+    algorithms = tuple(algorithms)
+    chunks = []
+    timings = {}
+    pool = multiprocessing.pool.ThreadPool(jobs)
+    try:
+        for name, view in parts:
+            ts = time.time()
+            chunks.extend(digestChunks(pool, view, algorithms))
+            timings[name] = round((time.time() - ts) * 1000, 3)
+    finally:
+        pool.terminate()
+        pool.join()
+        for _, view in parts:
+            view.release()
+    digests = {}
+    for i, name in enumerate(algorithms):
+        h = hashlib.new(name, V2_DIGEST_PREFIX + UINT32.pack(len(chunks)))
+        for c in chunks:
+            h.update(c[i])
+        digests[name] = h.digest()
+    return digests, timings
+
+
+def verifySignature(publicKey, algorithmId, signedData, signature):
+    '''
+    check signature of signedData, None if cryptography is not installed
+    '''
+    try:
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec, padding
+    except ImportError:
+        return None
+    digest, scheme = V2_SIGNATURE_ALGORITHMS[algorithmId]
+    algorithm = hashes.SHA512() if digest == 'sha512' else hashes.SHA256()
+    key = serialization.load_der_public_key(publicKey)
+    try:
+        if scheme == 'rsa-pss':
+            key.verify(signature, signedData,
+                       padding.PSS(padding.MGF1(algorithm),
+                                   algorithm.digest_size), algorithm)
+        elif scheme == 'rsa-pkcs1':
+            key.verify(signature, signedData, padding.PKCS1v15(), algorithm)
+        elif scheme == 'ecdsa':
+            key.verify(signature, signedData, ec.ECDSA(algorithm))
+        else:
+            key.verify(signature, signedData, algorithm)
+        return True
+    except InvalidSignature:
+        return False
+
+
+def certificateKey(certificate):
+    # SubjectPublicKeyInfo of a DER certificate, None without cryptography
+    try:
+        from cryptography import x509
+        from cryptography.hazmat.primitives import serialization
+    except ImportError:
+        return None
+    return x509.load_der_x509_certificate(certificate).public_key() \
+        .public_bytes(serialization.Encoding.DER,
+                      serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+def verifyV2(apk, jobs=None):
+    '''
+    verify the APK Signature Scheme v2 signature of apk, like apksigner:
+    signatures over signed data (needs the optional cryptography package,
+    skipped otherwise), certificate public key and content digests
+
+    returns a dict with path, verified, signers, signatures (True, False
+    or None if not checked), digests, errors and per-section timings
+    '''
+    ts = time.time()
+    errors = []
+    result = {'path': apk, 'verified': False, 'signers': 0,
+              'signatures': None, 'digests': {}, 'errors': errors,
+              'timings': {}}
+    with ApkView(apk) as v:
+        signers = parseV2Signers(findV2Block(v))
+        result['signers'] = len(signers)
+        if not signers:
+            errors.append('No signers')
+        expected = {}
+        for n, signer in enumerate(signers):
+            signatures = [(a, s) for a, s in signer['signatures']
+                          if a in V2_SIGNATURE_ALGORITHMS]
+            if not signatures:
+                errors.append('Signer #{}: no supported signatures'
+                              .format(n + 1))
+                continue
+            for algorithmId, signature in signatures:
+                ok = verifySignature(signer['publicKey'], algorithmId,
+                                     signer['signedData'], signature)
+                if ok is False:
+                    errors.append('Signer #{}: bad signature {:#06x}'
+                                  .format(n + 1, algorithmId))
+                    result['signatures'] = False
+                elif ok and result['signatures'] is None:
+                    result['signatures'] = True
+            if [a for a, _ in signer['signatures']] != \
+                    [a for a, _ in signer['digests']]:
+                errors.append('Signer #{}: signature and digest algorithms '
+                              'do not match'.format(n + 1))
+            if not signer['certificates']:
+                errors.append('Signer #{}: no certificates'.format(n + 1))
+            else:
+                key = certificateKey(signer['certificates'][0])
+                if key is not None and key != signer['publicKey']:
+                    errors.append('Signer #{}: public key does not match '
+                                  'certificate'.format(n + 1))
+            for algorithmId, digest in signer['digests']:
+                if algorithmId in V2_SIGNATURE_ALGORITHMS:
+                    name = V2_SIGNATURE_ALGORITHMS[algorithmId][0]
+                    if expected.setdefault(name, digest) != digest:
+                        errors.append('Signer #{}: {} digest differs from '
+                                      'other signers'.format(n + 1, name))
+        if expected:
+            actual, result['timings'] = computeContentDigests(
+                v, sorted(expected), jobs)
+            for name, digest in sorted(expected.items()):
+                result['digests'][name] = actual[name] == digest
+                if actual[name] != digest:
+                    errors.append('{} content digest mismatch'.format(name))
+    result['timings']['total'] = round((time.time() - ts) * 1000, 3)
+    result['verified'] = not errors
+    return result
+
+
+#####################################################################
+
+
+COMMANDS = {
+    'batch': batchMain,
+    'write': writeMain,
+    'generate': generateMain,
+    'verify': verifyMain,
+    'index': indexMain,
+    'manifest': manifestMain,
+    'serve': serveMain,
+    'pack': packMain,
+    'worker': workerMain,
+}
+
 
 def main():
+    logging.basicConfig(
+        format='%(levelname)s:%(lineno)s: %(funcName)s() %(message)s',
+        level=logging.ERROR)
     logger.debug('AUTHOR:%s', AUTHOR)
-    logger.debug('VERSION:%s', VERSION)
+    logger.debug('VERSION:%s', getVersion())
     prog = os.path.basename(sys.argv[0])
     if len(sys.argv) < 2:
         print('Usage: {} app.apk'.format(prog))
+        print('       {} batch [options] apk|dir|glob|@list ...'.format(prog))
+        print('       {} write [options] apk channel'.format(prog))
+        print('       {} generate [options] -c @markets.txt apk'.format(prog))
+        print('       {} verify [options] apk ...'.format(prog))
+        print('       {} index [options] refresh|find|show ...'.format(prog))
+        print('       {} manifest [options] apk|dir|glob|@list ...'.format(prog))
+        print('       {} serve [options] apk ...'.format(prog))
+        print('       {} pack create|list|extract ...'.format(prog))
+        print('       {} worker [options] < requests'.format(prog))
         sys.exit(1)
-    apk = os.path.abspath(sys.argv[1])
+    command = COMMANDS.get(sys.argv[1])
+    if command:
+        sys.exit(command(prog, sys.argv[2:]))
+    apk = sys.argv[1]
+    if not isUrl(apk):
+        apk = os.path.abspath(apk)
     channel = getChannel(apk)
     print('Channel: \t{}'.format(channel))
     showInfo(apk)